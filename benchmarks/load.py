@@ -0,0 +1,167 @@
+import argparse
+import http.client
+import json
+import random
+import sys
+import tempfile
+import threading
+import time
+import urllib.parse
+from collections import defaultdict
+from pathlib import Path
+
+from benchmarks.results import add_output_arguments, finish, make_report, percentile, result
+from benchmarks.seed import make_database
+
+READS = ('list_news', 'get_news', 'list_comments')
+WRITES = ('add_news', 'add_comment')
+
+
+def make_request(kind: str, rng: random.Random, news_count: int):
+    """
+    A request of a kind to a random news
+    :param kind: one of READS or WRITES
+    :param rng:
+    :param news_count: news ids are 1 to news_count
+    :return: method, path and body
+    """
+    news_id = rng.randint(1, news_count)
+    if kind == 'list_news':
+        return 'GET', '/news/', None
+    if kind == 'get_news':
+        return 'GET', '/news/{}/'.format(news_id), None
+    if kind == 'list_comments':
+        return 'GET', '/news/{}/comments/'.format(news_id), None
+    if kind == 'add_news':
+        return 'POST', '/news/', json.dumps({'title': 'Load test', 'content': 'Load test content'}).encode()
+    return 'POST', '/news/{}/comments/'.format(news_id), json.dumps({'content': 'Load test comment'}).encode()
+
+
+class Client(threading.Thread):
+    """
+    Sends requests one after another on a kept alive connection until the deadline
+    """
+    def __init__(self, host: str, port: int, deadline: float, write_ratio: float, news_count: int, seed: int):
+        super().__init__(daemon=True)
+        self.host = host
+        self.port = port
+        self.deadline = deadline
+        self.write_ratio = write_ratio
+        self.news_count = news_count
+        self.rng = random.Random(seed)
+        self.latencies = defaultdict(list)  # kind -> seconds
+        self.errors = 0
+
+    def run(self):
+        conn = http.client.HTTPConnection(self.host, self.port, timeout=30)
+        while time.monotonic() < self.deadline:
+            kind = self.rng.choice(WRITES if self.rng.random() < self.write_ratio else READS)
+            method, path, body = make_request(kind, self.rng, self.news_count)
+            started = time.perf_counter()
+            try:
+                conn.request(method, path, body)
+                response = conn.getresponse()
+                response.read()
+            except (OSError, http.client.HTTPException):
+                self.errors += 1
+                conn.close()
+                conn = http.client.HTTPConnection(self.host, self.port, timeout=30)
+                continue
+            self.latencies[kind].append(time.perf_counter() - started)
+            if response.status >= 400:
+                self.errors += 1
+        conn.close()
+
+
+def count_news(host: str, port: int) -> int:
+    """
+    The id of the newest news, requests pick news ids up to it
+    """
+    conn = http.client.HTTPConnection(host, port, timeout=30)
+    conn.request('GET', '/news/?limit=1')
+    page = json.loads(conn.getresponse().read().decode())
+    conn.close()
+    return page[0]['id'] if page else 1
+
+
+def start_local_server(rows: int, workers: int, directory: str):
+    """
+    Starts the http.server engine in this process, on a free port and a seeded database
+    :return: server and its thread
+    """
+    from news_restapi import settings
+    settings.DB_PATH = str(Path(directory) / 'news.db')
+    print('Seeding {} rows'.format(rows), file=sys.stderr)
+    make_database(rows, settings.DB_PATH).close()
+    # imported once the database path is set
+    from news_restapi.server import RESTRequestHandler, make_server
+
+    class QuietRequestHandler(RESTRequestHandler):
+        def log_message(self, format, *args):
+            pass
+
+    server = make_server(0, workers, QuietRequestHandler)
+    thread = threading.Thread(target=server.serve_forever, args=(0.1,), daemon=True)
+    thread.start()
+    return server, thread
+
+
+def run_load(host: str, port: int, concurrency: int, duration: float, write_ratio: float, seed: int) -> dict:
+    news_count = count_news(host, port)
+    deadline = time.monotonic() + duration
+    clients = [Client(host, port, deadline, write_ratio, news_count, seed + index) for index in range(concurrency)]
+    started = time.perf_counter()
+    for client in clients:
+        client.start()
+    for client in clients:
+        client.join()
+    elapsed = time.perf_counter() - started
+    latencies = defaultdict(list)
+    for client in clients:
+        for kind, values in client.latencies.items():
+            latencies[kind].extend(values)
+    total = sum(len(values) for values in latencies.values())
+    results = {
+        'requests_per_second': result(total / elapsed, 'requests/s', 'higher'),
+        'errors': result(sum(client.errors for client in clients), 'requests'),
+    }
+    for kind, values in latencies.items():
+        values.sort()
+        for percent in (50, 95, 99):
+            results['{}/p{}'.format(kind, percent)] = result(percentile(values, percent) * 1000, 'ms')
+    return results
+
+
+def main():
+    parser = argparse.ArgumentParser(description='HTTP load generator with a read/write mix')
+    parser.add_argument('--url', help='server to load, e.g. http://localhost:8080, by default one is started '
+                                      'in this process on a seeded temporary database')
+    parser.add_argument('--rows', type=int, default=10000, help='news and comments of the seeded database')
+    parser.add_argument('--workers', type=int, default=8, help='worker threads of the started server')
+    parser.add_argument('--concurrency', type=int, default=8, help='clients sending requests in parallel')
+    parser.add_argument('--duration', type=float, default=10, help='seconds')
+    parser.add_argument('--write-ratio', type=float, default=0.1, help='fraction of requests that are writes')
+    parser.add_argument('--seed', type=int, default=0)
+    add_output_arguments(parser)
+    args = parser.parse_args()
+    with tempfile.TemporaryDirectory() as directory:
+        server = None
+        if args.url:
+            url = urllib.parse.urlsplit(args.url)
+            host, port = url.hostname, url.port or 80
+        else:
+            server, thread = start_local_server(args.rows, args.workers, directory)
+            host, port = '127.0.0.1', server.server_port
+        try:
+            results = run_load(host, port, args.concurrency, args.duration, args.write_ratio, args.seed)
+        finally:
+            if server is not None:
+                server.shutdown()
+                server.server_close()
+    params = {key: value for key, value in vars(args).items() if key not in ('output', 'baseline', 'tolerance')}
+    report = make_report('load', results, params)
+    sys.exit(finish(report, args.output, args.baseline, args.tolerance))
+
+
+if __name__ == '__main__':
+    main()
@@ -0,0 +1,51 @@
+import sqlite3
+import timeit
+from datetime import datetime
+from pathlib import Path, PurePath
+
+from news_restapi.metrics import Metrics
+from news_restapi.migrations import migrate
+from news_restapi.models import News
+from news_restapi.repositories import NewsRepository
+
+
+def make_connection():
+    """
+    An in-memory database with the schema and one news
+    """
+    conn = sqlite3.connect(':memory:', isolation_level=None)
+    with open(Path(__file__).parent.parent / PurePath('db/schema.sql'), 'r') as content_file:
+        conn.executescript(content_file.read())
+    migrate(conn)
+    dt = datetime.now()
+    NewsRepository(connection=conn).add_news(News(id=None, created_date=dt, modified_date=dt, title='T', content='C'))
+    return conn
+
+
+def main():
+    number = 100000
+    metrics = Metrics()
+    observe_request = timeit.timeit(
+        lambda: metrics.observe_request(r'^/news/(?P<pk>\d+)/$', 'GET', 200, 0.002, 512), number=number
+    )
+    observe_query = timeit.timeit(lambda: metrics.observe_query('news', 'get', 0.0001), number=number)
+    print('{:<40} {:>10.2f}'.format('observe_request, us', observe_request * 1e6 / number))
+    print('{:<40} {:>10.2f}'.format('observe_query, us', observe_query * 1e6 / number))
+
+    conn = make_connection()
+    plain = NewsRepository(connection=conn)
+    timed = NewsRepository(connection=conn, metrics=metrics)
+    number = 20000
+    get_plain = timeit.timeit(lambda: plain.get(1), number=number)
+    get_timed = timeit.timeit(lambda: timed.get(1), number=number)
+    print('{:<40} {:>10.2f}'.format('NewsRepository.get, us', get_plain * 1e6 / number))
+    print('{:<40} {:>10.2f}'.format('NewsRepository.get with metrics, us', get_timed * 1e6 / number))
+
+    for index in range(200):
+        metrics.observe_request('^/route{}/$'.format(index), 'GET', 200, 0.002, 512)
+    render = timeit.timeit(metrics.render, number=100)
+    print('{:<40} {:>10.2f}'.format('render 200 routes, ms', render * 1e3 / 100))
+
+
+if __name__ == '__main__':
+    main()
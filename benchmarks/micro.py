@@ -0,0 +1,128 @@
+import argparse
+import io
+import json
+import sys
+import timeit
+from dataclasses import asdict
+from http.client import HTTPMessage
+
+from benchmarks.results import add_output_arguments, finish, make_report, result
+from benchmarks.seed import make_database
+from news_restapi.controllers import NewsController, CommentController
+from news_restapi.repositories import NewsRepository, CommentRepository
+from news_restapi.routing import Router
+from news_restapi.serializers import dumps
+from news_restapi.server import RESTRequestHandler, build_routes, routes
+from news_restapi.utils import datetime_to_timestamp, timestamp_to_datetime
+
+SIZES = (10000, 1000000)
+
+
+class NullFile:
+    def write(self, data):
+        return len(data)
+
+    def flush(self):
+        pass
+
+
+class BenchRequestHandler(RESTRequestHandler):
+    """
+    A request handler run without a socket, the response is written nowhere
+    """
+    metrics = None
+    profiler = None
+
+    def __init__(self, router: Router, path: str):
+        self.router = router
+        self.path = path
+        self.command = 'GET'
+        self.request_version = 'HTTP/1.1'
+        self.requestline = 'GET {} HTTP/1.1'.format(path)
+        self.headers = HTTPMessage()
+        self.rfile = io.BytesIO()
+        self.wfile = NullFile()
+        self.server = None
+        self.close_connection = False
+        self.requests_handled = 0
+
+    def log_message(self, format, *args):
+        pass
+
+
+def measure(function, repeat: int) -> float:
+    """
+    Times a function, calling it enough times to take about 0.2 seconds per round
+    :param function:
+    :param repeat: rounds, the fastest one counts
+    :return: microseconds per call
+    """
+    timer = timeit.Timer(function)
+    number, _ = timer.autorange()
+    return min(timer.repeat(repeat, number)) / number * 1e6
+
+
+def run_core(repeat: int) -> dict:
+    """
+    Benchmarks that do not depend on the database size
+    """
+    conn = make_database(100)
+    page = NewsRepository(connection=conn).list(25)
+    timestamp = datetime_to_timestamp(page[0].created_date)
+    router = Router(routes)
+    benchmarks = {
+        'route_resolve': lambda: router.resolve('GET', '/news/123/comments/456/'),
+        'timestamp_to_datetime': lambda: timestamp_to_datetime(timestamp),
+        'datetime_to_timestamp': lambda: datetime_to_timestamp(page[0].created_date),
+        'serialize_page_asdict_json': lambda: json.dumps([asdict(news) for news in page], default=str),
+        'serialize_page_dumps': lambda: dumps(page),
+    }
+    return {name: result(measure(function, repeat), 'us') for name, function in benchmarks.items()}
+
+
+def run_sized(rows: int, repeat: int) -> dict:
+    """
+    Repository and request handling benchmarks on a database of rows news and comments
+    """
+    print('Seeding {} rows'.format(rows), file=sys.stderr)
+    conn = make_database(rows)
+    news_repository = NewsRepository(connection=conn)
+    comment_repository = CommentRepository(connection=conn)
+    router = Router(build_routes(NewsController(news_repository), CommentController(comment_repository)))
+    middle = rows // 2
+    news_id = conn.execute('SELECT news_id FROM comment WHERE id = ?', (middle,)).fetchone()[0]
+    benchmarks = {
+        'repository_get': lambda: news_repository.get(middle),
+        'repository_list': lambda: news_repository.list(25),
+        'repository_list_deep': lambda: news_repository.list(25, before_id=middle),
+        'repository_comments_for_news': lambda: comment_repository.fetch_comments_for_news(news_id, 25),
+        'repository_search': lambda: news_repository.search_news('rain storm', 25),
+        'handle_method_get_news': lambda: BenchRequestHandler(router, '/news/{}/'.format(middle)).handle_method('GET'),
+        'handle_method_list_news': lambda: BenchRequestHandler(router, '/news/').handle_method('GET'),
+        'handle_method_list_comments': lambda: BenchRequestHandler(
+            router, '/news/{}/comments/'.format(news_id)
+        ).handle_method('GET'),
+    }
+    return {
+        '{}/{}'.format(rows, name): result(measure(function, repeat), 'us') for name, function in benchmarks.items()
+    }
+
+
+def main():
+    parser = argparse.ArgumentParser(description='Micro-benchmarks of the request hot paths')
+    parser.add_argument('--rows', type=int, action='append',
+                        help='news and comments in a seeded database, repeatable (default {})'.format(
+                            ' and '.join(map(str, SIZES))))
+    parser.add_argument('--repeat', type=int, default=3, help='timing rounds, the fastest counts')
+    add_output_arguments(parser)
+    args = parser.parse_args()
+    sizes = args.rows or SIZES
+    results = run_core(args.repeat)
+    for rows in sizes:
+        results.update(run_sized(rows, args.repeat))
+    report = make_report('micro', results, {'rows': list(sizes), 'repeat': args.repeat})
+    sys.exit(finish(report, args.output, args.baseline, args.tolerance))
+
+
+if __name__ == '__main__':
+    main()
@@ -0,0 +1,157 @@
+import argparse
+import http.client
+import json
+import re
+import sys
+import threading
+import time
+import urllib.parse
+from collections import defaultdict
+from concurrent.futures import ThreadPoolExecutor
+from typing import List
+
+from benchmarks.results import add_output_arguments, finish, make_report, percentile, result
+
+PERCENTS = (50, 95, 99)
+
+
+def load_records(path: str) -> List[dict]:
+    """
+    Reads a traffic recording (see news_restapi.recording), oldest request first
+    :param path:
+    :return: records
+    """
+    records = []
+    with open(path) as log_file:
+        for line in log_file:
+            line = line.strip()
+            if not line:
+                continue
+            record = json.loads(line)
+            if isinstance(record, dict) and 'method' in record and 'path' in record:
+                records.append(record)
+    records.sort(key=lambda record: record.get('time', 0))
+    return records
+
+
+def path_template(path: str) -> str:
+    """
+    Groups requests by endpoint: the query string is dropped and numeric segments become :id
+    """
+    return re.sub(r'/\d+(?=/|$)', '/:id', urllib.parse.urlsplit(path).path)
+
+
+class Replayer:
+    """
+    Re-issues recorded requests at their recorded pace divided by speed, each on a kept alive
+    connection of a pool of concurrency threads
+    """
+    def __init__(self, host: str, port: int, speed: float, concurrency: int):
+        self.host = host
+        self.port = port
+        self.speed = speed
+        self.concurrency = concurrency
+        self.local = threading.local()
+        self.lag = []  # seconds requests started late, when the pool could not keep up
+
+    def connection(self) -> http.client.HTTPConnection:
+        conn = getattr(self.local, 'conn', None)
+        if conn is None:
+            conn = self.local.conn = http.client.HTTPConnection(self.host, self.port, timeout=30)
+        return conn
+
+    def send(self, record: dict, scheduled: float):
+        self.lag.append(max(0.0, time.monotonic() - scheduled))
+        body = record['body'].encode() if record.get('body') is not None else None
+        conn = self.connection()
+        started = time.perf_counter()
+        try:
+            conn.request(record['method'], record['path'], body)
+            response = conn.getresponse()
+            response.read()
+        except (OSError, http.client.HTTPException):
+            conn.close()
+            self.local.conn = None
+            return None, None
+        return response.status, time.perf_counter() - started
+
+    def replay(self, records: List[dict]) -> List[tuple]:
+        """
+        :param records:
+        :return: (record, status, seconds) per request, Nones for a failed request
+        """
+        first = records[0].get('time', 0) if records else 0
+        start = time.monotonic()
+        futures = []
+        with ThreadPoolExecutor(max_workers=self.concurrency) as executor:
+            for record in records:
+                scheduled = start
+                if self.speed > 0:
+                    scheduled += (record.get('time', first) - first) / self.speed
+                    delay = scheduled - time.monotonic()
+                    if delay > 0:
+                        time.sleep(delay)
+                futures.append((record, executor.submit(self.send, record, scheduled)))
+        return [(record, *future.result()) for record, future in futures]
+
+
+def summarize(outcomes: List[tuple]) -> dict:
+    """
+    Recorded and replayed latency percentiles per endpoint and over all requests, and their deltas
+    :param outcomes: see Replayer.replay
+    :return: results
+    """
+    recorded, replayed = defaultdict(list), defaultdict(list)
+    failed = mismatched = 0
+    for record, status, seconds in outcomes:
+        if status is None:
+            failed += 1
+            continue
+        if status != record.get('status'):
+            mismatched += 1
+        for group in ('all', '{} {}'.format(record['method'], path_template(record['path']))):
+            replayed[group].append(seconds * 1000)
+            if record.get('latency_ms') is not None:
+                recorded[group].append(record['latency_ms'])
+    results = {
+        'failed': result(failed, 'requests'),
+        'status_mismatches': result(mismatched, 'requests'),
+    }
+    for group, values in replayed.items():
+        values.sort()
+        recorded_values = sorted(recorded[group])
+        results['{}/count'.format(group)] = result(len(values), 'requests', 'higher')
+        for percent in PERCENTS:
+            value = percentile(values, percent)
+            results['{}/p{}'.format(group, percent)] = result(value, 'ms')
+            if recorded_values:
+                delta = value - percentile(recorded_values, percent)
+                results['{}/p{}_delta'.format(group, percent)] = result(delta, 'ms')
+    return results
+
+
+def main():
+    parser = argparse.ArgumentParser(description='Replay a traffic recording against a server')
+    parser.add_argument('recording', help='JSON lines written with NEWS_RECORD_PATH')
+    parser.add_argument('--url', default='http://localhost:8080', help='server to replay against')
+    parser.add_argument('--speed', type=float, default=1.0,
+                        help='pace relative to the recording, 2 replays twice as fast, 0 as fast as possible')
+    parser.add_argument('--concurrency', type=int, default=4,
+                        help='requests in flight at most, each on its own kept alive connection')
+    add_output_arguments(parser)
+    args = parser.parse_args()
+    records = load_records(args.recording)
+    url = urllib.parse.urlsplit(args.url)
+    replayer = Replayer(url.hostname, url.port or 80, args.speed, args.concurrency)
+    print('Replaying {} requests'.format(len(records)), file=sys.stderr)
+    started = time.monotonic()
+    outcomes = replayer.replay(records)
+    results = summarize(outcomes)
+    results['duration'] = result(time.monotonic() - started, 's')
+    results['start_lag/p99'] = result(percentile(sorted(replayer.lag), 99) * 1000, 'ms')
+    params = {'recording': args.recording, 'speed': args.speed, 'concurrency': args.concurrency}
+    sys.exit(finish(make_report('replay', results, params), args.output, args.baseline, args.tolerance))
+
+
+if __name__ == '__main__':
+    main()
@@ -0,0 +1,115 @@
+import json
+import math
+import platform
+import sqlite3
+import sys
+from typing import Dict, List
+
+
+def result(value: float, unit: str, better: str = 'lower') -> dict:
+    """
+    A measurement
+    :param value:
+    :param unit: e.g. 'us' or 'requests/s'
+    :param better: 'lower' or 'higher', the direction of an improvement
+    :return:
+    """
+    return {'value': round(value, 3), 'unit': unit, 'better': better}
+
+
+def percentile(values: List[float], percent: float) -> float:
+    """
+    Nearest-rank percentile
+    :param values: sorted values
+    :param percent: e.g. 99
+    :return: value, 0 for no values
+    """
+    if not values:
+        return 0.0
+    return values[min(len(values) - 1, max(0, math.ceil(percent / 100 * len(values)) - 1))]
+
+
+def make_report(kind: str, results: Dict[str, dict], params: dict) -> dict:
+    """
+    Results with what they were measured on, as written to a JSON file
+    :param kind: e.g. 'micro' or 'load'
+    :param results: measurements by name
+    :param params: benchmark parameters
+    :return: report
+    """
+    return {
+        'kind': kind,
+        'python': platform.python_version(),
+        'sqlite': sqlite3.sqlite_version,
+        'platform': platform.platform(),
+        'params': params,
+        'results': results,
+    }
+
+
+def compare(report: dict, baseline: dict, tolerance: float) -> List[str]:
+    """
+    Finds the results worse than the baseline ones by more than tolerance
+    :param report:
+    :param baseline: a report of the same kind
+    :param tolerance: e.g. 0.1 lets results be 10% worse
+    :return: descriptions of the regressions
+    """
+    regressions = []
+    for name, measured in sorted(report['results'].items()):
+        expected = baseline['results'].get(name)
+        if expected is None or expected['value'] <= 0:
+            continue
+        change = measured['value'] / expected['value'] - 1
+        if measured['better'] == 'higher':
+            change = -change
+        if change > tolerance:
+            regressions.append('{}: {} {} against {} {} ({:+.0%})'.format(
+                name, measured['value'], measured['unit'], expected['value'], expected['unit'], change
+            ))
+    return regressions
+
+
+def print_report(report: dict, baseline: dict = None) -> None:
+    for name, measured in sorted(report['results'].items()):
+        line = '{:<45} {:>12.3f} {}'.format(name, measured['value'], measured['unit'])
+        expected = baseline['results'].get(name) if baseline else None
+        if expected and expected['value']:
+            line += '  ({:+.1%} vs baseline)'.format(measured['value'] / expected['value'] - 1)
+        print(line)
+
+
+def finish(report: dict, output: str = None, baseline_path: str = None, tolerance: float = 0.1) -> int:
+    """
+    Prints a report, writes it as JSON and compares it to a baseline
+    :param report:
+    :param output: JSON file to write, '-' for stdout
+    :param baseline_path: JSON file written by an earlier run
+    :param tolerance: see compare
+    :return: exit status, 1 if there are regressions
+    """
+    baseline = None
+    if baseline_path:
+        with open(baseline_path) as baseline_file:
+            baseline = json.load(baseline_file)
+    if output == '-':
+        json.dump(report, sys.stdout, indent=2, sort_keys=True)
+        print()
+    else:
+        print_report(report, baseline)
+        if output:
+            with open(output, 'w') as output_file:
+                json.dump(report, output_file, indent=2, sort_keys=True)
+    if baseline is None:
+        return 0
+    regressions = compare(report, baseline, tolerance)
+    for regression in regressions:
+        print('Regression: {}'.format(regression), file=sys.stderr)
+    return 1 if regressions else 0
+
+
+def add_output_arguments(parser) -> None:
+    parser.add_argument('--output', help='write the results as JSON to this file, - for stdout')
+    parser.add_argument('--baseline', help='compare the results to a JSON file written by an earlier run')
+    parser.add_argument('--tolerance', type=float, default=0.1,
+                        help='fraction by which a result may be worse than the baseline (default 0.1)')
@@ -0,0 +1,50 @@
+import re
+import timeit
+
+from news_restapi.routing import Router
+
+PATHS = ('/news/', '/news/123/', '/news/123/comments/', '/news/123/comments/456/', '/unknown/')
+
+
+def make_routes(count: int) -> dict:
+    """
+    The API routes plus filler ones, to see how routing scales with the number of endpoints
+    :param count: number of filler routes
+    :return: routes
+    """
+    routes = {
+        r'^/news/$': {'GET': None},
+        r'^/news/(?P<pk>\d+)/$': {'GET': None},
+        r'^/news/(?P<news_pk>\d+)/comments/$': {'GET': None},
+        r'^/news/(?P<news_pk>\d+)/comments/(?P<pk>\d+)/$': {'GET': None},
+    }
+    for index in range(count):
+        routes[r'^/filler{}/(?P<pk>\d+)/$'.format(index)] = {'GET': None}
+    return routes
+
+
+def linear_scan(routes: dict, path: str):
+    """
+    The routing done before Router: a re.match per route
+    """
+    for pattern, route in routes.items():
+        match = re.match(pattern, path)
+        if match:
+            return route, match.groupdict()
+    return None, None
+
+
+def main():
+    number = 20000
+    print('{:>8} {:>14} {:>14}'.format('routes', 'scan, us', 'router, us'))
+    for filler in (0, 10, 50, 200):
+        routes = make_routes(filler)
+        router = Router(routes)
+        scan = timeit.timeit(lambda: [linear_scan(routes, path) for path in PATHS], number=number)
+        compiled = timeit.timeit(lambda: [router.resolve('GET', path) for path in PATHS], number=number)
+        per_lookup = 1e6 / (number * len(PATHS))
+        print('{:>8} {:>14.2f} {:>14.2f}'.format(len(routes), scan * per_lookup, compiled * per_lookup))
+
+
+if __name__ == '__main__':
+    main()
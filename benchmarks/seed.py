@@ -0,0 +1,59 @@
+import random
+import sqlite3
+from pathlib import Path, PurePath
+
+from news_restapi.migrations import migrate
+
+WORDS = (
+    'market', 'city', 'council', 'weather', 'rain', 'storm', 'election', 'vote', 'team', 'match', 'season',
+    'school', 'budget', 'road', 'bridge', 'river', 'festival', 'music', 'film', 'science', 'space', 'energy',
+    'price', 'bank', 'health', 'hospital', 'police', 'court', 'train', 'airport',
+)
+
+
+def make_text(rng: random.Random, words: int) -> str:
+    return ' '.join(rng.choice(WORDS) for _ in range(words)).capitalize()
+
+
+def seed_database(conn, rows: int, seed: int = 0) -> None:
+    """
+    Fills a database created from db/schema.sql with rows news and as many comments, spread over
+    the news, then applies the migrations, so the search index and comment counts are built once
+    rather than row by row by their triggers
+    :param conn: connection in autocommit mode
+    :param rows:
+    :param seed: the same seed gives the same rows
+    :return:
+    """
+    rng = random.Random(seed)
+    # microsecond timestamps a minute apart, the newest news now-ish
+    start = 1600000000 * 1000000
+    conn.execute('BEGIN')
+    conn.executemany(
+        'INSERT INTO news (id, created_date, modified_date, title, content) VALUES (?, ?, ?, ?, ?)',
+        ((index, start + index * 60000000, start + index * 60000000, make_text(rng, 6), make_text(rng, 60))
+         for index in range(1, rows + 1))
+    )
+    conn.executemany(
+        'INSERT INTO comment (id, created_date, modified_date, news_id, content) VALUES (?, ?, ?, ?, ?)',
+        ((index, start + index * 60000000, start + index * 60000000, rng.randint(1, rows), make_text(rng, 20))
+         for index in range(1, rows + 1))
+    )
+    conn.execute('COMMIT')
+    migrate(conn)
+
+
+def make_database(rows: int, path: str = ':memory:', seed: int = 0):
+    """
+    Creates a seeded database
+    :param rows: news, and comments
+    :param path: file path, in memory by default
+    :param seed:
+    :return: connection in autocommit mode
+    """
+    conn = sqlite3.connect(path, isolation_level=None, check_same_thread=False)
+    with open(Path(__file__).parent.parent / PurePath('db/schema.sql'), 'r') as content_file:
+        conn.executescript(content_file.read())
+    seed_database(conn, rows, seed)
+    conn.execute('PRAGMA foreign_keys = ON')
+    return conn
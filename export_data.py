@@ -0,0 +1,28 @@
+import argparse
+import sys
+
+from news_restapi.migrations import migrate_database
+from news_restapi.repositories import get_connection
+from news_restapi.transfer import TransferStats, export_ndjson
+
+
+def export_data():
+    parser = argparse.ArgumentParser(description='Export news and comments as NDJSON')
+    parser.add_argument('output', nargs='?', default='-', help='file to write, - for stdout')
+    args = parser.parse_args()
+    migrate_database()
+    conn = get_connection()
+    stats = TransferStats()
+    output = sys.stdout if args.output == '-' else open(args.output, 'w', encoding='utf-8')
+    try:
+        for line in export_ndjson(conn, stats):
+            output.write(line)
+    finally:
+        if output is not sys.stdout:
+            output.close()
+        conn.close()
+    print('Exported {}'.format(stats), file=sys.stderr)
+
+
+if __name__ == '__main__':
+    export_data()
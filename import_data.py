@@ -0,0 +1,32 @@
+import argparse
+import sys
+
+from news_restapi import exceptions, settings
+from news_restapi.migrations import migrate_database
+from news_restapi.repositories import NewsRepository, get_connection
+from news_restapi.transfer import TransferStats, import_ndjson
+
+
+def import_data():
+    parser = argparse.ArgumentParser(description='Import news and comments from NDJSON made by export_data.py')
+    parser.add_argument('input', nargs='?', default='-', help='file to read, - for stdin')
+    parser.add_argument('--batch-size', type=int, default=settings.IMPORT_BATCH_SIZE,
+                        help='rows committed per transaction')
+    args = parser.parse_args()
+    migrate_database()
+    conn = get_connection()
+    stats = TransferStats()
+    input_file = sys.stdin.buffer if args.input == '-' else open(args.input, 'rb')
+    try:
+        import_ndjson(input_file, NewsRepository(connection=conn).write, args.batch_size, stats)
+    except exceptions.ValidationError as e:
+        sys.exit('Import failed: {}'.format(e))
+    finally:
+        if input_file is not sys.stdin.buffer:
+            input_file.close()
+        conn.close()
+    print('Imported {}'.format(stats), file=sys.stderr)
+
+
+if __name__ == '__main__':
+    import_data()
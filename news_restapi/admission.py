@@ -0,0 +1,90 @@
+import math
+import threading
+import time
+from collections import Counter, OrderedDict
+from typing import Callable, Optional, Tuple
+
+# reasons a request is shed for, the label of its shed count
+OVERLOAD = 'overload'
+RATE_LIMITED = 'rate_limited'
+PENDING = 'pending'
+
+
+class TokenBucket:
+    """
+    Holds up to burst tokens, refilled at rate tokens per second, a request takes one
+    """
+    __slots__ = ('tokens', 'updated')
+
+    def __init__(self, burst: float, now: float):
+        self.tokens = burst
+        self.updated = now
+
+    def take(self, rate: float, burst: float, now: float) -> float:
+        """
+        Takes a token if there is one
+        :param rate:
+        :param burst:
+        :param now:
+        :return: 0 if a token was taken, otherwise seconds until there is one
+        """
+        self.tokens = min(burst, self.tokens + (now - self.updated) * rate)
+        self.updated = now
+        if self.tokens >= 1:
+            self.tokens -= 1
+            return 0.0
+        return (1 - self.tokens) / rate
+
+
+class AdmissionControl:
+    """
+    Decides whether a request is handled or shed: at most max_in_flight requests are handled at once,
+    and every client address gets a token bucket of rate requests per second with bursts of burst.
+    Rejecting a request costs a lock and a dict lookup, far less than queueing it behind the others.
+    """
+    def __init__(self, max_in_flight: int = 0, rate: float = 0, burst: int = 20, retry_after: int = 1,
+                 max_clients: int = 100000, clock: Callable[[], float] = time.monotonic):
+        self.max_in_flight = max_in_flight
+        self.rate = rate
+        self.burst = burst
+        self.retry_after = retry_after
+        self.max_clients = max_clients
+        self.clock = clock
+        self.in_flight = 0
+        self.shed = Counter()
+        self._buckets = OrderedDict()  # client address -> TokenBucket, least recently seen first
+        self._lock = threading.Lock()
+
+    def admit(self, client: str) -> Optional[Tuple[int, int, str]]:
+        """
+        Lets a request in, call release() once it is handled
+        :param client: client address
+        :return: None if admitted, otherwise status, seconds to retry after and the reason
+        """
+        with self._lock:
+            if self.rate > 0:
+                wait = self.take_token(client)
+                if wait:
+                    self.shed[RATE_LIMITED] += 1
+                    return 429, max(1, math.ceil(wait)), RATE_LIMITED
+            if self.max_in_flight and self.in_flight >= self.max_in_flight:
+                self.shed[OVERLOAD] += 1
+                return 503, self.retry_after, OVERLOAD
+            self.in_flight += 1
+            return None
+
+    def release(self) -> None:
+        with self._lock:
+            self.in_flight -= 1
+
+    def take_token(self, client: str) -> float:
+        now = self.clock()
+        bucket = self._buckets.get(client)
+        if bucket is None:
+            bucket = self._buckets[client] = TokenBucket(self.burst, now)
+            if len(self._buckets) > self.max_clients:
+                # the least recently seen client has likely refilled its bucket anyway
+                self._buckets.popitem(last=False)
+        else:
+            self._buckets.move_to_end(client)
+        return bucket.take(self.rate, self.burst, now)
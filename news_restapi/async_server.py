@@ -0,0 +1,292 @@
+import asyncio
+import io
+import http.client
+import signal
+import time
+from concurrent.futures import ThreadPoolExecutor
+from email.utils import formatdate
+from http import HTTPStatus
+
+from news_restapi import settings
+from news_restapi.migrations import migrate_database
+from news_restapi.server import (
+    RESTDispatcher, PayloadReader, enable_cache_coherence, get_content_length, get_poll_interval, recorder,
+    service_worker, start_sampler, write_queue, writer_thread
+)
+
+MAX_HEADER_SIZE = 65536
+
+
+class LoopStreamFile:
+    """
+    Blocking reads from an asyncio stream, for code running in the executor rather than the event loop
+    """
+    def __init__(self, reader: asyncio.StreamReader, loop):
+        self.reader = reader
+        self.loop = loop
+
+    def read(self, size: int) -> bytes:
+        read = asyncio.wait_for(self.reader.read(size), settings.KEEP_ALIVE_TIMEOUT)
+        return asyncio.run_coroutine_threadsafe(read, self.loop).result()
+
+
+class AsyncRESTRequest(RESTDispatcher):
+    """
+    A request read from an asyncio stream, dispatched to the same routes as RESTRequestHandler.
+    The body is read by the controller as it needs it.
+    """
+    def __init__(self, command: str, path: str, request_version: str, headers, payload: PayloadReader,
+                 client_address):
+        self.command = command
+        self.path = path
+        self.request_version = request_version
+        self.headers = headers
+        self.payload = payload
+        self.client_address = client_address
+
+    def handle(self):
+        """
+        Dispatches the request and reads what is left of its body, runs in the executor
+        :return: status code, headers and body
+        """
+        response = self.dispatch(self.command)
+        self.payload.discard()
+        return response
+
+    @property
+    def keep_alive(self) -> bool:
+        connection = self.headers.get('Connection', '').lower()
+        if self.request_version == 'HTTP/1.0':
+            return connection == 'keep-alive'
+        return connection != 'close'
+
+
+class AsyncRESTServer:
+    """
+    An HTTP/1.1 server on asyncio streams. Connections are served by the event loop,
+    controllers (and so all blocking SQLite calls) run in a thread pool executor.
+    """
+    def __init__(self, port: int, workers: int = None, reuse_port: bool = False):
+        self.port = port
+        self.reuse_port = reuse_port
+        self.executor = ThreadPoolExecutor(max_workers=workers or None, thread_name_prefix='rest-executor')
+        self.server = None
+        # set by drain(), connections are closed after their current response
+        self.draining = False
+        self.connections = set()  # tasks serving connections
+        self.idle = set()  # writers of connections waiting for their next request
+
+    async def start(self, host: str = ''):
+        self.server = await asyncio.start_server(
+            self.handle_connection, host or None, self.port, limit=MAX_HEADER_SIZE, reuse_port=self.reuse_port or None
+        )
+        self.port = self.server.sockets[0].getsockname()[1]
+
+    async def serve_forever(self):
+        async with self.server:
+            await self.server.serve_forever()
+
+    async def run_service_worker(self, interval: float):
+        """
+        Calls service_worker every interval seconds in the executor, as http.server does between requests
+        :param interval:
+        :return:
+        """
+        loop = asyncio.get_event_loop()
+        while True:
+            await asyncio.sleep(interval)
+            await loop.run_in_executor(self.executor, service_worker)
+
+    async def drain(self):
+        """
+        Stops accepting connections, closes the idle ones and waits for the others to answer their request
+        :return:
+        """
+        self.draining = True
+        self.server.close()
+        for writer in list(self.idle):
+            writer.close()
+        if self.connections:
+            await asyncio.wait(list(self.connections))
+
+    def close(self):
+        if self.server:
+            self.server.close()
+        self.executor.shutdown(wait=True)
+
+    async def read_request(self, reader, writer, client_address):
+        """
+        Reads a request line, headers and body from the stream
+        :param reader:
+        :param writer: used to acknowledge 'Expect: 100-continue'
+        :param client_address:
+        :return: request, None on a closed connection. The body is left in the stream.
+        """
+        try:
+            head = await asyncio.wait_for(reader.readuntil(b'\r\n\r\n'), settings.KEEP_ALIVE_TIMEOUT)
+        except asyncio.IncompleteReadError:
+            return None
+        request_line, _, header_lines = head.partition(b'\r\n')
+        words = request_line.decode('iso-8859-1').split()
+        if len(words) != 3 or not words[2].startswith('HTTP/'):
+            raise ValueError('Bad request line {!r}'.format(request_line))
+        command, path, request_version = words
+        headers = http.client.parse_headers(io.BytesIO(header_lines))
+        if not headers.get('content-length', '0').strip().isdigit():
+            raise ValueError('Bad Content-Length {!r}'.format(headers.get('content-length')))
+        payload_len = get_content_length(headers)
+        if payload_len and headers.get('Expect', '').lower() == '100-continue':
+            writer.write(b'HTTP/1.1 100 Continue\r\n\r\n')
+        payload = PayloadReader(
+            LoopStreamFile(reader, asyncio.get_event_loop()), payload_len, AsyncRESTRequest.kept_body_size()
+        )
+        return AsyncRESTRequest(command, path, request_version, headers, payload, client_address)
+
+    async def handle_connection(self, reader, writer):
+        loop = asyncio.get_event_loop()
+        client_address = writer.get_extra_info('peername')
+        requests_handled = 0
+        task = asyncio.current_task()
+        self.connections.add(task)
+        try:
+            while not self.draining:
+                self.idle.add(writer)
+                try:
+                    request = await self.read_request(reader, writer, client_address)
+                except (asyncio.TimeoutError, ConnectionError):
+                    break
+                except (ValueError, asyncio.LimitOverrunError):
+                    self.write_response(writer, 'GET', 400, {}, 'Bad request'.encode(), False)
+                    await writer.drain()
+                    break
+                finally:
+                    self.idle.discard(writer)
+                if request is None:
+                    break
+                started = time.perf_counter()
+                rejection = request.admit()
+                if rejection is not None:
+                    # shed before it waits for the executor, the body is not read and the connection is closed
+                    status, headers, body = rejection
+                    self.write_response(writer, request.command, status, headers, body, False)
+                    await writer.drain()
+                    request.record_request(request.command, status, len(body), started)
+                    break
+                try:
+                    status, headers, body = await loop.run_in_executor(self.executor, request.handle)
+                    requests_handled += 1
+                    keep_alive = request.keep_alive and requests_handled < settings.KEEP_ALIVE_MAX_REQUESTS \
+                        and not self.draining
+                    if isinstance(body, bytes):
+                        self.write_response(writer, request.command, status, headers, body, keep_alive)
+                        size = len(body) if request.command != 'HEAD' and status != 304 else 0
+                    else:
+                        # HTTP/1.0 clients do not know chunked encoding, a streamed body is ended by closing
+                        # the connection
+                        chunked = request.request_version != 'HTTP/1.0'
+                        keep_alive = keep_alive and chunked
+                        self.write_response(writer, request.command, status, headers, None, keep_alive, chunked)
+                        size = await self.write_stream(writer, body, chunked)
+                        if size is None:
+                            break
+                    await writer.drain()
+                finally:
+                    request.release()
+                request.record_request(request.command, status, size, started)
+                if not keep_alive:
+                    break
+        except ConnectionError:
+            pass
+        finally:
+            writer.close()
+            self.connections.discard(task)
+
+    async def write_stream(self, writer, chunks, chunked: bool) -> bool:
+        """
+        Writes a streamed body, chunks are made in the executor as they read from the database
+        :param writer:
+        :param chunks: generator of chunks, closed when done
+        :param chunked: frame chunks with chunked transfer encoding
+        :return: bytes of body written, None if the body was cut short
+        """
+        loop = asyncio.get_event_loop()
+        size = 0
+        try:
+            while True:
+                chunk = await loop.run_in_executor(self.executor, next, chunks, None)
+                if chunk is None:
+                    break
+                if chunk:
+                    writer.write(b'%x\r\n%s\r\n' % (len(chunk), chunk) if chunked else chunk)
+                    size += len(chunk)
+                    await writer.drain()
+            if chunked:
+                writer.write(b'0\r\n\r\n')
+            return size
+        except Exception:
+            # the headers are out, the connection is closed so the client sees the response incomplete
+            return None
+        finally:
+            await loop.run_in_executor(self.executor, chunks.close)
+
+    @staticmethod
+    def write_response(writer, method: str, status: int, headers: dict, body, keep_alive: bool,
+                       chunked: bool = False):
+        """
+        Writes the status line and headers, and the body unless it is None (a streamed one written after)
+        """
+        lines = [
+            'HTTP/1.1 {} {}'.format(status, HTTPStatus(status).phrase),
+            'Date: {}'.format(formatdate(usegmt=True)),
+            'Connection: {}'.format('keep-alive' if keep_alive else 'close'),
+        ]
+        # HEAD and 304 responses never have a body, other ones are framed by their length or chunked
+        if body is None:
+            if chunked:
+                lines.append('Transfer-Encoding: chunked')
+            body = b''
+        elif method != 'HEAD' and status != 304:
+            lines.append('Content-Length: {}'.format(len(body)))
+        else:
+            body = b''
+        lines.extend('{}: {}'.format(name, value) for name, value in headers.items())
+        writer.write(('\r\n'.join(lines) + '\r\n\r\n').encode('iso-8859-1') + body)
+
+
+def async_rest_server(port: int, workers: int = None, reuse_port: bool = False) -> None:
+    """
+    Starts the REST server on an asyncio event loop. SIGTERM shuts it down once the requests in progress
+    are answered.
+    :param port:
+    :param workers: size of the executor running controllers, settings.SERVER_WORKERS by default
+    :param reuse_port: share the port with other processes serving the same database, see supervisor.py
+    :return:
+    """
+    if workers is None:
+        workers = settings.SERVER_WORKERS
+    migrate_database()
+    server = AsyncRESTServer(port, workers, reuse_port)
+    if reuse_port:
+        enable_cache_coherence()
+
+    async def main():
+        await server.start()
+        start_sampler()
+        if write_queue is not None:
+            asyncio.ensure_future(server.run_service_worker(get_poll_interval()))
+        serving = asyncio.ensure_future(server.serve_forever())
+        stopping = asyncio.Event()
+        asyncio.get_event_loop().add_signal_handler(signal.SIGTERM, stopping.set)
+        await asyncio.wait([serving, asyncio.ensure_future(stopping.wait())], return_when=asyncio.FIRST_COMPLETED)
+        await server.drain()
+        serving.cancel()
+
+    try:
+        asyncio.run(main())
+    except KeyboardInterrupt:
+        pass
+    server.close()
+    if recorder is not None:
+        recorder.close()
+    if writer_thread is not None:
+        writer_thread.close()
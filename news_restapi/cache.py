@@ -0,0 +1,111 @@
+import threading
+import time
+from collections import OrderedDict
+from typing import Any, Callable, Hashable, Iterable
+
+
+class LRUCache:
+    """
+    A thread safe LRU cache with a time to live for entries and tag based invalidation
+    """
+    def __init__(self, maxsize: int, ttl: float, clock: Callable[[], float] = time.monotonic):
+        self.maxsize = maxsize
+        self.ttl = ttl
+        self.clock = clock
+        self.hits = 0
+        self.misses = 0
+        self.evictions = 0
+        # bumped on every invalidation, see get_or_load
+        self.generation = 0
+        self._entries = OrderedDict()  # key -> (expires, value, tags)
+        self._tags = {}  # tag -> set of keys
+        self._lock = threading.Lock()
+
+    def __len__(self):
+        return len(self._entries)
+
+    def get(self, key: Hashable, default: Any = None) -> Any:
+        with self._lock:
+            entry = self._entries.get(key)
+            if entry is not None and entry[0] < self.clock():
+                self._remove(key)
+                entry = None
+            if entry is None:
+                self.misses += 1
+                return default
+            self._entries.move_to_end(key)
+            self.hits += 1
+            return entry[1]
+
+    def set(self, key: Hashable, value: Any, tags: Iterable[Hashable] = (), generation: int = None) -> None:
+        """
+        Stores a value
+        :param key:
+        :param value:
+        :param tags: invalidate_tags() with any of them drops the entry
+        :param generation: the value is not stored if the cache was invalidated since this generation
+        :return:
+        """
+        with self._lock:
+            if generation is not None and generation != self.generation:
+                return
+            if key in self._entries:
+                self._remove(key)
+            tags = tuple(tags)
+            self._entries[key] = (self.clock() + self.ttl, value, tags)
+            for tag in tags:
+                self._tags.setdefault(tag, set()).add(key)
+            while len(self._entries) > self.maxsize:
+                self._remove(next(iter(self._entries)))
+                self.evictions += 1
+
+    def get_or_load(self, key: Hashable, load: Callable[[], Any], tags=()) -> Any:
+        """
+        Read-through lookup, a loaded value that is not None gets stored.
+        A value loaded while a concurrent write invalidated the cache is not stored, it may be stale.
+        :param key:
+        :param load: fetches the value on a miss
+        :param tags: tags or a function making them from the loaded value
+        :return: value
+        """
+        missing = object()
+        value = self.get(key, missing)
+        if value is not missing:
+            return value
+        generation = self.generation
+        value = load()
+        if value is not None:
+            self.set(key, value, tags(value) if callable(tags) else tags, generation)
+        return value
+
+    def invalidate_tags(self, *tags: Hashable) -> None:
+        with self._lock:
+            self.generation += 1
+            for tag in tags:
+                for key in self._tags.pop(tag, ()):
+                    self._remove(key)
+
+    def clear(self) -> None:
+        with self._lock:
+            self.generation += 1
+            self._entries.clear()
+            self._tags.clear()
+
+    def stats(self) -> dict:
+        return {
+            'size': len(self._entries),
+            'hits': self.hits,
+            'misses': self.misses,
+            'evictions': self.evictions,
+        }
+
+    def _remove(self, key: Hashable) -> None:
+        entry = self._entries.pop(key, None)
+        if entry is None:
+            return
+        for tag in entry[2]:
+            keys = self._tags.get(tag)
+            if keys is not None:
+                keys.discard(key)
+                if not keys:
+                    del self._tags[tag]
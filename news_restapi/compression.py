@@ -0,0 +1,79 @@
+import zlib
+from typing import Iterable, Iterator, Optional
+
+# content coding -> zlib wbits
+ENCODINGS = {
+    'gzip': 31,
+    'deflate': 15,
+}
+
+
+def negotiate_encoding(accept_encoding: Optional[str]) -> Optional[str]:
+    """
+    Picks a supported content coding from an Accept-Encoding header
+    :param accept_encoding: e.g. 'gzip;q=0.8, deflate, *;q=0'
+    :return: content coding, None for identity
+    """
+    if not accept_encoding:
+        return None
+    qualities = {}
+    for item in accept_encoding.split(','):
+        coding, _, params = item.strip().partition(';')
+        quality = 1.0
+        params = params.strip()
+        if params.startswith('q='):
+            try:
+                quality = float(params[2:])
+            except ValueError:
+                quality = 0.0
+        qualities[coding.strip().lower()] = quality
+
+    best, best_quality = None, 0.0
+    for coding in ENCODINGS:
+        quality = qualities.get(coding, qualities.get('*', 0.0))
+        if quality > best_quality:
+            best, best_quality = coding, quality
+    return best
+
+
+def compress(body: bytes, encoding: str, level: int) -> bytes:
+    compressor = zlib.compressobj(level, zlib.DEFLATED, ENCODINGS[encoding])
+    return compressor.compress(body) + compressor.flush()
+
+
+def compress_stream(chunks: Iterable[bytes], encoding: str, level: int) -> Iterator[bytes]:
+    """
+    Compresses a body chunk by chunk. Every chunk is flushed, so a client can decode
+    what it got so far without waiting for the end of the body.
+    :param chunks:
+    :param encoding:
+    :param level:
+    :return: compressed chunks
+    """
+    compressor = zlib.compressobj(level, zlib.DEFLATED, ENCODINGS[encoding])
+    for chunk in chunks:
+        yield compressor.compress(chunk) + compressor.flush(zlib.Z_SYNC_FLUSH)
+    yield compressor.flush()
+
+
+def encoded_etag(etag: str, encoding: str) -> str:
+    """
+    A strong ETag must differ between encodings of a resource
+    :param etag: e.g. '"abc"'
+    :param encoding: e.g. 'gzip'
+    :return: e.g. '"abc-gzip"'
+    """
+    return '{}-{}"'.format(etag[:-1], encoding)
+
+
+def decoded_etag(etag: str) -> str:
+    """
+    Reverts encoded_etag
+    :param etag: e.g. '"abc-gzip"'
+    :return: e.g. '"abc"'
+    """
+    for encoding in ENCODINGS:
+        suffix = '-{}"'.format(encoding)
+        if etag.endswith(suffix):
+            return etag[:-len(suffix)] + '"'
+    return etag
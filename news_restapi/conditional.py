@@ -0,0 +1,101 @@
+import hashlib
+from dataclasses import fields, is_dataclass
+from datetime import datetime
+from email.utils import formatdate, parsedate_to_datetime
+from typing import Any, List, Optional, Tuple
+
+from news_restapi.compression import decoded_etag
+
+
+# fields maintained from other tables, they change without touching modified_date
+DENORMALIZED_FIELDS = ('comment_count',)
+
+
+def collect_versions(content: Any, versions: List[tuple]) -> None:
+    """
+    Collects (id, modified_date) of every object in a response content
+    :param content: model object, dict, list of them or nested ones
+    :param versions: list to add versions to
+    :return:
+    """
+    if is_dataclass(content):
+        versions.append((content.id, content.modified_date) + tuple(
+            getattr(content, name) for name in DENORMALIZED_FIELDS if hasattr(content, name)
+        ))
+        for field in fields(content):
+            value = getattr(content, field.name)
+            if isinstance(value, (dict, list)):
+                collect_versions(value, versions)
+    elif isinstance(content, dict):
+        if 'id' in content and 'modified_date' in content:
+            versions.append((content['id'], content['modified_date']))
+        for value in content.values():
+            if isinstance(value, (dict, list)):
+                collect_versions(value, versions)
+    elif isinstance(content, list):
+        for item in content:
+            collect_versions(item, versions)
+
+
+def get_validators(content: Any) -> Tuple[str, Optional[datetime]]:
+    """
+    Makes validators from object ids and modification dates, without serializing the content.
+    Every change of an object updates its modified_date or a denormalized field, so equal versions
+    mean equal bodies.
+    :param content:
+    :return: strong ETag and the latest modification date (None for an empty list)
+    """
+    versions = []
+    collect_versions(content, versions)
+    digest = hashlib.sha1(repr(versions).encode()).hexdigest()
+    last_modified = max((version[1] for version in versions), default=None)
+    return '"{}"'.format(digest), last_modified
+
+
+def is_date_validated(content: Any) -> bool:
+    """
+    Whether the latest modification date changes with every change of a content. It does not when
+    a list loses an item, nor when a denormalized field of an object changes.
+    :param content:
+    :return: True if If-Modified-Since can be evaluated
+    """
+    if isinstance(content, list):
+        return False
+    return not any(hasattr(content, name) for name in DENORMALIZED_FIELDS)
+
+
+def http_date(dt: datetime) -> str:
+    """
+    Formats a datetime (local time zone) as an HTTP date
+    :param dt:
+    :return: e.g. 'Sun, 17 Nov 2019 12:27:43 GMT'
+    """
+    return formatdate(dt.timestamp(), usegmt=True)
+
+
+def is_not_modified(headers, etag: str, last_modified: Optional[datetime]) -> bool:
+    """
+    Evaluates If-None-Match, or If-Modified-Since when there is no If-None-Match
+    :param headers: request headers
+    :param etag: ETag of the identity encoding
+    :param last_modified: None to ignore If-Modified-Since
+    :return: True if a 304 response can be sent
+    """
+    if_none_match = headers.get('If-None-Match')
+    if if_none_match is not None:
+        if if_none_match.strip() == '*':
+            return True
+        # weak comparison, as required for GET, that also ignores the content coding
+        tags = [tag.strip() for tag in if_none_match.split(',')]
+        return etag in [decoded_etag(tag[2:] if tag.startswith('W/') else tag) for tag in tags]
+
+    if_modified_since = headers.get('If-Modified-Since')
+    if if_modified_since is None or last_modified is None:
+        return False
+    try:
+        since = parsedate_to_datetime(if_modified_since)
+    except (TypeError, ValueError):
+        return False
+    if since.tzinfo is None:
+        return False
+    return int(last_modified.timestamp()) <= since.timestamp()
@@ -1,9 +1,72 @@
-from dataclasses import asdict
 from datetime import datetime
 from json import dumps
+from typing import Any, Optional, Tuple, Union
 
 from news_restapi.models import News, Comment
-from news_restapi import exceptions
+from news_restapi.pagination import (
+    get_limit, get_page_params, get_search_params, make_page, make_search_page, Page, is_streamed, make_stream_page,
+    StreamPage
+)
+from news_restapi.repositories import ConstraintViolation
+from news_restapi.transfer import NDJSONStream, export_ndjson, import_ndjson
+from news_restapi import exceptions, settings
+
+
+def get_bulk_payload(handler) -> list:
+    """
+    Reads and validates a bulk payload: a JSON list of at most settings.BULK_MAX_ITEMS items
+    :param handler:
+    :return: payload
+    """
+    try:
+        payload = handler.get_payload()
+    except ValueError:
+        raise exceptions.ValidationError(dumps({'non_field_errors': 'Invalid JSON'}))
+    if not isinstance(payload, list):
+        raise exceptions.ValidationError(dumps({'non_field_errors': 'Expected a list'}))
+    if len(payload) > settings.BULK_MAX_ITEMS:
+        raise exceptions.ValidationError(
+            dumps({'non_field_errors': 'At most {} items are allowed'.format(settings.BULK_MAX_ITEMS)})
+        )
+    return payload
+
+
+def get_bulk_id(item: Any) -> Optional[int]:
+    """
+    Get the id of a bulk update item ({"id": 1, ...}) or bulk delete item (1)
+    :param item:
+    :return: id, None if missing
+    """
+    value = item.get('id') if isinstance(item, dict) else item
+    return value if isinstance(value, int) and not isinstance(value, bool) else None
+
+
+def bulk_result(obj_id: Optional[int], errors: dict) -> dict:
+    """
+    Result of a bulk item: {"id": 1} or {"id": 1, "errors": {...}}
+    :param obj_id:
+    :param errors:
+    :return: result
+    """
+    result = {} if obj_id is None else {'id': obj_id}
+    if errors:
+        result['errors'] = errors
+    return result
+
+
+def check_bulk_id(item: Any, existing: dict) -> Tuple[Optional[int], dict]:
+    """
+    Validate the id of a bulk update or delete item
+    :param item:
+    :param existing: objects that may be changed, by id
+    :return: id and errors
+    """
+    obj_id = get_bulk_id(item)
+    if obj_id is None:
+        return None, {'id': 'This field is required'}
+    if obj_id not in existing:
+        return obj_id, {'id': 'Not found'}
+    return obj_id, {}
 
 
 class NewsController:
@@ -13,31 +76,62 @@ class NewsController:
     def __init__(self, news_repository):
         self.news_repository = news_repository
 
-    def validate_news(self, payload: dict) -> dict:
+    def news_errors(self, payload: dict) -> dict:
         """
-        Validate input payload for required fields
+        Check input payload for required fields
         :param payload:
-        :return: payload
+        :return: errors by field
         """
+        if not isinstance(payload, dict):
+            return {'non_field_errors': 'Expected an object'}
         errors = {}
         if not payload.get('title', None):
             errors['title'] = 'This field is required'
         if not payload.get('content', None):
             errors['content'] = 'This field is required'
+        return errors
+
+    def validate_news(self, payload: dict) -> dict:
+        """
+        Validate input payload for required fields
+        :param payload:
+        :return: payload
+        """
+        errors = self.news_errors(payload)
         if errors:
             raise exceptions.ValidationError(dumps(errors))
         return payload
 
-    def list_news(self, handler, **kwargs) -> list:
+    def list_news(self, handler, **kwargs) -> Union[Page, StreamPage]:
+        """
+        Get a page of news, see get_page_params for the query parameters. Large pages are read lazily.
+        :param handler:
+        :return: page of news
+        """
+        limit, before_id = get_page_params(handler.get_query())
+        if is_streamed(limit):
+            last_id = self.news_repository.get_news_page_end(limit, before_id)
+            # bounded by the last id, so news added meanwhile do not push one off the page, and by the limit,
+            # as the last page has no last id and the stream may read a newer snapshot than get_news_page_end
+            return make_stream_page(self.news_repository.iter_news(before_id, last_id, limit), limit, last_id)
+        news_list = self.news_repository.list_news(limit + 1, before_id)
+        return make_page(news_list, limit)
+
+    def search_news(self, handler, **kwargs) -> Page:
         """
-        Get a list of news (25 for now)
+        Search news by the words of ?q=, best matches first. Accepts limit and cursor like list_news.
         :param handler:
-        :return: list of news
+        :return: page of hits with snippets
         """
-        news_list = self.news_repository.list_news(25, 0)
-        return [asdict(news) for news in news_list]
+        query = handler.get_query()
+        text = query.get('q', '').strip()
+        if not text:
+            raise exceptions.ValidationError(dumps({'q': 'This field is required'}))
+        limit, after = get_search_params(query)
+        hits = self.news_repository.search_news(text, limit + 1, after)
+        return make_search_page(hits, limit)
 
-    def add_news(self, handler, **kwargs) -> dict:
+    def add_news(self, handler, **kwargs) -> News:
         """
         Add new news
         :param handler:
@@ -47,21 +141,29 @@ class NewsController:
         dt = datetime.now()
         news = News(id=None, created_date=dt, modified_date=dt, title=payload['title'], content=payload['content'])
         news = self.news_repository.add_news(news)
-        return asdict(news)
+        return news
 
-    def get_news(self, handler, **kwargs) -> dict:
+    def get_news(self, handler, **kwargs) -> News:
         """
-        Get news by id
+        Get news by id. ?include=comments embeds the newest comments, ?comments_limit= of them
+        (settings.PAGE_SIZE by default).
         :param handler:
         :return: news
         """
         news_id = kwargs.get('pk')
-        news = self.news_repository.get_news(news_id)
+        query = handler.get_query()
+        include = [name for name in query.get('include', '').split(',') if name]
+        if [name for name in include if name != 'comments']:
+            raise exceptions.ValidationError(dumps({'include': 'Only comments can be included'}))
+        if include:
+            news = self.news_repository.get_news_with_comments(news_id, get_limit(query, 'comments_limit'))
+        else:
+            news = self.news_repository.get_news(news_id)
         if not news:
             raise exceptions.NotFoundError()
-        return asdict(news)
+        return news
 
-    def update_news(self, handler, **kwargs) -> dict:
+    def update_news(self, handler, **kwargs) -> News:
         """
         Update news by id
         :param handler:
@@ -76,7 +178,7 @@ class NewsController:
         news.title = payload['title']
         news.content = payload['content']
         self.news_repository.update_news(news)
-        return asdict(news)
+        return news
 
     def delete_news(self, handler, **kwargs) -> dict:
         """
@@ -92,6 +194,59 @@ class NewsController:
         self.news_repository.delete_news(news)
         return {}
 
+    def bulk_add_news(self, handler, **kwargs) -> list:
+        """
+        Add a list of news in one transaction, invalid items are reported and skipped
+        :param handler:
+        :return: result per item, {"id": 1} or {"errors": {...}}
+        """
+        payload = get_bulk_payload(handler)
+        dt = datetime.now()
+        results, news_list = [], []
+        for item in payload:
+            errors = self.news_errors(item)
+            if errors:
+                results.append(bulk_result(None, errors))
+            else:
+                news = News(id=None, created_date=dt, modified_date=dt, title=item['title'], content=item['content'])
+                news_list.append(news)
+                results.append(news)
+        self.news_repository.add_news_many(news_list)
+        return [bulk_result(result.id, {}) if isinstance(result, News) else result for result in results]
+
+    def bulk_update_news(self, handler, **kwargs) -> list:
+        """
+        Update a list of news ({"id": 1, "title": ..., "content": ...}) in one transaction
+        :param handler:
+        :return: result per item, {"id": 1} or {"id": 1, "errors": {...}}
+        """
+        payload = get_bulk_payload(handler)
+        existing = self.news_repository.get_news_many({get_bulk_id(item) for item in payload} - {None})
+        results, news_list = [], []
+        for item in payload:
+            news_id, errors = check_bulk_id(item, existing)
+            errors.update(self.news_errors(item))
+            if not errors:
+                news = existing[news_id]
+                news.title = item['title']
+                news.content = item['content']
+                news_list.append(news)
+            results.append(bulk_result(news_id, errors))
+        self.news_repository.update_news_many(news_list)
+        return results
+
+    def bulk_delete_news(self, handler, **kwargs) -> list:
+        """
+        Delete a list of news by id in one transaction
+        :param handler:
+        :return: result per item, {"id": 1} or {"id": 1, "errors": {...}}
+        """
+        payload = get_bulk_payload(handler)
+        existing = self.news_repository.get_news_many({get_bulk_id(item) for item in payload} - {None})
+        results = [bulk_result(*check_bulk_id(item, existing)) for item in payload]
+        self.news_repository.delete_news_many(list(existing.values()))
+        return results
+
 
 class CommentController:
     """
@@ -100,30 +255,47 @@ class CommentController:
     def __init__(self, comment_repository):
         self.comment_repository = comment_repository
 
-    def validate_comment(self, payload: dict) -> dict:
+    def comment_errors(self, payload: dict) -> dict:
         """
-        Validate input payload for required fields
+        Check input payload for required fields
         :param payload:
-        :return: payload
+        :return: errors by field
         """
+        if not isinstance(payload, dict):
+            return {'non_field_errors': 'Expected an object'}
         errors = {}
         if not payload.get('content', None):
             errors['content'] = 'This field is required'
+        return errors
+
+    def validate_comment(self, payload: dict) -> dict:
+        """
+        Validate input payload for required fields
+        :param payload:
+        :return: payload
+        """
+        errors = self.comment_errors(payload)
         if errors:
             raise exceptions.ValidationError(dumps(errors))
         return payload
 
-    def list_comments(self, handler, **kwargs) -> list:
+    def list_comments(self, handler, **kwargs) -> Union[Page, StreamPage]:
         """
-        Get a list of comments (25 for now)
+        Get a page of comments, see get_page_params for the query parameters. Large pages are read lazily.
         :param handler:
-        :return: list of comments
+        :return: page of comments
         """
         news_id = kwargs['news_pk']
-        comment_list = self.comment_repository.get_comments_for_news(news_id, 25, 0)
-        return [asdict(comment) for comment in comment_list]
+        limit, before_id = get_page_params(handler.get_query())
+        if is_streamed(limit):
+            last_id = self.comment_repository.get_comments_page_end(news_id, limit, before_id)
+            return make_stream_page(
+                self.comment_repository.iter_comments_for_news(news_id, before_id, last_id, limit), limit, last_id
+            )
+        comment_list = self.comment_repository.get_comments_for_news(news_id, limit + 1, before_id)
+        return make_page(comment_list, limit)
 
-    def add_comment(self, handler, **kwargs) -> dict:
+    def add_comment(self, handler, **kwargs) -> Comment:
         """
         Add new comment
         :param handler:
@@ -133,10 +305,14 @@ class CommentController:
         dt = datetime.now()
         news_id = kwargs['news_pk']
         comment = Comment(id=None, created_date=dt, modified_date=dt, news_id=news_id, content=payload['content'])
-        comment = self.comment_repository.add_comment(comment)
-        return asdict(comment)
+        try:
+            comment = self.comment_repository.add_comment(comment)
+        except ConstraintViolation:
+            # the news does not exist
+            raise exceptions.NotFoundError()
+        return comment
 
-    def get_comment(self, handler, **kwargs) -> dict:
+    def get_comment(self, handler, **kwargs) -> Comment:
         """
         Get comment by id
         :param handler:
@@ -146,9 +322,9 @@ class CommentController:
         comment = self.comment_repository.get_comment(comment_id)
         if not comment:
             raise exceptions.NotFoundError()
-        return asdict(comment)
+        return comment
 
-    def update_comment(self, handler, **kwargs) -> dict:
+    def update_comment(self, handler, **kwargs) -> Comment:
         """
         Update comment by id
         :param handler:
@@ -162,7 +338,7 @@ class CommentController:
         payload = self.validate_comment(handler.get_payload())
         comment.content = payload['content']
         self.comment_repository.update_comment(comment)
-        return asdict(comment)
+        return comment
 
     def delete_comment(self, handler, **kwargs) -> dict:
         """
@@ -177,3 +353,129 @@ class CommentController:
 
         self.comment_repository.delete_comment(comment)
         return {}
+
+    def bulk_add_comments(self, handler, **kwargs) -> list:
+        """
+        Add a list of comments in one transaction, invalid items are reported and skipped
+        :param handler:
+        :return: result per item, {"id": 1} or {"errors": {...}}
+        """
+        payload = get_bulk_payload(handler)
+        dt = datetime.now()
+        news_id = kwargs['news_pk']
+        results, comment_list = [], []
+        for item in payload:
+            errors = self.comment_errors(item)
+            if errors:
+                results.append(bulk_result(None, errors))
+            else:
+                comment = Comment(id=None, created_date=dt, modified_date=dt, news_id=news_id, content=item['content'])
+                comment_list.append(comment)
+                results.append(comment)
+        try:
+            self.comment_repository.add_comment_many(comment_list)
+        except ConstraintViolation:
+            # the news does not exist
+            raise exceptions.NotFoundError()
+        return [bulk_result(result.id, {}) if isinstance(result, Comment) else result for result in results]
+
+    def get_news_comments(self, payload: list, news_id: int) -> dict:
+        """
+        Get the comments of a news referenced by bulk items
+        :param payload:
+        :param news_id:
+        :return: comments by id
+        """
+        comments = self.comment_repository.get_comment_many({get_bulk_id(item) for item in payload} - {None})
+        return {comment_id: comment for comment_id, comment in comments.items() if comment.news_id == news_id}
+
+    def bulk_update_comments(self, handler, **kwargs) -> list:
+        """
+        Update a list of comments ({"id": 1, "content": ...}) in one transaction
+        :param handler:
+        :return: result per item, {"id": 1} or {"id": 1, "errors": {...}}
+        """
+        payload = get_bulk_payload(handler)
+        existing = self.get_news_comments(payload, kwargs['news_pk'])
+        results, comment_list = [], []
+        for item in payload:
+            comment_id, errors = check_bulk_id(item, existing)
+            errors.update(self.comment_errors(item))
+            if not errors:
+                comment = existing[comment_id]
+                comment.content = item['content']
+                comment_list.append(comment)
+            results.append(bulk_result(comment_id, errors))
+        self.comment_repository.update_comment_many(comment_list)
+        return results
+
+    def bulk_delete_comments(self, handler, **kwargs) -> list:
+        """
+        Delete a list of comments by id in one transaction
+        :param handler:
+        :return: result per item, {"id": 1} or {"id": 1, "errors": {...}}
+        """
+        payload = get_bulk_payload(handler)
+        existing = self.get_news_comments(payload, kwargs['news_pk'])
+        results = [bulk_result(*check_bulk_id(item, existing)) for item in payload]
+        self.comment_repository.delete_comment_many(list(existing.values()))
+        return results
+
+
+class TransferController:
+    """
+    A controller that exports and imports the whole corpus as NDJSON
+    """
+    def __init__(self, news_repository, comment_repository):
+        self.news_repository = news_repository
+        self.comment_repository = comment_repository
+
+    def export_corpus(self, handler, **kwargs) -> NDJSONStream:
+        """
+        Export every news followed by its comments
+        :param handler:
+        :return: stream of NDJSON lines
+        """
+        return NDJSONStream(self.export_lines())
+
+    def export_lines(self):
+        with self.news_repository.read_connection() as conn:
+            yield from export_ndjson(conn)
+
+    def import_corpus(self, handler, **kwargs) -> dict:
+        """
+        Import NDJSON as export writes it, the payload is read line by line.
+        ?batch_size= sets the rows committed per transaction.
+        :param handler:
+        :return: imported rows and throughput
+        """
+        batch_size = handler.get_query().get('batch_size', settings.IMPORT_BATCH_SIZE)
+        try:
+            batch_size = int(batch_size)
+        except ValueError:
+            batch_size = 0
+        if batch_size < 1:
+            raise exceptions.ValidationError(dumps({'batch_size': 'Must be a positive integer'}))
+        try:
+            stats = import_ndjson(handler.get_payload_lines(), self.news_repository.write, batch_size)
+        finally:
+            # imported rows may belong on any cached list
+            self.news_repository.invalidate_all()
+            self.comment_repository.invalidate_all()
+        return stats.as_dict()
+
+
+class MetricsController:
+    """
+    A controller that exposes request and query metrics
+    """
+    def __init__(self, metrics):
+        self.metrics = metrics
+
+    def get_metrics(self, handler, **kwargs) -> bytes:
+        """
+        Get the metrics in the Prometheus text format
+        :param handler:
+        :return: text, sent as it is
+        """
+        return self.metrics.render().encode()
@@ -0,0 +1,201 @@
+import threading
+from bisect import bisect_left
+from typing import Iterable, List, Tuple
+
+# upper bounds of the histogram buckets, in seconds
+REQUEST_BUCKETS = (0.001, 0.0025, 0.005, 0.01, 0.025, 0.05, 0.1, 0.25, 0.5, 1.0, 2.5, 5.0)
+QUERY_BUCKETS = (0.0001, 0.00025, 0.0005, 0.001, 0.0025, 0.005, 0.01, 0.025, 0.05, 0.1, 0.25, 1.0)
+
+# route label of requests matching no route
+UNMATCHED_ROUTE = 'unmatched'
+
+# metrics of the caches: name, key of LRUCache.stats(), type and help
+CACHE_METRICS = (
+    ('news_cache_hits_total', 'hits', 'counter', 'Lookups answered from a cache.'),
+    ('news_cache_misses_total', 'misses', 'counter', 'Lookups not found in a cache.'),
+    ('news_cache_evictions_total', 'evictions', 'counter', 'Entries dropped from a full cache.'),
+    ('news_cache_entries', 'size', 'gauge', 'Entries in a cache.'),
+)
+
+
+class Histogram:
+    """
+    Counts of observations per bucket, not cumulative (Prometheus buckets are, see cumulative_counts)
+    """
+    __slots__ = ('bounds', 'counts', 'sum', 'count')
+
+    def __init__(self, bounds: Tuple[float, ...]):
+        self.bounds = bounds
+        # the last count is of observations above the largest bound
+        self.counts = [0] * (len(bounds) + 1)
+        self.sum = 0.0
+        self.count = 0
+
+    def observe(self, value: float) -> None:
+        self.counts[bisect_left(self.bounds, value)] += 1
+        self.sum += value
+        self.count += 1
+
+    def cumulative_counts(self) -> List[int]:
+        counts, total = [], 0
+        for count in self.counts:
+            total += count
+            counts.append(total)
+        return counts
+
+
+class Metrics:
+    """
+    Thread safe request and query statistics, rendered in the Prometheus text format.
+    Recording an observation costs a lock and a few dict lookups, so it can stay on under load.
+    """
+    def __init__(self):
+        self.requests = {}  # (route, method, status) -> count
+        self.request_durations = {}  # (route, method) -> Histogram
+        self.response_bytes = {}  # (route, method) -> bytes
+        self.query_durations = {}  # (table, query) -> Histogram
+        self.shed = {}  # reason -> count
+        self.caches = {}  # name -> cache with stats(), e.g. LRUCache
+        self._lock = threading.Lock()
+
+    def observe_request(self, route: str, method: str, status: int, seconds: float, size: int) -> None:
+        """
+        Records a served request
+        :param route: route pattern, None for a request matching no route
+        :param method:
+        :param status:
+        :param seconds: from dispatching the request to writing the last byte of the response
+        :param size: bytes of body sent
+        :return:
+        """
+        key = (route or UNMATCHED_ROUTE, method)
+        with self._lock:
+            status_key = key + (status,)
+            self.requests[status_key] = self.requests.get(status_key, 0) + 1
+            histogram = self.request_durations.get(key)
+            if histogram is None:
+                histogram = self.request_durations[key] = Histogram(REQUEST_BUCKETS)
+            histogram.observe(seconds)
+            self.response_bytes[key] = self.response_bytes.get(key, 0) + size
+
+    def observe_query(self, table: str, query: str, seconds: float) -> None:
+        """
+        Records the time a repository method spent on the database
+        :param table:
+        :param query: repository method, e.g. 'list'
+        :param seconds:
+        :return:
+        """
+        key = (table, query)
+        with self._lock:
+            histogram = self.query_durations.get(key)
+            if histogram is None:
+                histogram = self.query_durations[key] = Histogram(QUERY_BUCKETS)
+            histogram.observe(seconds)
+
+    def observe_shed(self, reason: str) -> None:
+        """
+        Records a request rejected by admission control
+        :param reason: see admission.py
+        :return:
+        """
+        with self._lock:
+            self.shed[reason] = self.shed.get(reason, 0) + 1
+
+    def add_cache(self, name: str, cache) -> None:
+        """
+        Reports the hits, misses, evictions and size of a cache, read from its stats() when rendering
+        :param name: cache label
+        :param cache:
+        :return:
+        """
+        with self._lock:
+            self.caches[name] = cache
+
+    def render(self) -> str:
+        """
+        Writes the statistics in the Prometheus text exposition format
+        :return: text
+        """
+        with self._lock:
+            requests = sorted(self.requests.items())
+            request_durations = sorted((key, copy_histogram(value)) for key, value in self.request_durations.items())
+            response_bytes = sorted(self.response_bytes.items())
+            query_durations = sorted((key, copy_histogram(value)) for key, value in self.query_durations.items())
+            shed = sorted(self.shed.items())
+            caches = sorted(self.caches.items())
+        cache_stats = [(name, cache.stats()) for name, cache in caches]
+        lines = [
+            '# HELP news_http_requests_total Requests served by route, method and status.',
+            '# TYPE news_http_requests_total counter',
+        ]
+        for (route, method, status), count in requests:
+            lines.append('news_http_requests_total{{{}}} {}'.format(
+                format_labels(route=route, method=method, status=status), count
+            ))
+        lines += [
+            '# HELP news_http_request_duration_seconds Time from dispatching a request to the end of its response.',
+            '# TYPE news_http_request_duration_seconds histogram',
+        ]
+        for (route, method), histogram in request_durations:
+            lines.extend(format_histogram('news_http_request_duration_seconds', histogram, route=route, method=method))
+        lines += [
+            '# HELP news_http_response_bytes_total Bytes of response bodies sent.',
+            '# TYPE news_http_response_bytes_total counter',
+        ]
+        for (route, method), size in response_bytes:
+            lines.append('news_http_response_bytes_total{{{}}} {}'.format(
+                format_labels(route=route, method=method), size
+            ))
+        lines += [
+            '# HELP news_db_query_duration_seconds Time repository methods spent on the database.',
+            '# TYPE news_db_query_duration_seconds histogram',
+        ]
+        for (table, query), histogram in query_durations:
+            lines.extend(format_histogram('news_db_query_duration_seconds', histogram, table=table, query=query))
+        lines += [
+            '# HELP news_http_shed_total Requests rejected by admission control.',
+            '# TYPE news_http_shed_total counter',
+        ]
+        for reason, count in shed:
+            lines.append('news_http_shed_total{{{}}} {}'.format(format_labels(reason=reason), count))
+        for metric, stat, metric_type, help_text in CACHE_METRICS:
+            lines += [
+                '# HELP {} {}'.format(metric, help_text),
+                '# TYPE {} {}'.format(metric, metric_type),
+            ]
+            for name, stats in cache_stats:
+                lines.append('{}{{{}}} {}'.format(metric, format_labels(cache=name), stats[stat]))
+        return '\n'.join(lines) + '\n'
+
+
+def copy_histogram(histogram: Histogram) -> Histogram:
+    copied = Histogram(histogram.bounds)
+    copied.counts = list(histogram.counts)
+    copied.sum = histogram.sum
+    copied.count = histogram.count
+    return copied
+
+
+def escape_label(value) -> str:
+    return str(value).replace('\\', '\\\\').replace('"', '\\"').replace('\n', '\\n')
+
+
+def format_labels(**labels) -> str:
+    return ','.join('{}="{}"'.format(name, escape_label(value)) for name, value in labels.items())
+
+
+def format_histogram(name: str, histogram: Histogram, **labels) -> Iterable[str]:
+    """
+    Writes the bucket, sum and count samples of a histogram
+    :param name: metric name
+    :param histogram:
+    :param labels:
+    :return: lines
+    """
+    labels_string = format_labels(**labels)
+    bounds = [repr(bound) for bound in histogram.bounds] + ['+Inf']
+    for bound, count in zip(bounds, histogram.cumulative_counts()):
+        yield '{}_bucket{{{},le="{}"}} {}'.format(name, labels_string, bound, count)
+    yield '{}_sum{{{}}} {!r}'.format(name, labels_string, histogram.sum)
+    yield '{}_count{{{}}} {}'.format(name, labels_string, histogram.count)
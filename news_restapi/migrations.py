@@ -0,0 +1,208 @@
+import argparse
+from datetime import datetime
+from typing import List, Tuple
+
+from news_restapi.models import News, Comment
+from news_restapi.repositories import NewsRepository, CommentRepository, get_connection
+
+# recomputes the maintained news.comment_count, only rows that are off get written
+REPAIR_COMMENT_COUNTS = (
+    'UPDATE news SET comment_count = (SELECT COUNT(*) FROM comment WHERE comment.news_id = news.id) '
+    'WHERE comment_count != (SELECT COUNT(*) FROM comment WHERE comment.news_id = news.id)'
+)
+
+# Versioned schema changes applied on top of db/schema.sql, the applied version
+# is kept in PRAGMA user_version. Entries are (version, description, statements).
+MIGRATIONS = [
+    (1, 'Index comments by news', (
+        'CREATE INDEX IF NOT EXISTS comment_news_id_id_idx ON comment (news_id, id)',
+    )),
+    (2, 'Index news by modification date', (
+        'CREATE INDEX IF NOT EXISTS news_modified_date_idx ON news (modified_date)',
+    )),
+    (3, 'Full-text index of news', (
+        "CREATE VIRTUAL TABLE IF NOT EXISTS news_fts USING fts5(title, content, content='news', content_rowid='id')",
+        'CREATE TRIGGER IF NOT EXISTS news_fts_insert AFTER INSERT ON news BEGIN '
+        'INSERT INTO news_fts (rowid, title, content) VALUES (new.id, new.title, new.content); END',
+        'CREATE TRIGGER IF NOT EXISTS news_fts_delete AFTER DELETE ON news BEGIN '
+        "INSERT INTO news_fts (news_fts, rowid, title, content) VALUES ('delete', old.id, old.title, old.content); END",
+        'CREATE TRIGGER IF NOT EXISTS news_fts_update AFTER UPDATE OF title, content ON news BEGIN '
+        "INSERT INTO news_fts (news_fts, rowid, title, content) VALUES ('delete', old.id, old.title, old.content); "
+        'INSERT INTO news_fts (rowid, title, content) VALUES (new.id, new.title, new.content); END',
+        "INSERT INTO news_fts (news_fts) VALUES ('rebuild')",
+    )),
+    (4, 'Count comments of news', (
+        'ALTER TABLE news ADD COLUMN comment_count INTEGER NOT NULL DEFAULT 0',
+        'CREATE TRIGGER IF NOT EXISTS comment_count_insert AFTER INSERT ON comment BEGIN '
+        'UPDATE news SET comment_count = comment_count + 1 WHERE id = new.news_id; END',
+        'CREATE TRIGGER IF NOT EXISTS comment_count_delete AFTER DELETE ON comment BEGIN '
+        'UPDATE news SET comment_count = comment_count - 1 WHERE id = old.news_id; END',
+        'CREATE TRIGGER IF NOT EXISTS comment_count_update AFTER UPDATE OF news_id ON comment '
+        'WHEN old.news_id != new.news_id BEGIN '
+        'UPDATE news SET comment_count = comment_count - 1 WHERE id = old.news_id; '
+        'UPDATE news SET comment_count = comment_count + 1 WHERE id = new.news_id; END',
+        REPAIR_COMMENT_COUNTS,
+    )),
+]
+
+
+def get_version(conn) -> int:
+    return conn.execute('PRAGMA user_version').fetchone()[0]
+
+
+def migrate(conn) -> List[int]:
+    """
+    Applies pending migrations, each one in its own transaction
+    :param conn: connection in autocommit mode
+    :return: versions applied
+    """
+    applied = []
+    current = get_version(conn)
+    for version, description, statements in MIGRATIONS:
+        if version <= current:
+            continue
+        conn.execute('BEGIN IMMEDIATE')
+        try:
+            for statement in statements:
+                conn.execute(statement)
+            conn.execute('PRAGMA user_version = {:d}'.format(version))
+            conn.execute('COMMIT')
+        except Exception:
+            conn.execute('ROLLBACK')
+            raise
+        applied.append(version)
+    return applied
+
+
+def migrate_database() -> List[int]:
+    """
+    Applies pending migrations to the configured database
+    :return: versions applied
+    """
+    conn = get_connection()
+    try:
+        return migrate(conn)
+    finally:
+        conn.close()
+
+
+def repair_comment_counts(conn) -> int:
+    """
+    Recomputes news.comment_count from the comments, e.g. after the triggers were bypassed
+    :param conn: connection in autocommit mode
+    :return: number of news fixed
+    """
+    conn.execute('BEGIN IMMEDIATE')
+    try:
+        fixed = conn.execute(REPAIR_COMMENT_COUNTS).rowcount
+        conn.execute('COMMIT')
+    except Exception:
+        conn.execute('ROLLBACK')
+        raise
+    return fixed
+
+
+def run_repository_queries(conn) -> None:
+    """
+    Calls every repository method once, used to collect the queries they run
+    :param conn:
+    :return:
+    """
+    news_repository = NewsRepository(connection=conn)
+    comment_repository = CommentRepository(connection=conn)
+    dt = datetime.now()
+    news = news_repository.add_news(News(id=None, created_date=dt, modified_date=dt, title='', content=''))
+    news_repository.list_news(1)
+    news_repository.list_news(1, news.id)
+    news_repository.get_news_page_end(1, news.id)
+    news_repository.search_news('title', 1)
+    news_repository.search_news('title', 1, (0.0, news.id))
+    list(news_repository.iter_news(news.id + 1, news.id, 1))
+    news_repository.get_news(news.id)
+    news_repository.get_news_with_comments(news.id, 1)
+    news_repository.update_news(news)
+    comment = comment_repository.add_comment(
+        Comment(id=None, created_date=dt, modified_date=dt, news_id=news.id, content='')
+    )
+    comment_repository.get_comments_for_news(news.id, 1)
+    comment_repository.get_comments_for_news(news.id, 1, comment.id)
+    comment_repository.get_comments_page_end(news.id, 1, comment.id)
+    list(comment_repository.iter_comments_for_news(news.id, comment.id + 1, comment.id, 1))
+    comment_repository.get_comment(comment.id)
+    comment_repository.update_comment(comment)
+    comment_repository.get_comment_many([comment.id])
+    comment_repository.update_comment_many([comment])
+    comment_repository.delete_comment_many([comment])
+    comment_repository.add_comment_many([comment])
+    comment_repository.delete_comment(comment)
+    news_repository.get_news_many([news.id])
+    news_repository.update_news_many([news])
+    news_repository.delete_news(news)
+    news_repository.add_news_many([news])
+    news_repository.delete_news_many([news])
+    news_repository.import_many([news])
+    comment.news_id = news.id
+    comment_repository.import_many([comment])
+    # an export reads every row, the news scan is expected
+    list(news_repository.iter_all_news())
+    list(comment_repository.iter_all_comments())
+
+
+def explain_queries(conn) -> List[Tuple[str, List[str]]]:
+    """
+    Collects the query plan of every repository query. The queries run in a transaction
+    that is rolled back, so the database is not changed.
+    :param conn: connection in autocommit mode
+    :return: list of (query, plan lines)
+    """
+    statements = []
+    conn.execute('BEGIN')
+    conn.set_trace_callback(statements.append)
+    try:
+        run_repository_queries(conn)
+    finally:
+        conn.set_trace_callback(None)
+        conn.execute('ROLLBACK')
+
+    plans = []
+    for statement in dict.fromkeys(statements):
+        if not statement.startswith(('SELECT', 'INSERT', 'UPDATE', 'DELETE')):
+            continue
+        # statements FTS5 runs on its shadow tables name the schema, e.g. 'main'.'news_fts_config'
+        if "'main'." in statement:
+            continue
+        rows = conn.execute('EXPLAIN QUERY PLAN {}'.format(statement)).fetchall()
+        plans.append((statement, [row[-1] for row in rows]))
+    return plans
+
+
+def is_full_scan(plan_line: str) -> bool:
+    # a virtual table scan is a lookup in the table's own index, e.g. an FTS5 MATCH
+    return plan_line.startswith('SCAN ') and ' USING ' not in plan_line and plan_line != 'SCAN CONSTANT ROW' \
+        and ' VIRTUAL TABLE ' not in plan_line
+
+
+def main():
+    parser = argparse.ArgumentParser(description='Apply schema migrations')
+    parser.add_argument('--explain', action='store_true', help='print query plans of repository queries')
+    parser.add_argument('--repair-counts', action='store_true', help='recompute comment counts of news')
+    args = parser.parse_args()
+
+    conn = get_connection()
+    try:
+        for version in migrate(conn):
+            print('Applied migration {}'.format(version))
+        print('Schema version {}'.format(get_version(conn)))
+        if args.explain:
+            for statement, plan in explain_queries(conn):
+                print(statement)
+                for line in plan:
+                    print('  {} {}'.format('!' if is_full_scan(line) else ' ', line))
+        if args.repair_counts:
+            print('Fixed comment counts of {} news'.format(repair_comment_counts(conn)))
+    finally:
+        conn.close()
+
+
+if __name__ == '__main__':
+    main()
@@ -1,7 +1,27 @@
-from dataclasses import dataclass
+from dataclasses import dataclass, field, fields, replace
 from datetime import datetime
+from typing import List
 
 
+def slotted(cls):
+    """
+    Rebuilds a dataclass with __slots__ for the fields it adds, objects then have no __dict__.
+    dataclass(slots=True) does the same but needs Python 3.10.
+    :param cls: dataclass
+    :return: new class
+    """
+    inherited = {name for base in cls.__mro__[1:] for name in getattr(base, '__slots__', ())}
+    names = tuple(f.name for f in fields(cls) if f.name not in inherited)
+    namespace = dict(cls.__dict__)
+    namespace['__slots__'] = names
+    for name in names:
+        namespace.pop(name, None)
+    namespace.pop('__dict__', None)
+    namespace.pop('__weakref__', None)
+    return type(cls)(cls.__name__, cls.__bases__, namespace)
+
+
+@slotted
 @dataclass
 class Base:
     id: int
@@ -9,13 +29,33 @@ class Base:
     modified_date: datetime
 
 
+@slotted
 @dataclass
 class News(Base):
     title: str
     content: str
+    # maintained by the database from the comments of the news
+    comment_count: int = 0
 
 
+@slotted
 @dataclass
 class Comment(Base):
     news_id: int
     content: str
+
+
+@slotted
+@dataclass
+class NewsSearchHit(News):
+    snippet: str = ''
+
+
+@slotted
+@dataclass
+class NewsWithComments(News):
+    comments: List[Comment] = field(default_factory=list)
+
+    def __copy__(self):
+        # copies of cached objects may be modified, the comments are copied too
+        return replace(self, comments=[replace(comment) for comment in self.comments])
@@ -0,0 +1,160 @@
+import base64
+import binascii
+import json
+from typing import Iterator, Optional, Tuple
+
+from news_restapi import exceptions, settings
+
+
+class Page(list):
+    """
+    A page of objects, next_cursor is None on the last page
+    """
+    def __init__(self, items, limit: int, next_cursor: str = None):
+        super().__init__(items)
+        self.limit = limit
+        self.next_cursor = next_cursor
+
+
+class StreamPage:
+    """
+    A page of objects read lazily, iterating it consumes the underlying generator
+    """
+    def __init__(self, items: Iterator, limit: int, next_cursor: str = None):
+        self.items = items
+        self.limit = limit
+        self.next_cursor = next_cursor
+
+    def __iter__(self) -> Iterator:
+        return self.items
+
+    def close(self) -> None:
+        close = getattr(self.items, 'close', None)
+        if close is not None:
+            close()
+
+
+def encode_cursor(position: dict) -> str:
+    """
+    Encodes a position in a listing to an opaque cursor
+    :param position: e.g. {'id': 10}
+    :return: cursor
+    """
+    data = json.dumps(position, separators=(',', ':')).encode()
+    return base64.urlsafe_b64encode(data).decode().rstrip('=')
+
+
+def decode_cursor(cursor: str) -> dict:
+    """
+    Decodes a cursor made by encode_cursor
+    :param cursor:
+    :return: position
+    """
+    try:
+        data = base64.urlsafe_b64decode(cursor + '=' * (-len(cursor) % 4))
+        position = json.loads(data.decode())
+    except (binascii.Error, UnicodeDecodeError, ValueError):
+        position = None
+    if not isinstance(position, dict):
+        raise exceptions.ValidationError(json.dumps({'cursor': 'Invalid cursor'}))
+    return position
+
+
+def get_limit(query: dict, name: str = 'limit') -> int:
+    """
+    Reads a limit query parameter, capped by settings.MAX_PAGE_SIZE
+    :param query: query parameters
+    :param name: parameter name
+    :return: limit
+    """
+    limit = query.get(name)
+    if limit is None:
+        limit = settings.PAGE_SIZE
+    else:
+        try:
+            limit = int(limit)
+        except ValueError:
+            limit = 0
+        if limit < 1:
+            raise exceptions.ValidationError(json.dumps({name: 'Must be a positive integer'}))
+    return min(limit, settings.MAX_PAGE_SIZE)
+
+
+def get_page_params(query: dict) -> Tuple[int, int]:
+    """
+    Reads limit and cursor query parameters, the limit is capped by settings.MAX_PAGE_SIZE
+    :param query: query parameters
+    :return: limit and id to list objects before (None for the first page)
+    """
+    limit = get_limit(query)
+    before_id = None
+    cursor = query.get('cursor')
+    if cursor:
+        before_id = decode_cursor(cursor).get('id')
+        if not isinstance(before_id, int):
+            raise exceptions.ValidationError(json.dumps({'cursor': 'Invalid cursor'}))
+    return limit, before_id
+
+
+def get_search_params(query: dict) -> Tuple[int, Optional[Tuple[float, int]]]:
+    """
+    Reads limit and cursor query parameters of a search, see make_search_page
+    :param query: query parameters
+    :return: limit and score and id to list hits after (None for the first page)
+    """
+    limit = get_limit(query)
+    after = None
+    cursor = query.get('cursor')
+    if cursor:
+        position = decode_cursor(cursor)
+        score, hit_id = position.get('score'), position.get('id')
+        if not isinstance(score, (int, float)) or isinstance(score, bool) or not isinstance(hit_id, int):
+            raise exceptions.ValidationError(json.dumps({'cursor': 'Invalid cursor'}))
+        after = (score, hit_id)
+    return limit, after
+
+
+def make_page(objects: list, limit: int) -> Page:
+    """
+    Builds a page from up to limit + 1 model objects fetched in id descending order
+    :param objects:
+    :param limit:
+    :return: page
+    """
+    if len(objects) > limit:
+        return Page(objects[:limit], limit, encode_cursor({'id': objects[limit - 1].id}))
+    return Page(objects, limit)
+
+
+def make_search_page(hits: list, limit: int) -> Page:
+    """
+    Builds a page from up to limit + 1 search hits with their scores, best first
+    :param hits: (hit, score) pairs
+    :param limit:
+    :return: page of hits
+    """
+    page = make_page([hit for hit, score in hits], limit)
+    if page.next_cursor:
+        hit, score = hits[limit - 1]
+        page.next_cursor = encode_cursor({'score': score, 'id': hit.id})
+    return page
+
+
+def make_stream_page(items: Iterator, limit: int, last_id: Optional[int]) -> StreamPage:
+    """
+    Builds a streamed page
+    :param items: generator of model objects in id descending order
+    :param limit:
+    :param last_id: id of the last object on the page when more objects follow, see Repository.get_page_end
+    :return: page
+    """
+    return StreamPage(items, limit, encode_cursor({'id': last_id}) if last_id is not None else None)
+
+
+def is_streamed(limit: int) -> bool:
+    """
+    Whether a page is large enough to be streamed rather than fetched at once
+    :param limit:
+    :return:
+    """
+    return settings.STREAM_PAGE_SIZE > 0 and limit > settings.STREAM_PAGE_SIZE
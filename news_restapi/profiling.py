@@ -0,0 +1,156 @@
+import cProfile
+import hmac
+import io
+import itertools
+import pstats
+import re
+import sys
+import threading
+import time
+from collections import Counter
+from pathlib import Path
+from typing import Any, Callable, Optional, Tuple
+
+# header of requests asking to be profiled, its value is the configured secret
+PROFILE_HEADER = 'X-Profile'
+
+
+def profile_file_name(prefix: str, label: str, extension: str) -> str:
+    """
+    A file name telling when and what was profiled
+    :param prefix: e.g. 'request'
+    :param label: e.g. 'GET /news/', reduced to letters, digits and dashes
+    :param extension:
+    :return: file name
+    """
+    label = re.sub(r'[^\w]+', '-', label).strip('-')[:60]
+    return '{}-{}-{:06d}-{}.{}'.format(
+        prefix, time.strftime('%Y%m%d-%H%M%S'), int(time.time() * 1e6) % 1000000, label, extension
+    )
+
+
+class RequestProfiler:
+    """
+    Profiles one request in every, and requests carrying the secret in an X-Profile header, with cProfile.
+    Profiles are saved as pstats files (python -m pstats <file>). One request is profiled at a time,
+    others arriving meanwhile run unprofiled.
+    """
+    def __init__(self, every: int = 0, secret: str = '', directory: str = None, top: int = 25):
+        self.every = every
+        self.secret = secret
+        self.directory = directory
+        self.top = top
+        self.profiled = 0
+        self._counter = itertools.count(1)
+        self._lock = threading.Lock()
+
+    def is_requested(self, headers) -> bool:
+        """
+        Whether a request asks to be profiled
+        :param headers: request headers
+        :return:
+        """
+        value = headers.get(PROFILE_HEADER)
+        return bool(self.secret) and value is not None and hmac.compare_digest(value.encode(), self.secret.encode())
+
+    def is_sampled(self) -> bool:
+        """
+        Whether the next request is profiled, true for one in every
+        :return:
+        """
+        return self.every > 0 and next(self._counter) % self.every == 0
+
+    def profile(self, function: Callable, *args) -> Tuple[Any, Optional[pstats.Stats]]:
+        """
+        Runs a function under cProfile, or unprofiled if another profile is running
+        :param function:
+        :param args:
+        :return: the function's result and its profile, None if it was not profiled
+        """
+        if not self._lock.acquire(blocking=False):
+            return function(*args), None
+        try:
+            profile = cProfile.Profile()
+            result = profile.runcall(function, *args)
+            self.profiled += 1
+            return result, pstats.Stats(profile)
+        finally:
+            self._lock.release()
+
+    def save(self, stats: pstats.Stats, label: str) -> Optional[str]:
+        """
+        Saves a profile in the directory
+        :param stats:
+        :param label: e.g. the method and path of the request
+        :return: file path, None without a directory
+        """
+        if not self.directory:
+            return None
+        directory = Path(self.directory)
+        directory.mkdir(parents=True, exist_ok=True)
+        path = directory / profile_file_name('request', label, 'pstats')
+        stats.dump_stats(str(path))
+        return str(path)
+
+    def summary(self, stats: pstats.Stats) -> str:
+        """
+        Lists the functions taking the most cumulative time
+        :param stats:
+        :return: text
+        """
+        stream = io.StringIO()
+        stats.stream = stream
+        stats.sort_stats('cumulative').print_stats(self.top)
+        return stream.getvalue()
+
+
+class StackSampler:
+    """
+    Samples the stacks of every thread of the process every interval seconds over a window,
+    which unlike cProfile sees all threads and costs little. The samples are saved as folded stacks,
+    one 'outer;...;inner count' line per stack, as flame graph tools read them.
+    """
+    def __init__(self, seconds: float, interval: float, directory: str):
+        self.seconds = seconds
+        self.interval = interval
+        self.directory = directory
+        self.samples = Counter()
+        self.thread = None
+
+    def start(self) -> None:
+        self.thread = threading.Thread(target=self.run, name='stack-sampler', daemon=True)
+        self.thread.start()
+
+    def run(self) -> Optional[str]:
+        """
+        Samples for the window and saves the samples
+        :return: file path
+        """
+        deadline = time.monotonic() + self.seconds
+        while time.monotonic() < deadline:
+            self.sample()
+            time.sleep(self.interval)
+        return self.save()
+
+    def sample(self) -> None:
+        current = threading.get_ident()
+        for thread_id, frame in sys._current_frames().items():
+            if thread_id == current:
+                continue
+            stack = []
+            while frame is not None:
+                code = frame.f_code
+                stack.append('{}:{}'.format(Path(code.co_filename).name, code.co_name))
+                frame = frame.f_back
+            self.samples[';'.join(reversed(stack))] += 1
+
+    def save(self) -> Optional[str]:
+        if not self.directory:
+            return None
+        directory = Path(self.directory)
+        directory.mkdir(parents=True, exist_ok=True)
+        path = directory / profile_file_name('process', '{}s'.format(self.seconds), 'folded')
+        with open(str(path), 'w') as folded_file:
+            for stack, count in self.samples.most_common():
+                folded_file.write('{} {}\n'.format(stack, count))
+        return str(path)
@@ -0,0 +1,98 @@
+import json
+import os
+import queue
+import random
+import threading
+import time
+from typing import Optional
+
+
+class TrafficRecorder:
+    """
+    Records a sample of the requests served as JSON lines, one
+    {"time", "method", "path", "body", "status", "size", "latency_ms"} object per request.
+    Request threads only queue records, a background thread writes them to the file in batches.
+    When the queue is full records are dropped rather than slowing requests down.
+    A forked process gets a writer thread of its own, batches are appended with one write each
+    so that processes recording to the same file do not interleave their lines.
+    """
+    def __init__(self, path: str, sample_rate: float = 1.0, queue_size: int = 10000, rng: random.Random = None):
+        self.path = path
+        self.sample_rate = sample_rate
+        self.rng = rng or random.Random()
+        self.queue_size = queue_size
+        self.recorded = 0
+        self.dropped = 0
+        self.closed = False
+        self.start()
+        if hasattr(os, 'register_at_fork'):
+            os.register_at_fork(after_in_child=self.after_fork)
+
+    def start(self) -> None:
+        """
+        Starts the writer thread with an empty queue
+        :return:
+        """
+        self._queue = queue.Queue(self.queue_size)
+        self._thread = threading.Thread(target=self.write_records, name='traffic-recorder', daemon=True)
+        self._thread.start()
+
+    def after_fork(self) -> None:
+        # the writer thread was not forked, records queued before the fork are the parent's to write
+        if not self.closed:
+            self.start()
+
+    def record(self, method: str, path: str, body: Optional[bytes], status: int, size: int, seconds: float) -> None:
+        """
+        Queues a record of a served request, if it is sampled
+        :param method:
+        :param path: path with the query string
+        :param body: request body, None if it was not kept
+        :param status:
+        :param size: bytes of response body sent
+        :param seconds: time the server took
+        :return:
+        """
+        if self.sample_rate < 1 and self.rng.random() >= self.sample_rate:
+            return
+        record = {
+            'time': time.time(),
+            'method': method,
+            'path': path,
+            'body': body.decode('utf-8', 'replace') if body else None,
+            'status': status,
+            'size': size,
+            'latency_ms': round(seconds * 1000, 3),
+        }
+        try:
+            self._queue.put_nowait(record)
+        except queue.Full:
+            self.dropped += 1
+
+    def write_records(self) -> None:
+        records = self._queue
+        with open(self.path, 'ab', buffering=0) as log_file:
+            while True:
+                record = records.get()
+                # write what has queued up meanwhile in the same batch
+                lines = []
+                while record is not None:
+                    lines.append(json.dumps(record, sort_keys=True) + '\n')
+                    try:
+                        record = records.get_nowait()
+                    except queue.Empty:
+                        break
+                if lines:
+                    log_file.write(''.join(lines).encode())
+                    self.recorded += len(lines)
+                if record is None:
+                    return
+
+    def close(self) -> None:
+        """
+        Writes the queued records and stops the writer thread
+        :return:
+        """
+        self.closed = True
+        self._queue.put(None)
+        self._thread.join()
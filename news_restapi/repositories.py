@@ -1,15 +1,54 @@
+import copy
+import functools
+import os
+import queue
 import sqlite3
-from pathlib import Path, PurePath
-from typing import List, Any, Tuple
+import threading
+import time
+import urllib.request
+from concurrent.futures import Future, TimeoutError
+from contextlib import contextmanager
+from typing import List, Any, Tuple, Callable, Dict, Iterable, Iterator, Optional, Union
 from datetime import datetime
 
-from news_restapi.models import News, Comment
+from news_restapi import settings
+from news_restapi.cache import LRUCache
+from news_restapi.metrics import Metrics
+from news_restapi.models import News, Comment, NewsSearchHit, NewsWithComments
 from news_restapi.utils import datetime_to_timestamp, timestamp_to_datetime
 
 
 def get_connection():
-    db_path = Path(__file__).parent.parent / PurePath('db/news.db')
-    return sqlite3.connect(db_path, isolation_level=None)
+    conn = sqlite3.connect(settings.DB_PATH, isolation_level=None, check_same_thread=False)
+    configure_connection(conn)
+    return conn
+
+
+def get_read_connection():
+    """
+    Opens a read-only connection (mode=ro), which never takes the write lock. With WAL it reads
+    while a write is in progress rather than waiting for it.
+    """
+    uri = 'file:{}?mode=ro'.format(urllib.request.pathname2url(settings.DB_PATH))
+    conn = sqlite3.connect(uri, uri=True, isolation_level=None, check_same_thread=False)
+    configure_connection(conn, read_only=True)
+    return conn
+
+
+def configure_connection(conn, read_only: bool = False) -> None:
+    """
+    Applies the configured pragmas to a connection
+    :param conn:
+    :param read_only: the connection cannot set the journal mode, read-write connections do
+    :return:
+    """
+    if not read_only:
+        conn.execute('PRAGMA journal_mode = {}'.format(settings.DB_JOURNAL_MODE))
+        conn.execute('PRAGMA synchronous = {}'.format(settings.DB_SYNCHRONOUS))
+    conn.execute('PRAGMA mmap_size = {:d}'.format(settings.DB_MMAP_SIZE))
+    conn.execute('PRAGMA cache_size = {:d}'.format(settings.DB_CACHE_SIZE))
+    conn.execute('PRAGMA busy_timeout = {:d}'.format(settings.DB_BUSY_TIMEOUT))
+    conn.execute('PRAGMA foreign_keys = ON')
 
 
 class RepositoryException(Exception):
@@ -18,21 +57,436 @@ class RepositoryException(Exception):
         self._errors = errors
 
 
+class ConstraintViolation(RepositoryException):
+    pass
+
+
+class ConnectionPool:
+    """
+    A bounded pool of connections. Connections are opened on demand up to the pool size,
+    checked out to one thread at a time and kept open when returned.
+    """
+    def __init__(self, size: int, factory=get_connection, timeout: float = None):
+        self.size = size
+        self.factory = factory
+        self.timeout = timeout
+        self._idle = queue.LifoQueue()
+        self._opened = 0
+        self._lock = threading.Lock()
+
+    def acquire(self):
+        try:
+            return self._idle.get_nowait()
+        except queue.Empty:
+            pass
+        with self._lock:
+            can_open = self._opened < self.size
+            if can_open:
+                self._opened += 1
+        if can_open:
+            try:
+                return self.factory()
+            except Exception:
+                with self._lock:
+                    self._opened -= 1
+                raise
+        try:
+            return self._idle.get(timeout=self.timeout)
+        except queue.Empty:
+            raise RepositoryException('No free connection in the pool')
+
+    def release(self, conn) -> None:
+        if conn.in_transaction:
+            conn.rollback()
+        self._idle.put(conn)
+
+    @contextmanager
+    def connection(self):
+        conn = self.acquire()
+        try:
+            yield conn
+        finally:
+            self.release(conn)
+
+    def close(self) -> None:
+        while True:
+            try:
+                conn = self._idle.get_nowait()
+            except queue.Empty:
+                break
+            with self._lock:
+                self._opened -= 1
+            conn.close()
+
+
+@contextmanager
+def transaction(conn):
+    """
+    Runs statements in a transaction, or in a savepoint if one is already open
+    :param conn: connection in autocommit mode
+    :return:
+    """
+    if conn.in_transaction:
+        conn.execute('SAVEPOINT nested')
+        try:
+            yield conn
+        except BaseException:
+            conn.execute('ROLLBACK TO nested')
+            conn.execute('RELEASE nested')
+            raise
+        conn.execute('RELEASE nested')
+    else:
+        conn.execute('BEGIN IMMEDIATE')
+        try:
+            yield conn
+        except BaseException:
+            conn.execute('ROLLBACK')
+            raise
+        try:
+            conn.execute('COMMIT')
+        except BaseException:
+            # a failed COMMIT, e.g. a deferred foreign key violation, leaves the transaction open
+            if conn.in_transaction:
+                conn.execute('ROLLBACK')
+            raise
+
+
+_pool = None
+_pool_lock = threading.Lock()
+
+
+def get_pool() -> ConnectionPool:
+    """
+    Returns the default connection pool, creating it on first use
+    :return: pool
+    """
+    global _pool
+    with _pool_lock:
+        if _pool is None:
+            _pool = ConnectionPool(settings.DB_POOL_SIZE, timeout=settings.DB_POOL_TIMEOUT)
+        return _pool
+
+
+class WriteQueue:
+    """
+    Group commit: writes submitted by many threads are run in one transaction, committed when
+    max_writes are queued or the oldest write has waited max_delay seconds, whichever comes first.
+    Every write runs in its own savepoint, so a failing write does not fail the others of its group.
+    Writers get their results only once the transaction is committed.
+    flush_due() is meant to be called periodically (see server.service_worker), a writer whose
+    group was not committed within max_delay commits it itself.
+    """
+    def __init__(self, max_delay: float, max_writes: int, pool: ConnectionPool = None, clock=time.monotonic):
+        self.max_delay = max_delay
+        self.max_writes = max_writes
+        self.pool = pool
+        self.clock = clock
+        self.commits = 0
+        self.writes = 0
+        self._pending = []  # (queued time, operation, future)
+        self._lock = threading.Lock()
+        self._flush_lock = threading.Lock()
+
+    def submit(self, operation: Callable[[Any], Any]) -> Any:
+        """
+        Queues a write and waits for it to be committed
+        :param operation: runs the write on the connection it is given, e.g. lambda conn: conn.execute(...)
+        :return: what the operation returned, exceptions it raised are raised here
+        """
+        future = Future()
+        with self._lock:
+            self._pending.append((self.clock(), operation, future))
+            full = len(self._pending) >= self.max_writes
+        if full:
+            self.flush()
+        else:
+            try:
+                return future.result(self.max_delay)
+            except TimeoutError:
+                self.flush()
+        return future.result()
+
+    def flush_due(self) -> None:
+        """
+        Commits the queued writes if the oldest of them has waited max_delay
+        :return:
+        """
+        with self._lock:
+            due = bool(self._pending) and self._pending[0][0] + self.max_delay <= self.clock()
+        if due:
+            self.flush()
+
+    def flush(self) -> None:
+        """
+        Runs the queued writes in one transaction and commits it
+        :return:
+        """
+        with self._flush_lock:
+            with self._lock:
+                batch, self._pending = self._pending, []
+            if not batch:
+                return
+            futures = [future for _, _, future in batch]
+            try:
+                with (self.pool or get_pool()).connection() as conn:
+                    outcomes = commit_group(conn, [operation for _, operation, _ in batch])
+            except Exception as e:
+                # the group was not committed, none of its writes took effect
+                for future in futures:
+                    future.set_exception(e)
+                return
+            self.commits += 1
+            self.writes += len(batch)
+            settle(futures, outcomes)
+
+
+class WriterThread:
+    """
+    Runs every write on one dedicated thread and read-write connection, so writes never wait for each other's
+    write lock and readers on read-only connections (see get_read_connection) never wait for writes.
+    The writes queued while a group is committed make up the next group, committed in one transaction
+    with a savepoint each as WriteQueue does; with max_delay the thread also waits that long for a group to fill.
+    The thread and its connection are started by the first write of a process.
+    """
+    def __init__(self, max_delay: float = 0, max_writes: int = 100, factory=get_connection):
+        self.max_delay = max_delay
+        self.max_writes = max_writes
+        self.factory = factory
+        self.commits = 0
+        self.writes = 0
+        self._queue = None
+        self._thread = None
+        self._pid = None
+        self._lock = threading.Lock()
+
+    def submit(self, operation: Callable[[Any], Any]) -> Any:
+        """
+        Queues a write and waits for it to be committed
+        :param operation: runs the write on the connection it is given, e.g. lambda conn: conn.execute(...)
+        :return: what the operation returned, exceptions it raised are raised here
+        """
+        if self._pid != os.getpid():
+            self.start()
+        future = Future()
+        self._queue.put((operation, future))
+        return future.result()
+
+    def start(self) -> None:
+        with self._lock:
+            # a forked process has no writer thread, it starts its own
+            if self._pid == os.getpid():
+                return
+            # opened here so that a failure is raised to the writer rather than lost in the thread
+            conn = self.factory()
+            self._queue = queue.Queue()
+            self._thread = threading.Thread(target=self.run, args=(conn, self._queue), name='db-writer', daemon=True)
+            self._thread.start()
+            self._pid = os.getpid()
+
+    def run(self, conn, writes: queue.Queue) -> None:
+        try:
+            while True:
+                group = self.next_group(writes)
+                if not group:
+                    return
+                futures = [future for _, future in group]
+                try:
+                    outcomes = commit_group(conn, [operation for operation, _ in group])
+                except Exception as e:
+                    # the next group must not run inside what is left of this one
+                    if conn.in_transaction:
+                        conn.rollback()
+                    for future in futures:
+                        future.set_exception(e)
+                    continue
+                self.commits += 1
+                self.writes += len(group)
+                settle(futures, outcomes)
+        finally:
+            conn.close()
+
+    def next_group(self, writes: queue.Queue) -> List[Tuple[Callable[[Any], Any], Future]]:
+        """
+        Waits for a write and takes the ones queued behind it, up to max_writes
+        :param writes:
+        :return: operations and their futures, empty once the thread is stopped
+        """
+        write = writes.get()
+        group = []
+        deadline = time.monotonic() + self.max_delay
+        while write is not None:
+            group.append(write)
+            if len(group) >= self.max_writes:
+                break
+            try:
+                timeout = deadline - time.monotonic()
+                write = writes.get(timeout=timeout) if timeout > 0 else writes.get_nowait()
+            except queue.Empty:
+                break
+        if write is None and group:
+            # stop once this group is committed
+            writes.put(None)
+        return group
+
+    def close(self) -> None:
+        """
+        Commits the queued writes and stops the thread
+        :return:
+        """
+        with self._lock:
+            if self._pid != os.getpid():
+                return
+            self._queue.put(None)
+            self._thread.join()
+            self._pid = None
+
+
+def commit_group(conn, operations: List[Callable[[Any], Any]]) -> List[Tuple[Any, Optional[Exception]]]:
+    """
+    Runs writes in one transaction and commits it. Every write runs in its own savepoint,
+    so a failing write does not fail the others.
+    :param conn: connection in autocommit mode
+    :param operations:
+    :return: the result and the exception of every write, raises if the transaction was not committed
+    """
+    if len(operations) == 1:
+        # a write alone needs no savepoint, its failure rolls the transaction back
+        with transaction(conn):
+            return [(operations[0](conn), None)]
+    outcomes = []
+    with transaction(conn):
+        for operation in operations:
+            try:
+                with transaction(conn):
+                    outcomes.append((operation(conn), None))
+            except Exception as e:
+                outcomes.append((None, e))
+    return outcomes
+
+
+def settle(futures: List[Future], outcomes: List[Tuple[Any, Optional[Exception]]]) -> None:
+    for future, (result, error) in zip(futures, outcomes):
+        if error is not None:
+            future.set_exception(error)
+        else:
+            future.set_result(result)
+
+
+class DataVersionWatcher:
+    """
+    Keeps a cache coherent with writes made by other processes. PRAGMA data_version of a connection
+    changes whenever another connection commits to the database, whichever process it belongs to,
+    so checking it before serving from the cache is enough to see those writes. What changed is not known,
+    the whole cache is cleared, also after writes of this process (they are made on other connections).
+    """
+    def __init__(self, cache: LRUCache, factory=get_connection):
+        self.cache = cache
+        self.factory = factory
+        self.clears = 0
+        self._conn = None
+        self._version = None
+        self._lock = threading.Lock()
+
+    def check(self) -> bool:
+        """
+        Clears the cache if the database changed since the last check
+        :return: whether it was cleared
+        """
+        with self._lock:
+            if self._conn is None:
+                # opened on first use, so in the process that uses it
+                self._conn = self.factory()
+            version = self._conn.execute('PRAGMA data_version').fetchone()[0]
+            changed = self._version is not None and version != self._version
+            self._version = version
+        if changed:
+            self.cache.clear()
+            self.clears += 1
+        return changed
+
+
+def timed(method):
+    """
+    Records the time a repository method takes in the repository's metrics, if it has them
+    :param method:
+    :return: wrapped method
+    """
+    name = method.__name__
+
+    @functools.wraps(method)
+    def wrapper(self, *args, **kwargs):
+        if self.metrics is None:
+            return method(self, *args, **kwargs)
+        started = time.perf_counter()
+        try:
+            return method(self, *args, **kwargs)
+        finally:
+            self.metrics.observe_query(self.table_name, name, time.perf_counter() - started)
+
+    return wrapper
+
+
 class Repository:
     """
-    A Base repository class for storing objects in a database table
+    A Base repository class for storing objects in a database table.
+    Without an explicit connection every query checks a connection out of a pool,
+    reads out of the read pool if there is one.
+    An optional cache, shared by the repositories, serves hot reads.
+    An optional write queue, shared by the repositories, commits writes in groups.
+    Optional metrics record the time spent by the methods querying the database (see timed).
     """
-    def __init__(self, table_name: str, columns: Tuple[str, ...], connection=None):
+    def __init__(self, table_name: str, columns: Tuple[str, ...], connection=None, pool: ConnectionPool = None,
+                 cache: LRUCache = None, read_only_columns: Tuple[str, ...] = (),
+                 write_queue: Union[WriteQueue, WriterThread] = None, metrics: Metrics = None,
+                 read_pool: ConnectionPool = None):
         self.table_name = table_name
         self.columns = columns
-        if connection:
-            self.conn = connection
+        # columns maintained by the database (e.g. by triggers), read but never written
+        self.read_only_columns = read_only_columns
+        self.conn = connection
+        self.pool = pool
+        self.read_pool = read_pool
+        self.cache = cache
+        self.write_queue = write_queue
+        self.metrics = metrics
+        self._complete = False
+
+    @contextmanager
+    def connection(self):
+        if self.conn:
+            yield self.conn
         else:
+            with (self.pool or get_pool()).connection() as conn:
+                yield conn
+
+    @contextmanager
+    def read_connection(self):
+        """
+        A connection for reads. One of the read pool is in a read transaction while it is checked out,
+        so that all queries made on it see the snapshot of the database the first one saw.
+        """
+        if self.conn or self.read_pool is None:
+            with self.connection() as conn:
+                yield conn
+            return
+        with self.read_pool.connection() as conn:
+            conn.execute('BEGIN')
             try:
-                self.conn = get_connection()
-            except Exception as e:
-                raise RepositoryException(*e.args)
-        self._complete = False
+                yield conn
+            finally:
+                conn.execute('COMMIT')
+
+    def write(self, operation: Callable[[Any], Any]) -> Any:
+        """
+        Runs a write on a connection, through the write queue if there is one and the repository
+        has no explicit connection
+        :param operation: runs the write on the connection it is given
+        :return: what the operation returned
+        """
+        if self.write_queue is not None and self.conn is None:
+            return self.write_queue.submit(operation)
+        with self.connection() as conn:
+            return operation(conn)
 
     def __enter__(self):
         return self
@@ -58,6 +512,7 @@ class Repository:
                 except Exception as e:
                     raise RepositoryException(*e.args)
 
+    @timed
     def add(self, obj: Any) -> Any:
         """
         Inserts a given object to a table
@@ -65,34 +520,108 @@ class Repository:
         :return: same object with id
         """
         try:
-            cursor = self.conn.cursor()
             data = self.obj_to_data(obj)
             query = 'INSERT INTO {} ({}) VALUES(?, ?, ?, ?)'.format(
                 self.table_name, self.columns_as_string
             )
-            cursor.execute(query, data)
-            obj.id = cursor.lastrowid
+            obj.id = self.write(lambda conn: conn.execute(query, data).lastrowid)
             return obj
+        except sqlite3.IntegrityError as e:
+            raise ConstraintViolation('Error storing object: {}'.format(e), e)
         except Exception as e:
             raise RepositoryException('Error storing object: {}'.format(e), e)
 
-    def list(self, limit: int, offset: int) -> List:
+    @timed
+    def list(self, limit: int, before_id: int = None) -> List:
         """
-        Fetches a given amount of objects from a table
+        Fetches a given amount of objects from a table, newest first
         :param limit:
-        :param offset:
+        :param before_id: fetch objects with smaller ids only (keyset pagination)
         :return: a list of objects
         """
         try:
-            cursor = self.conn.cursor()
-            query = 'SELECT {} FROM {} ORDER BY id DESC LIMIT {} OFFSET {}'.format(
-                'id,{}'.format(self.columns_as_string), self.table_name, limit, offset
+            query = 'SELECT {} FROM {} {} ORDER BY id DESC LIMIT ?'.format(
+                'id,{}'.format(self.select_columns_as_string), self.table_name,
+                'WHERE id < ?' if before_id is not None else ''
+            )
+            params = (limit,) if before_id is None else (before_id, limit)
+            with self.read_connection() as conn:
+                cursor = conn.cursor()
+                cursor.execute(query, params)
+                return [self.data_to_obj(data) for data in cursor.fetchall()]
+        except Exception as e:
+            raise RepositoryException('Error fetching objects: {}'.format(e), e)
+
+    def page_where(self, filters: Dict[str, Any] = None, before_id: int = None,
+                   min_id: int = None) -> Tuple[str, list]:
+        """
+        Builds the WHERE clause of a listing
+        :param filters: column values to match
+        :param before_id: objects with smaller ids only
+        :param min_id: objects with this id or greater ones only
+        :return: clause (may be empty) and its parameters
+        """
+        conditions, params = [], []
+        for column, value in (filters or {}).items():
+            conditions.append('{} = ?'.format(column))
+            params.append(value)
+        if before_id is not None:
+            conditions.append('id < ?')
+            params.append(before_id)
+        if min_id is not None:
+            conditions.append('id >= ?')
+            params.append(min_id)
+        return ('WHERE ' + ' AND '.join(conditions)) if conditions else '', params
+
+    @timed
+    def get_page_end(self, limit: int, before_id: int = None, filters: Dict[str, Any] = None) -> Optional[int]:
+        """
+        Finds where a page of objects ends without fetching the objects
+        :param limit: objects on the page
+        :param before_id: the page starts after this id
+        :param filters: column values to match
+        :return: id of the last object on the page, None if no objects follow the page
+        """
+        try:
+            where, params = self.page_where(filters, before_id)
+            query = 'SELECT id FROM {} {} ORDER BY id DESC LIMIT 2 OFFSET ?'.format(self.table_name, where)
+            with self.read_connection() as conn:
+                rows = conn.execute(query, params + [limit - 1]).fetchall()
+            return rows[0][0] if len(rows) > 1 else None
+        except Exception as e:
+            raise RepositoryException('Error fetching objects: {}'.format(e), e)
+
+    def iter_list(self, before_id: int = None, min_id: int = None, filters: Dict[str, Any] = None,
+                  order_by: str = 'id DESC', limit: int = None) -> Iterator:
+        """
+        Yields objects from a table newest first, rows are read from the cursor as they are consumed.
+        The connection stays checked out until the generator is exhausted or closed.
+        :param before_id: objects with smaller ids only
+        :param min_id: objects with this id or greater ones only, the end of the page
+        :param filters: column values to match
+        :param order_by: ORDER BY clause, e.g. 'id' to read a whole table oldest first
+        :param limit: objects yielded at most
+        :return: generator of objects
+        """
+        try:
+            where, params = self.page_where(filters, before_id, min_id)
+            query = 'SELECT id,{} FROM {} {} ORDER BY {}'.format(
+                self.select_columns_as_string, self.table_name, where, order_by
             )
-            cursor.execute(query)
-            return [self.data_to_obj(data) for data in cursor.fetchall()]
+            if limit is not None:
+                query += ' LIMIT ?'
+                params = params + [limit]
+            with self.read_connection() as conn:
+                cursor = conn.execute(query, params)
+                try:
+                    for data in cursor:
+                        yield self.data_to_obj(data)
+                finally:
+                    cursor.close()
         except Exception as e:
             raise RepositoryException('Error fetching objects: {}'.format(e), e)
 
+    @timed
     def get(self, id: int) -> Any:
         """
         Fetches an object from a table with given id
@@ -100,16 +629,18 @@ class Repository:
         :return: object
         """
         try:
-            cursor = self.conn.cursor()
             query = 'SELECT {} FROM {} WHERE id = ? LIMIT 1'.format(
-                'id,{}'.format(self.columns_as_string), self.table_name
+                'id,{}'.format(self.select_columns_as_string), self.table_name
             )
-            cursor.execute(query, (id,))
-            data = cursor.fetchone()
+            with self.read_connection() as conn:
+                cursor = conn.cursor()
+                cursor.execute(query, (id,))
+                data = cursor.fetchone()
             return self.data_to_obj(data) if data else None
         except Exception as e:
             raise RepositoryException('Error fetching object: {}'.format(e), e)
 
+    @timed
     def update(self, obj: Any) -> Any:
         """
         Updates a given object in a table
@@ -117,14 +648,15 @@ class Repository:
         :return: object
         """
         try:
-            cursor = self.conn.cursor()
             data = self.obj_to_data(obj) + (obj.id,)
             columns = ','.join(['{}=?'.format(c) for c in self.columns])
-            cursor.execute('UPDATE {} SET {} WHERE id = ?'.format(self.table_name, columns), data)
+            query = 'UPDATE {} SET {} WHERE id = ?'.format(self.table_name, columns)
+            self.write(lambda conn: conn.execute(query, data))
             return obj
         except Exception as e:
             raise RepositoryException('Error updating object: {}'.format(e), e)
 
+    @timed
     def delete(self, obj: Any) -> None:
         """
         Deletes a given object from a table
@@ -132,16 +664,172 @@ class Repository:
         :return:
         """
         try:
-            cursor = self.conn.cursor()
-            cursor.execute('DELETE FROM {} WHERE id = ?'.format(self.table_name), (obj.id,))
+            query = 'DELETE FROM {} WHERE id = ?'.format(self.table_name)
+            self.write(lambda conn: conn.execute(query, (obj.id,)))
             return None
         except Exception as e:
             raise RepositoryException('Error deleting object: {}'.format(e), e)
 
+    @timed
+    def get_many(self, ids: Iterable[int]) -> Dict[int, Any]:
+        """
+        Fetches objects with given ids
+        :param ids:
+        :return: objects by id, missing ids are left out
+        """
+        ids = list(ids)
+        objects = {}
+        try:
+            with self.read_connection() as conn:
+                # stay under SQLITE_MAX_VARIABLE_NUMBER of old SQLite versions
+                for start in range(0, len(ids), 500):
+                    chunk = ids[start:start + 500]
+                    query = 'SELECT {} FROM {} WHERE id IN ({})'.format(
+                        'id,{}'.format(self.select_columns_as_string), self.table_name, ','.join('?' * len(chunk))
+                    )
+                    for data in conn.execute(query, chunk):
+                        objects[data[0]] = self.data_to_obj(data)
+            return objects
+        except Exception as e:
+            raise RepositoryException('Error fetching objects: {}'.format(e), e)
+
+    @timed
+    def add_many(self, objs: List) -> List:
+        """
+        Inserts objects in a single transaction
+        :param objs:
+        :return: same objects with ids
+        """
+        if not objs:
+            return objs
+
+        def insert(conn):
+            with transaction(conn):
+                self.insert_new(conn, objs)
+
+        try:
+            self.write(insert)
+            return objs
+        except sqlite3.IntegrityError as e:
+            raise ConstraintViolation('Error storing objects: {}'.format(e), e)
+        except Exception as e:
+            raise RepositoryException('Error storing objects: {}'.format(e), e)
+
+    @timed
+    def import_many(self, objs: List) -> List:
+        """
+        Inserts objects keeping the ids they have, objects without an id get new ones.
+        Runs in a single transaction, or a savepoint of the caller's one.
+        :param objs:
+        :return: same objects with ids
+        """
+        if not objs:
+            return objs
+        query = 'INSERT INTO {} (id,{}) VALUES(?, ?, ?, ?, ?)'.format(self.table_name, self.columns_as_string)
+
+        def insert(conn):
+            with transaction(conn):
+                conn.executemany(query, [(obj.id,) + self.obj_to_data(obj) for obj in objs if obj.id is not None])
+                self.insert_new(conn, [obj for obj in objs if obj.id is None])
+
+        try:
+            self.write(insert)
+            return objs
+        except sqlite3.IntegrityError as e:
+            raise ConstraintViolation('Error storing objects: {}'.format(e), e)
+        except Exception as e:
+            raise RepositoryException('Error storing objects: {}'.format(e), e)
+
+    def insert_new(self, conn, objs: List) -> None:
+        """
+        Inserts objects and sets their new ids, in the caller's transaction
+        :param conn:
+        :param objs:
+        :return:
+        """
+        query = 'INSERT INTO {} ({}) VALUES(?, ?, ?, ?)'.format(self.table_name, self.columns_as_string)
+        cursor = conn.cursor()
+        for obj in objs:
+            cursor.execute(query, self.obj_to_data(obj))
+            obj.id = cursor.lastrowid
+
+    @timed
+    def update_many(self, objs: List) -> List:
+        """
+        Updates objects with one executemany in a single transaction
+        :param objs:
+        :return: same objects
+        """
+        if not objs:
+            return objs
+        columns = ','.join(['{}=?'.format(c) for c in self.columns])
+        query = 'UPDATE {} SET {} WHERE id = ?'.format(self.table_name, columns)
+
+        def update(conn):
+            with transaction(conn):
+                conn.executemany(query, [self.obj_to_data(obj) + (obj.id,) for obj in objs])
+
+        try:
+            self.write(update)
+            return objs
+        except Exception as e:
+            raise RepositoryException('Error updating objects: {}'.format(e), e)
+
+    @timed
+    def delete_many(self, objs: List) -> None:
+        """
+        Deletes objects with one executemany in a single transaction
+        :param objs:
+        :return:
+        """
+        if not objs:
+            return None
+        query = 'DELETE FROM {} WHERE id = ?'.format(self.table_name)
+
+        def delete(conn):
+            with transaction(conn):
+                conn.executemany(query, [(obj.id,) for obj in objs])
+
+        try:
+            self.write(delete)
+            return None
+        except Exception as e:
+            raise RepositoryException('Error deleting objects: {}'.format(e), e)
+
+    def cached(self, key: tuple, tags, load: Callable[[], Any]) -> Any:
+        """
+        Read-through cache lookup. Returns copies, so callers may modify the objects.
+        :param key:
+        :param tags: see invalidate(), or a function making them from the loaded value
+        :param load: fetches the value from the database
+        :return: object or list of objects
+        """
+        if self.cache is None:
+            return load()
+        value = self.cache.get_or_load(key, load, tags)
+        if isinstance(value, list):
+            return [copy.copy(obj) for obj in value]
+        return copy.copy(value)
+
+    def invalidate(self, *tags) -> None:
+        if self.cache is not None:
+            self.cache.invalidate_tags(*tags)
+
+    def invalidate_all(self) -> None:
+        """
+        Drops every cached object, after changes too broad to invalidate by tag
+        """
+        if self.cache is not None:
+            self.cache.clear()
+
     @property
     def columns_as_string(self) -> str:
         return ','.join(self.columns)
 
+    @property
+    def select_columns_as_string(self) -> str:
+        return ','.join(self.columns + self.read_only_columns)
+
     def obj_to_data(self, obj: Any) -> tuple:
         raise NotImplementedError()
 
@@ -149,12 +837,27 @@ class Repository:
         raise NotImplementedError()
 
 
+# columns of the tables besides id, a news with its comments is read by the news repository
+NEWS_COLUMNS = ('created_date', 'modified_date', 'title', 'content')
+COMMENT_COLUMNS = ('created_date', 'modified_date', 'news_id', 'content')
+
+
+def data_to_comment(data: tuple) -> Comment:
+    return Comment(
+        id=data[0],
+        created_date=timestamp_to_datetime(data[1]),
+        modified_date=timestamp_to_datetime(data[2]),
+        news_id=data[3],
+        content=data[4]
+    )
+
+
 class NewsRepository(Repository):
     def __init__(self, *args, **kwargs):
         super().__init__(
             'news',
-            ('created_date', 'modified_date', 'title', 'content'),
-            *args, **kwargs
+            NEWS_COLUMNS,
+            *args, read_only_columns=('comment_count',), **kwargs
         )
 
     def obj_to_data(self, obj: News) -> tuple:
@@ -171,31 +874,155 @@ class NewsRepository(Repository):
             created_date=timestamp_to_datetime(data[1]),
             modified_date=timestamp_to_datetime(data[2]),
             title=data[3],
-            content=data[4]
+            content=data[4],
+            comment_count=data[5]
         )
 
+    def data_to_hit(self, data: tuple) -> NewsSearchHit:
+        return NewsSearchHit(
+            id=data[0],
+            created_date=timestamp_to_datetime(data[1]),
+            modified_date=timestamp_to_datetime(data[2]),
+            title=data[3],
+            content=data[4],
+            comment_count=data[5],
+            snippet=data[6]
+        )
+
+    # cache tags: ('news', id) for a news, 'news_list' for first pages of news,
+    # ('news_comments', news_id) for comments and comment pages of a news
+
     def add_news(self, news: News) -> News:
-        return self.add(news)
+        news = self.add(news)
+        self.invalidate('news_list')
+        return news
+
+    def list_news(self, limit: int, before_id: int = None) -> List:
+        if before_id is not None:
+            return self.list(limit, before_id)
+        return self.cached(('news_list', limit), ('news_list',), lambda: self.list(limit))
+
+    def get_news_page_end(self, limit: int, before_id: int = None) -> Optional[int]:
+        return self.get_page_end(limit, before_id)
 
-    def list_news(self, limit: int, offset: int) -> List:
-        return self.list(limit, offset)
+    def iter_news(self, before_id: int = None, min_id: int = None, limit: int = None) -> Iterator[News]:
+        return self.iter_list(before_id, min_id, limit=limit)
+
+    def iter_all_news(self) -> Iterator[News]:
+        return self.iter_list(order_by='id')
+
+    @timed
+    def search_news(self, text: str, limit: int, after: Tuple[float, int] = None) -> List[Tuple[NewsSearchHit, float]]:
+        """
+        Finds news containing every word of a text in their title or content, best matches
+        (lowest bm25 score) first, with a snippet of the best matching column
+        :param text: words to look for, FTS5 query syntax is not interpreted
+        :param limit:
+        :param after: score and id of the last hit of the previous page (keyset pagination)
+        :return: hits with their scores
+        """
+        # every word becomes a quoted FTS5 string, so quotes and operators in it match literally
+        terms = ' '.join('"{}"'.format(word.replace('"', '""')) for word in text.split())
+        try:
+            query = (
+                "SELECT news.id,{},snippet(news_fts, -1, '<mark>', '</mark>', '...', ?),bm25(news_fts) AS score "
+                'FROM news_fts JOIN news ON news.id = news_fts.rowid WHERE news_fts MATCH ? {}'
+                'ORDER BY score, news.id LIMIT ?'
+            ).format(
+                ','.join('news.{}'.format(column) for column in self.columns + self.read_only_columns),
+                'AND (bm25(news_fts) > ? OR (bm25(news_fts) = ? AND news.id > ?)) ' if after is not None else ''
+            )
+            params = [settings.SEARCH_SNIPPET_TOKENS, terms]
+            if after is not None:
+                params += [after[0], after[0], after[1]]
+            with self.read_connection() as conn:
+                rows = conn.execute(query, params + [limit]).fetchall()
+            return [(self.data_to_hit(row), row[7]) for row in rows]
+        except Exception as e:
+            raise RepositoryException('Error searching objects: {}'.format(e), e)
 
     def get_news(self, id: int) -> News:
-        return self.get(id)
+        return self.cached(('news', id), (('news', id),), lambda: self.get(id))
+
+    def get_news_with_comments(self, id: int, comments_limit: int) -> Optional[NewsWithComments]:
+        return self.cached(
+            ('news_with_comments', id, comments_limit),
+            (('news', id), ('comment_list', id), ('news_comments', id)),
+            lambda: self.fetch_news_with_comments(id, comments_limit)
+        )
+
+    @timed
+    def fetch_news_with_comments(self, id: int, comments_limit: int) -> Optional[NewsWithComments]:
+        """
+        Fetches a news with its newest comments in one query, a row per comment
+        :param id:
+        :param comments_limit:
+        :return: news with comments, None if there is no such news
+        """
+        try:
+            query = (
+                'SELECT {},{} FROM news LEFT JOIN comment AS c '
+                'ON c.id IN (SELECT id FROM comment WHERE news_id = ? ORDER BY id DESC LIMIT ?) '
+                'WHERE news.id = ? ORDER BY c.id DESC'
+            ).format(
+                ','.join('news.{}'.format(column) for column in ('id',) + self.columns + self.read_only_columns),
+                ','.join('c.{}'.format(column) for column in ('id',) + COMMENT_COLUMNS)
+            )
+            with self.read_connection() as conn:
+                rows = conn.execute(query, (id, comments_limit, id)).fetchall()
+        except Exception as e:
+            raise RepositoryException('Error fetching object: {}'.format(e), e)
+        if not rows:
+            return None
+        size = 1 + len(self.columns) + len(self.read_only_columns)
+        news = self.data_to_obj(rows[0][:size])
+        return NewsWithComments(
+            id=news.id,
+            created_date=news.created_date,
+            modified_date=news.modified_date,
+            title=news.title,
+            content=news.content,
+            comment_count=news.comment_count,
+            comments=[data_to_comment(row[size:]) for row in rows if row[size] is not None]
+        )
 
     def update_news(self, obj: News) -> News:
         obj.modified_date = datetime.now()
-        return self.update(obj)
+        obj = self.update(obj)
+        self.invalidate(('news', obj.id), 'news_list')
+        return obj
 
     def delete_news(self, obj: News) -> None:
-        return self.delete(obj)
+        self.delete(obj)
+        # comments are deleted by the foreign key cascade
+        self.invalidate(('news', obj.id), 'news_list', ('news_comments', obj.id))
+
+    def get_news_many(self, ids: Iterable[int]) -> Dict[int, News]:
+        return self.get_many(ids)
+
+    def add_news_many(self, objs: List[News]) -> List[News]:
+        objs = self.add_many(objs)
+        self.invalidate('news_list')
+        return objs
+
+    def update_news_many(self, objs: List[News]) -> List[News]:
+        dt = datetime.now()
+        for obj in objs:
+            obj.modified_date = dt
+        objs = self.update_many(objs)
+        self.invalidate('news_list', *[('news', obj.id) for obj in objs])
+        return objs
+
+    def delete_news_many(self, objs: List[News]) -> None:
+        self.delete_many(objs)
+        self.invalidate('news_list', *[tag for obj in objs for tag in (('news', obj.id), ('news_comments', obj.id))])
 
 
 class CommentRepository(Repository):
     def __init__(self, *args, **kwargs):
         super().__init__(
             'comment',
-            ('created_date', 'modified_date', 'news_id', 'content'),
+            COMMENT_COLUMNS,
             *args, **kwargs
         )
 
@@ -208,44 +1035,104 @@ class CommentRepository(Repository):
         )
 
     def data_to_obj(self, data: tuple) -> Comment:
-        return Comment(
-            id=data[0],
-            created_date=timestamp_to_datetime(data[1]),
-            modified_date=timestamp_to_datetime(data[2]),
-            news_id=data[3],
-            content=data[4]
-        )
+        return data_to_comment(data)
+
+    # cache tags: ('comment', id) for a comment, ('comment_list', news_id) for first pages of comments,
+    # ('news_comments', news_id) for comments and comment pages of a news.
+    # Adding or deleting comments changes the comment count of their news too.
 
     def add_comment(self, comment: Comment) -> Comment:
-        return self.add(comment)
+        comment = self.add(comment)
+        self.invalidate(('comment_list', comment.news_id), ('news', comment.news_id), 'news_list')
+        return comment
 
-    def list_comment(self, limit: int, offset: int) -> List:
-        return self.list(limit, offset)
+    def list_comment(self, limit: int, before_id: int = None) -> List:
+        return self.list(limit, before_id)
 
     def get_comment(self, id: int) -> Comment:
-        return self.get(id)
+        return self.cached(
+            ('comment', id),
+            lambda comment: (('comment', id), ('news_comments', comment.news_id)),
+            lambda: self.get(id)
+        )
 
-    def get_comments_for_news(self, news_id: int, limit: int, offset: int) -> List:
+    def get_comments_for_news(self, news_id: int, limit: int, before_id: int = None) -> List:
+        if before_id is not None:
+            return self.fetch_comments_for_news(news_id, limit, before_id)
+        return self.cached(
+            ('comment_list', news_id, limit),
+            (('comment_list', news_id), ('news_comments', news_id)),
+            lambda: self.fetch_comments_for_news(news_id, limit)
+        )
+
+    def get_comments_page_end(self, news_id: int, limit: int, before_id: int = None) -> Optional[int]:
+        return self.get_page_end(limit, before_id, {'news_id': news_id})
+
+    def iter_comments_for_news(self, news_id: int, before_id: int = None, min_id: int = None,
+                               limit: int = None) -> Iterator[Comment]:
+        return self.iter_list(before_id, min_id, {'news_id': news_id}, limit=limit)
+
+    def iter_all_comments(self) -> Iterator[Comment]:
+        """
+        Yields every comment grouped by news, in the order of comment_news_id_id_idx
+        """
+        return self.iter_list(order_by='news_id, id')
+
+    @timed
+    def fetch_comments_for_news(self, news_id: int, limit: int, before_id: int = None) -> List:
         """
-        Fetches a list of comments that corresponds to the given news id
+        Fetches a list of comments that corresponds to the given news id, newest first
         :param news_id:
         :param limit:
-        :param offset:
+        :param before_id: fetch comments with smaller ids only (keyset pagination)
         :return:
         """
         try:
-            cursor = self.conn.cursor()
-            query = 'SELECT {} FROM {} WHERE news_id = ? ORDER BY id DESC LIMIT {} OFFSET {}'.format(
-                'id,{}'.format(self.columns_as_string), self.table_name, limit, offset
+            query = 'SELECT {} FROM {} WHERE news_id = ? {} ORDER BY id DESC LIMIT ?'.format(
+                'id,{}'.format(self.select_columns_as_string), self.table_name,
+                'AND id < ?' if before_id is not None else ''
             )
-            cursor.execute(query, (news_id,))
-            return [self.data_to_obj(data) for data in cursor.fetchall()]
+            params = (news_id, limit) if before_id is None else (news_id, before_id, limit)
+            with self.read_connection() as conn:
+                cursor = conn.cursor()
+                cursor.execute(query, params)
+                return [self.data_to_obj(data) for data in cursor.fetchall()]
         except Exception as e:
             raise RepositoryException('Error fetching objects: {}'.format(e), e)
 
     def update_comment(self, obj: Comment) -> Comment:
         obj.modified_date = datetime.now()
-        return self.update(obj)
+        obj = self.update(obj)
+        self.invalidate(('comment', obj.id), ('comment_list', obj.news_id))
+        return obj
 
     def delete_comment(self, comment: Comment) -> None:
-        return self.delete(comment)
+        self.delete(comment)
+        self.invalidate(
+            ('comment', comment.id), ('comment_list', comment.news_id), ('news', comment.news_id), 'news_list'
+        )
+
+    def get_comment_many(self, ids: Iterable[int]) -> Dict[int, Comment]:
+        return self.get_many(ids)
+
+    def add_comment_many(self, objs: List[Comment]) -> List[Comment]:
+        objs = self.add_many(objs)
+        self.invalidate(
+            'news_list', *{tag for obj in objs for tag in (('comment_list', obj.news_id), ('news', obj.news_id))}
+        )
+        return objs
+
+    def update_comment_many(self, objs: List[Comment]) -> List[Comment]:
+        dt = datetime.now()
+        for obj in objs:
+            obj.modified_date = dt
+        objs = self.update_many(objs)
+        self.invalidate(*[('comment', obj.id) for obj in objs], *{('comment_list', obj.news_id) for obj in objs})
+        return objs
+
+    def delete_comment_many(self, objs: List[Comment]) -> None:
+        self.delete_many(objs)
+        self.invalidate(
+            'news_list', *[('comment', obj.id) for obj in objs],
+            *{tag for obj in objs for tag in (('comment_list', obj.news_id), ('news', obj.news_id))}
+        )
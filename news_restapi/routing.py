@@ -0,0 +1,93 @@
+import re
+from typing import Callable, Optional, Tuple
+
+METHODS = ('GET', 'POST', 'PUT', 'DELETE')
+
+GROUP_RE = re.compile(r'\(\?P<(\w+)>((?:[^()\\]|\\.)*)\)')
+# a pattern starting with a literal path segment, e.g. ^/news/...
+FIRST_SEGMENT_RE = re.compile(r'^\^/([\w-]+)/')
+# the largest SQLite integer, larger ids name no row
+MAX_INT = 2 ** 63 - 1
+
+
+class Router:
+    """
+    Compiles a routes table once. Routes are bucketed by their first path segment, and
+    the routes of a bucket are joined into a single regular expression with one alternative
+    per route, so resolving a path costs a dict lookup and one match however many routes there are.
+    Routes not starting with a literal segment are tried when the bucket of a path has no match.
+    Parameters matched by \\d+ are converted to int, a path with one beyond SQLite integers matches no route.
+    """
+    def __init__(self, routes: dict):
+        self.routes = routes
+        self._targets = {}
+        self._patterns = {id(route): pattern for pattern, route in routes.items()}
+        buckets = {}
+        for index, (pattern, route) in enumerate(routes.items()):
+            name = 'r{}'.format(index)
+            params = []
+
+            def rename(match):
+                group = '{}_{}'.format(name, len(params))
+                params.append((group, match.group(1), match.group(2) == r'\d+'))
+                return '(?P<{}>{})'.format(group, match.group(2))
+
+            body = GROUP_RE.sub(rename, pattern)
+            if body.startswith('^'):
+                body = body[1:]
+            if body.endswith('$'):
+                body = body[:-1]
+            segment = FIRST_SEGMENT_RE.match(pattern)
+            buckets.setdefault(segment.group(1) if segment else None, []).append('(?P<{}>{})'.format(name, body))
+            methods = [method for method in METHODS if method in route]
+            allow = ', '.join(methods + ['HEAD'])
+            self._targets[name] = (route, params, allow)
+        self._buckets = {
+            segment: re.compile('^(?:{})$'.format('|'.join(alternatives)))
+            for segment, alternatives in buckets.items()
+        }
+        self._fallback = self._buckets.pop(None, None)
+
+    def match(self, path: str) -> Tuple[Optional[dict], Optional[dict], Optional[str]]:
+        """
+        Finds the route of a path
+        :param path: URL path without the query string
+        :return: route, its parameters and the methods it allows, Nones if no route matches
+        """
+        regex = self._buckets.get(path.split('/', 2)[1] if path.startswith('/') else None)
+        match = regex.match(path) if regex else None
+        if match is None and self._fallback:
+            match = self._fallback.match(path)
+        if match is None:
+            return None, None, None
+        route, params, allow = self._targets[match.lastgroup]
+        values = {}
+        for group, param, is_int in params:
+            value = match.group(group)
+            if is_int:
+                value = int(value)
+                if value > MAX_INT:
+                    return None, None, None
+            values[param] = value
+        return route, values, allow
+
+    def pattern(self, route: dict) -> str:
+        """
+        The URL pattern of a route, e.g. to label its metrics
+        :param route: route returned by match or resolve
+        :return: pattern
+        """
+        return self._patterns[id(route)]
+
+    def resolve(self, method: str, path: str) -> Tuple[Optional[dict], Optional[Callable], Optional[dict], str]:
+        """
+        Finds the route of a path and its handler for a method
+        :param method:
+        :param path: URL path without the query string
+        :return: route (None if no route matches), handler (None if the method is not allowed),
+                 parameters and the methods the route allows
+        """
+        route, params, allow = self.match(path)
+        if route is None:
+            return None, None, None, None
+        return route, route.get(method), params, allow
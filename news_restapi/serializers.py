@@ -0,0 +1,95 @@
+import json
+from dataclasses import fields
+from datetime import datetime
+from json.encoder import encode_basestring_ascii
+from typing import Any, Callable, Iterable, Iterator
+
+from news_restapi.models import News, Comment, NewsSearchHit, NewsWithComments
+
+
+def make_serializer(model: type) -> Callable[[Any], str]:
+    """
+    Generates a function writing objects of a dataclass model as JSON. Fields are written
+    in alphabetical order and datetimes as str(datetime) does, the output is the same as
+    json.dumps(asdict(obj), sort_keys=True, default=str) without building a dict.
+    :param model: dataclass
+    :return: serializer
+    """
+    parts = []
+    for field in sorted(fields(model), key=lambda field: field.name):
+        value = 'obj.{}'.format(field.name)
+        if field.type is str:
+            expression = 'encode_str({})'.format(value)
+        elif field.type is int:
+            expression = 'str({})'.format(value)
+        elif field.type is datetime:
+            expression = '\'"\' + {}.isoformat(" ") + \'"\''.format(value)
+        else:
+            expression = 'dumps({})'.format(value)
+        parts.append('{!r} + ({} if {} is not None else "null")'.format(
+            '{}: '.format(encode_basestring_ascii(field.name)), expression, value
+        ))
+    source = 'def serialize(obj):\n    return "{{" + {} + "}}"\n'.format(' + ", " + '.join(parts))
+    namespace = {'encode_str': encode_basestring_ascii, 'dumps': dumps}
+    exec(source, namespace)
+    return namespace['serialize']
+
+
+def dumps(content: Any) -> str:
+    """
+    Writes response content as JSON, models through their generated serializers
+    :param content: model object, list, dict or JSON value
+    :return: JSON
+    """
+    serializer = serializers.get(type(content))
+    if serializer is not None:
+        return serializer(content)
+    if isinstance(content, list):
+        return '[' + ', '.join([dumps(item) for item in content]) + ']'
+    if isinstance(content, dict):
+        return '{' + ', '.join([
+            '{}: {}'.format(encode_basestring_ascii(str(key)), dumps(value)) for key, value in sorted(content.items())
+        ]) + '}'
+    return json.dumps(content, default=str)
+
+
+def iter_dumps(items: Iterable[Any]) -> Iterator[str]:
+    """
+    Writes a JSON array piece by piece, items are serialized as they are consumed
+    :param items: any iterable, e.g. a generator of model objects
+    :return: JSON chunks
+    """
+    yield '['
+    separator = ''
+    for item in items:
+        yield separator + dumps(item)
+        separator = ', '
+    yield ']'
+
+
+def encode_chunks(pieces: Iterable[str], size: int) -> Iterator[bytes]:
+    """
+    Gathers pieces of text, e.g. from iter_dumps, into encoded chunks of at least size bytes
+    (the last one may be smaller), so a streamed body is not written item by item
+    :param pieces:
+    :param size:
+    :return: chunks
+    """
+    buffer, buffered = [], 0
+    for piece in pieces:
+        data = piece.encode()
+        buffer.append(data)
+        buffered += len(data)
+        if buffered >= size:
+            yield b''.join(buffer)
+            buffer, buffered = [], 0
+    if buffer:
+        yield b''.join(buffer)
+
+
+serializers = {
+    News: make_serializer(News),
+    Comment: make_serializer(Comment),
+    NewsSearchHit: make_serializer(NewsSearchHit),
+    NewsWithComments: make_serializer(NewsWithComments),
+}
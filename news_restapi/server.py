@@ -1,56 +1,503 @@
 import http.server
 import importlib
 import json
-import re
+import logging
+import select
+import signal
+import socket
 import sys
+import threading
+import time
+import urllib.parse
+from concurrent.futures import ThreadPoolExecutor
+from typing import Iterator, Optional, Tuple, Union
 
-from news_restapi import exceptions
-from news_restapi.controllers import NewsController, CommentController
-from news_restapi.repositories import NewsRepository, CommentRepository
+from news_restapi import exceptions, settings
+from news_restapi.admission import AdmissionControl, PENDING
+from news_restapi.cache import LRUCache
+from news_restapi.compression import negotiate_encoding, compress, compress_stream, encoded_etag
+from news_restapi.conditional import get_validators, http_date, is_date_validated, is_not_modified
+from news_restapi.controllers import NewsController, CommentController, TransferController, MetricsController
+from news_restapi.metrics import Metrics
+from news_restapi.migrations import migrate_database
+from news_restapi.pagination import Page, StreamPage
+from news_restapi.profiling import RequestProfiler, StackSampler
+from news_restapi.recording import TrafficRecorder
+from news_restapi.repositories import (
+    NewsRepository, CommentRepository, ConnectionPool, DataVersionWatcher, WriteQueue, WriterThread, get_read_connection
+)
+from news_restapi.routing import Router
+from news_restapi.serializers import dumps, encode_chunks, iter_dumps
+from news_restapi.transfer import NDJSONStream
 
 importlib.reload(sys)
 
+logger = logging.getLogger(__name__)
+
 
 def service_worker():
-    pass
-
-
-news_controller = NewsController(NewsRepository())
-comment_controller = CommentController(CommentRepository())
-
-
-routes = {
-    r'^/news/$': {
-        'GET': news_controller.list_news,
-        'POST': news_controller.add_news,
-        'media_type': 'application/json'
-    },
-    r'^/news/(?P<pk>\d+)/$': {
-        'GET': news_controller.get_news,
-        'PUT': news_controller.update_news,
-        'DELETE': news_controller.delete_news,
-        'media_type': 'application/json'
-    },
-    r'^/news/(?P<news_pk>\d+)/comments/$': {
-        'GET': comment_controller.list_comments,
-        'POST': comment_controller.add_comment,
-        'media_type': 'application/json'
-    },
-    r'^/news/(?P<news_pk>\d+)/comments/(?P<pk>\d+)/$': {
-        'GET': comment_controller.get_comment,
-        'PUT': comment_controller.update_comment,
-        'DELETE': comment_controller.delete_comment,
-        'media_type': 'application/json'
+    """
+    Runs between requests and every poll interval: commits queued writes that have waited long enough
+    """
+    if write_queue is not None:
+        write_queue.flush_due()
+
+
+cache = LRUCache(settings.CACHE_SIZE, settings.CACHE_TTL) if settings.CACHE_SIZE else None
+compressed_cache = LRUCache(
+    settings.COMPRESSION_CACHE_SIZE, settings.COMPRESSION_CACHE_TTL
+) if settings.COMPRESSION_CACHE_SIZE else None
+writer_thread = WriterThread(
+    settings.GROUP_COMMIT_DELAY / 1000, settings.GROUP_COMMIT_MAX_WRITES
+) if settings.DB_WRITER_THREAD else None
+read_pool = ConnectionPool(
+    settings.DB_POOL_SIZE, factory=get_read_connection, timeout=settings.DB_POOL_TIMEOUT
+) if settings.DB_WRITER_THREAD else None
+write_queue = WriteQueue(
+    settings.GROUP_COMMIT_DELAY / 1000, settings.GROUP_COMMIT_MAX_WRITES
+) if settings.GROUP_COMMIT_DELAY and writer_thread is None else None
+metrics = Metrics() if settings.METRICS else None
+if metrics is not None and cache is not None:
+    metrics.add_cache('read', cache)
+if metrics is not None and compressed_cache is not None:
+    metrics.add_cache('compressed', compressed_cache)
+recorder = TrafficRecorder(
+    settings.RECORD_PATH, settings.RECORD_SAMPLE_RATE, settings.RECORD_QUEUE_SIZE
+) if settings.RECORD_PATH else None
+admission = AdmissionControl(
+    settings.ADMISSION_MAX_IN_FLIGHT, settings.ADMISSION_RATE, settings.ADMISSION_BURST, settings.ADMISSION_RETRY_AFTER
+) if settings.ADMISSION_MAX_IN_FLIGHT or settings.ADMISSION_RATE else None
+profiler = RequestProfiler(
+    settings.PROFILE_EVERY, settings.PROFILE_SECRET, settings.PROFILE_DIR, settings.PROFILE_TOP
+) if settings.PROFILE_EVERY or settings.PROFILE_SECRET else None
+news_controller = NewsController(
+    NewsRepository(cache=cache, write_queue=writer_thread or write_queue, metrics=metrics, read_pool=read_pool)
+)
+comment_controller = CommentController(
+    CommentRepository(cache=cache, write_queue=writer_thread or write_queue, metrics=metrics, read_pool=read_pool)
+)
+transfer_controller = TransferController(news_controller.news_repository, comment_controller.comment_repository)
+metrics_controller = MetricsController(metrics) if metrics is not None else None
+
+
+def build_routes(news_controller: NewsController, comment_controller: CommentController,
+                 transfer_controller: TransferController = None, metrics_controller: MetricsController = None) -> dict:
+    """
+    Maps URL patterns to controller methods
+    :param news_controller:
+    :param comment_controller:
+    :param transfer_controller: export and import routes are left out without it
+    :param metrics_controller: the metrics route is left out without it
+    :return: routes
+    """
+    routes = {
+        r'^/news/$': {
+            'GET': news_controller.list_news,
+            'POST': news_controller.add_news,
+            'media_type': 'application/json'
+        },
+        r'^/news/_bulk/$': {
+            'POST': news_controller.bulk_add_news,
+            'PUT': news_controller.bulk_update_news,
+            'DELETE': news_controller.bulk_delete_news,
+            'media_type': 'application/json'
+        },
+        r'^/news/search/?$': {
+            'GET': news_controller.search_news,
+            'media_type': 'application/json'
+        },
+        r'^/news/(?P<pk>\d+)/$': {
+            'GET': news_controller.get_news,
+            'PUT': news_controller.update_news,
+            'DELETE': news_controller.delete_news,
+            'media_type': 'application/json'
+        },
+        r'^/news/(?P<news_pk>\d+)/comments/$': {
+            'GET': comment_controller.list_comments,
+            'POST': comment_controller.add_comment,
+            'media_type': 'application/json'
+        },
+        r'^/news/(?P<news_pk>\d+)/comments/_bulk/$': {
+            'POST': comment_controller.bulk_add_comments,
+            'PUT': comment_controller.bulk_update_comments,
+            'DELETE': comment_controller.bulk_delete_comments,
+            'media_type': 'application/json'
+        },
+        r'^/news/(?P<news_pk>\d+)/comments/(?P<pk>\d+)/$': {
+            'GET': comment_controller.get_comment,
+            'PUT': comment_controller.update_comment,
+            'DELETE': comment_controller.delete_comment,
+            'media_type': 'application/json'
+        }
     }
-}
+    if transfer_controller is not None:
+        routes[r'^/export/?$'] = {
+            'GET': transfer_controller.export_corpus,
+            'media_type': 'application/x-ndjson'
+        }
+        routes[r'^/import/?$'] = {
+            'POST': transfer_controller.import_corpus,
+            'media_type': 'application/json'
+        }
+    if metrics_controller is not None:
+        routes[r'^/metrics/?$'] = {
+            'GET': metrics_controller.get_metrics,
+            'media_type': 'text/plain; version=0.0.4; charset=utf-8'
+        }
+    return routes
+
+
+routes = build_routes(news_controller, comment_controller, transfer_controller, metrics_controller)
 
 poll_interval = 0.1
+# seconds between checks of an idle kept alive connection for other connections waiting for its worker
+idle_poll_interval = 0.05
+
+
+def get_poll_interval() -> float:
+    """
+    Seconds between service_worker calls of an idle server, queued writes are not left waiting longer
+    :return:
+    """
+    if write_queue is not None:
+        return min(poll_interval, write_queue.max_delay)
+    return poll_interval
+
+
+def get_content_length(headers) -> int:
+    try:
+        return max(int(headers.get('content-length', 0)), 0)
+    except ValueError:
+        return 0
+
+
+class PayloadReader:
+    """
+    Reads a request body framed by Content-Length from a file-like object, never past its end,
+    so the next request on a kept alive connection starts where expected
+    """
+    block_size = 65536
+
+    def __init__(self, rfile, length: int, keep: int = 0):
+        """
+        :param rfile:
+        :param length: Content-Length
+        :param keep: a body of up to this many bytes is kept as it is read, see body
+        """
+        self.rfile = rfile
+        self.remaining = length
+        self.kept = [] if 0 < length <= keep else None
+
+    def read_block(self) -> bytes:
+        if self.remaining <= 0:
+            return b''
+        data = self.rfile.read(min(self.remaining, self.block_size))
+        # an empty read means the client went away
+        self.remaining = self.remaining - len(data) if data else 0
+        if self.kept is not None:
+            self.kept.append(data)
+        return data
+
+    @property
+    def body(self) -> Optional[bytes]:
+        """
+        The body read so far if it is kept, None otherwise
+        """
+        return b''.join(self.kept) if self.kept is not None else None
+
+    def read(self) -> bytes:
+        blocks = []
+        block = self.read_block()
+        while block:
+            blocks.append(block)
+            block = self.read_block()
+        return b''.join(blocks)
+
+    def __iter__(self) -> Iterator[bytes]:
+        """
+        Yields the body line by line, with line endings, reading a block at a time
+        """
+        buffer = b''
+        block = self.read_block()
+        while block:
+            buffer += block
+            lines = buffer.split(b'\n')
+            buffer = lines.pop()
+            for line in lines:
+                yield line + b'\n'
+            block = self.read_block()
+        if buffer:
+            yield buffer
+
+    def discard(self) -> None:
+        """
+        Reads what the controller did not
+        """
+        while self.read_block():
+            pass
+
+
+class RESTDispatcher:
+    """
+    Maps a request to a controller and builds the response, independent of the transport.
+    Subclasses provide path, headers and payload, a PayloadReader of the request body.
+    """
+    router = Router(routes)
+    metrics = metrics
+    profiler = profiler
+    recorder = recorder
+    admission = admission
+    # set when other processes write to the database too, see enable_cache_coherence
+    coherence = None
+
+    def get_payload(self):
+        return json.loads(self.payload.read().decode())
+
+    def get_payload_lines(self) -> Iterator[bytes]:
+        return iter(self.payload)
+
+    def get_query(self) -> dict:
+        """
+        Query string parameters, the first value of each
+        :return: query parameters
+        """
+        query = urllib.parse.urlsplit(self.path).query
+        return {name: values[0] for name, values in urllib.parse.parse_qs(query).items()}
+
+    def admit(self) -> Optional[Tuple[int, dict, bytes]]:
+        """
+        Asks admission control to let the request in, release() it once its response is written
+        :return: None if the request is admitted, otherwise the response shedding it
+        """
+        self.route_pattern = None
+        if self.admission is None:
+            return None
+        rejection = self.admission.admit(self.client_address[0] if self.client_address else '')
+        if rejection is None:
+            return None
+        status, retry_after, reason = rejection
+        if self.metrics is not None:
+            self.metrics.observe_shed(reason)
+        message = 'Too many requests' if status == 429 else 'Server overloaded'
+        return status, {'Retry-After': str(retry_after)}, message.encode()
+
+    def release(self) -> None:
+        if self.admission is not None:
+            self.admission.release()
+
+    def dispatch(self, method: str) -> Tuple[int, dict, Union[bytes, Iterator[bytes]]]:
+        """
+        Runs the controller for the request, under the profiler if the request is sampled or asks for it.
+        A request asking for it is answered with a summary of its profile instead of its response.
+        :param method: HTTP method
+        :return: status code, headers and body, a generator of chunks for a streamed page
+        """
+        if self.coherence is not None:
+            self.coherence.check()
+        if self.profiler is None:
+            return self.dispatch_request(method)
+        requested = self.profiler.is_requested(self.headers)
+        if not requested and not self.profiler.is_sampled():
+            return self.dispatch_request(method)
+        response, stats = self.profiler.profile(self.dispatch_request, method)
+        if stats is None:
+            return response
+        path = self.profiler.save(stats, '{} {}'.format(method, self.path))
+        if not requested:
+            return response
+        status, headers, body = response
+        if not isinstance(body, bytes):
+            # a streamed body is not read, the profile covers the controller only
+            body.close()
+        headers = {'Content-type': 'text/plain; charset=utf-8', 'X-Profile-Status': str(status)}
+        if path:
+            headers['X-Profile-File'] = path
+        return 200, headers, self.profiler.summary(stats).encode()
+
+    def dispatch_request(self, method: str) -> Tuple[int, dict, Union[bytes, Iterator[bytes]]]:
+        """
+        Runs the controller for the request
+        :param method: HTTP method
+        :return: status code, headers and body, a generator of chunks for a streamed page
+        """
+        content = None
+        self.route_pattern = None
+        try:
+            route, controller, params, allow = self.router.resolve(method, urllib.parse.urlsplit(self.path).path)
+            if route is None:
+                return 404, {}, 'Route not found'.encode()
+            self.route_pattern = self.router.pattern(route)
+            headers = {}
+            if 'media_type' in route:
+                headers['Content-type'] = route['media_type']
+            if method == 'HEAD':
+                return 200, headers, b''
+            if controller is None:
+                return 405, {'Allow': allow}, '{} is not supported'.format(method).encode()
+            content = controller(self, **params)
+            if content is None:
+                return 404, {}, 'Not found'.encode()
+            if method == 'DELETE' and not content:
+                return 200, headers, b''
+            if isinstance(content, (Page, StreamPage)) and content.next_cursor:
+                # other parameters, e.g. a search query, carry over to the next page
+                query = dict(self.get_query(), limit=content.limit, cursor=content.next_cursor)
+                headers['Link'] = '<{}?{}>; rel="next"'.format(
+                    urllib.parse.urlsplit(self.path).path, urllib.parse.urlencode(query)
+                )
+            encoding = None
+            if settings.COMPRESSION_LEVEL:
+                encoding = negotiate_encoding(self.headers.get('Accept-Encoding'))
+                headers['Vary'] = 'Accept-Encoding'
+            if isinstance(content, bytes):
+                # e.g. metrics, sent as the controller wrote them
+                return 200, headers, self.encode_body(headers, content, encoding)
+            if isinstance(content, (StreamPage, NDJSONStream)):
+                # the validators of a streamed page are only known once it is written, it has none
+                return 200, headers, self.stream_body(headers, content, encoding)
+            if method == 'GET':
+                etag, last_modified = get_validators(content)
+                headers['ETag'] = etag
+                if last_modified:
+                    headers['Last-Modified'] = http_date(last_modified)
+                # contents whose latest modification date misses some changes are validated by the ETag only
+                if is_not_modified(self.headers, etag, last_modified if is_date_validated(content) else None):
+                    if encoding and encoded_etag(etag, encoding) in self.headers.get('If-None-Match', ''):
+                        headers['ETag'] = encoded_etag(etag, encoding)
+                    return 304, headers, b''
+            body = dumps(content).encode()
+            return 200, headers, self.encode_body(headers, body, encoding)
+        except (exceptions.ValidationError, exceptions.NotFoundError) as e:
+            return e.status_code, {}, str(e).encode()
+        except Exception:
+            logger.exception('Error handling %s %s', method, self.path)
+            if isinstance(content, (StreamPage, NDJSONStream)):
+                content.close()
+            return 500, {}, 'Internal server error'.encode()
+
+    def stream_body(self, headers: dict, page: Union[StreamPage, NDJSONStream], encoding: str) -> Iterator[bytes]:
+        """
+        Writes a streamed page as a JSON array, or NDJSON lines as they are, in chunks of about
+        settings.STREAM_CHUNK_SIZE bytes. The first chunk is made right away, so a page that cannot
+        be read still gets an error response, an empty one is an empty chunk.
+        :param headers: response headers, Content-Encoding gets set
+        :param page:
+        :param encoding: negotiated content coding, None for identity
+        :return: generator of chunks, closing it releases the page
+        """
+        pieces = iter_dumps(page) if isinstance(page, StreamPage) else iter(page)
+        chunks = encode_chunks(pieces, settings.STREAM_CHUNK_SIZE)
+        if encoding:
+            chunks = compress_stream(chunks, encoding, settings.COMPRESSION_LEVEL)
+            headers['Content-Encoding'] = encoding
+        first = next(chunks, b'')
+
+        def stream():
+            try:
+                yield first
+                yield from chunks
+            finally:
+                page.close()
+
+        return stream()
+
+    def encode_body(self, headers: dict, body: bytes, encoding: str) -> bytes:
+        """
+        Compresses a response body large enough to be worth it. Compressed bodies of
+        responses with an ETag are cached and reused while the ETag stays the same.
+        :param headers: response headers, Content-Encoding and ETag get updated
+        :param body:
+        :param encoding: negotiated content coding, None for identity
+        :return: body
+        """
+        if encoding is None or len(body) < settings.COMPRESSION_MIN_SIZE:
+            return body
+        etag = headers.get('ETag')
+        key = (self.path, etag, encoding)
+        compressed = compressed_cache.get(key) if etag and compressed_cache is not None else None
+        if compressed is None:
+            compressed = compress(body, encoding, settings.COMPRESSION_LEVEL)
+            if etag and compressed_cache is not None:
+                compressed_cache.set(key, compressed)
+        headers['Content-Encoding'] = encoding
+        if etag:
+            headers['ETag'] = encoded_etag(etag, encoding)
+        return compressed
+
+    def record_request(self, method: str, status: int, size: int, started: float) -> None:
+        """
+        Records a served request in the metrics and the traffic recording
+        :param method:
+        :param status:
+        :param size: bytes of body sent
+        :param started: time.perf_counter() before the request was dispatched
+        :return:
+        """
+        seconds = time.perf_counter() - started
+        if self.metrics is not None:
+            self.metrics.observe_request(self.route_pattern, method, status, seconds, size)
+        if self.recorder is not None:
+            self.recorder.record(method, self.path, self.payload.body, status, size, seconds)
 
+    @classmethod
+    def kept_body_size(cls) -> int:
+        """
+        Bytes of request body kept for the traffic recording
+        """
+        return settings.RECORD_MAX_BODY if cls.recorder is not None else 0
 
-class RESTRequestHandler(http.server.BaseHTTPRequestHandler):
-    def __init__(self, *args, **kwargs):
-        self.routes = routes
-        http.server.BaseHTTPRequestHandler.__init__(self, *args, **kwargs)
+
+class RESTRequestHandler(RESTDispatcher, http.server.BaseHTTPRequestHandler):
+    """
+    Speaks HTTP/1.1. Connections are kept alive, up to settings.KEEP_ALIVE_MAX_REQUESTS requests
+    or settings.KEEP_ALIVE_TIMEOUT idle seconds, if the server handles them concurrently.
+    An idle connection is closed as soon as another connection waits for a worker, so that idle
+    clients never keep the others waiting.
+    """
+    protocol_version = 'HTTP/1.1'
+    timeout = settings.KEEP_ALIVE_TIMEOUT
+    # headers and body are separate writes, with Nagle's algorithm the body of a kept alive
+    # connection's response waits for the client's delayed ACK of the headers (about 40 ms)
+    disable_nagle_algorithm = True
+
+    def setup(self):
+        super().setup()
+        self.requests_handled = 0
+
+    def handle(self):
+        self.close_connection = True
+        self.handle_one_request()
+        while not self.close_connection and self.wait_for_request():
+            self.handle_one_request()
+
+    def wait_for_request(self) -> bool:
+        """
+        Waits for the next request of a kept alive connection, giving the worker up when another
+        connection waits for it, when the server shuts down or after settings.KEEP_ALIVE_TIMEOUT
+        :return: whether there is something to read, False closes the connection
+        """
+        if self.is_readable():
+            return True
+        deadline = time.monotonic() + self.timeout
+        while not getattr(self.server, 'pending', 0) and not getattr(self.server, 'draining', False):
+            remaining = deadline - time.monotonic()
+            if remaining <= 0:
+                return False
+            if select.select([self.connection], [], [], min(remaining, idle_poll_interval))[0]:
+                return True
+        return False
+
+    def is_readable(self) -> bool:
+        """
+        Whether the next request is buffered already (pipelined) or has arrived, without blocking
+        """
+        self.connection.settimeout(0)
+        try:
+            return bool(self.rfile.peek(1))
+        except BlockingIOError:
+            return False
+        finally:
+            self.connection.settimeout(self.timeout)
 
     def do_HEAD(self):
         self.handle_method('HEAD')
@@ -67,71 +514,225 @@ class RESTRequestHandler(http.server.BaseHTTPRequestHandler):
     def do_DELETE(self):
         self.handle_method('DELETE')
 
-    def get_payload(self):
-        payload_len = int(self.headers.get('content-length', 0))
-        payload = self.rfile.read(payload_len)
-        payload = json.loads(payload.decode())
-        return payload
-
     def handle_method(self, method):
+        started = time.perf_counter()
+        self.requests_handled += 1
+        self.payload = PayloadReader(self.rfile, get_content_length(self.headers), self.kept_body_size())
+        rejection = self.admit()
+        if rejection is not None:
+            # the body of a shed request is not read, the connection is closed instead
+            status, headers, body = rejection
+            self.record_request(method, status, self.write_response(method, status, headers, body, True), started)
+            return
         try:
-            route, params = self.get_route()
-            if route is None:
-                self.send_response(404)
-                self.end_headers()
-                self.wfile.write('Route not found'.encode())
+            status, headers, body = self.dispatch(method)
+            self.payload.discard()
+            size = self.write_response(method, status, headers, body)
+        finally:
+            self.release()
+        self.record_request(method, status, size, started)
+
+    def write_response(self, method: str, status: int, headers: dict, body: Union[bytes, Iterator[bytes]],
+                       close: bool = False) -> int:
+        """
+        Writes a response
+        :param method:
+        :param status:
+        :param headers:
+        :param body: bytes, or a generator of chunks for a streamed body
+        :param close: close the connection after the response
+        :return: bytes of body written
+        """
+        streamed = not isinstance(body, bytes)
+        # HTTP/1.0 clients do not know chunked encoding, a streamed body is ended by closing the connection
+        chunked = streamed and self.request_version != 'HTTP/1.0'
+        self.send_response(status)
+        for name, value in headers.items():
+            self.send_header(name, value)
+        # HEAD and 304 responses never have a body, other ones are framed by their length or chunked
+        if chunked:
+            self.send_header('Transfer-Encoding', 'chunked')
+        elif method != 'HEAD' and status != 304 and not streamed:
+            self.send_header('Content-Length', str(len(body)))
+        if close or not getattr(self.server, 'persistent_connections', False) \
+                or getattr(self.server, 'draining', False) \
+                or self.requests_handled >= settings.KEEP_ALIVE_MAX_REQUESTS or (streamed and not chunked):
+            self.send_header('Connection', 'close')
+        self.end_headers()
+        if streamed:
+            return self.write_stream(body, chunked)
+        if body and method != 'HEAD':
+            self.wfile.write(body)
+            return len(body)
+        return 0
+
+    def write_stream(self, chunks: Iterator[bytes], chunked: bool) -> int:
+        """
+        Writes a streamed body. Once the headers are out an error can only cut the response short,
+        the connection is closed so the client sees it incomplete.
+        :param chunks: generator of chunks, closed when done
+        :param chunked: frame chunks with chunked transfer encoding
+        :return: bytes of body written
+        """
+        size = 0
+        try:
+            for chunk in chunks:
+                if chunk:
+                    self.wfile.write(b'%x\r\n%s\r\n' % (len(chunk), chunk) if chunked else chunk)
+                    size += len(chunk)
+            if chunked:
+                self.wfile.write(b'0\r\n\r\n')
+        except Exception as e:
+            self.close_connection = True
+            self.log_error('Streamed response cut short: %r', e)
+        finally:
+            chunks.close()
+        return size
+
+
+SHED_RESPONSE = (
+    'HTTP/1.1 503 Service Unavailable\r\nRetry-After: {}\r\nContent-Length: 0\r\nConnection: close\r\n\r\n'
+).format(settings.ADMISSION_RETRY_AFTER).encode()
+
+
+class ThreadPoolHTTPServer(http.server.HTTPServer):
+    """
+    An HTTP server that handles requests in a bounded pool of worker threads
+    """
+    # a kept alive connection holds its worker only, a serial server would stall on it
+    persistent_connections = True
+    # set on shutdown, kept alive connections are closed after their current response
+    draining = False
+
+    def __init__(self, server_address, handler_class, workers: int, max_pending: int = None,
+                 bind_and_activate: bool = True):
+        super().__init__(server_address, handler_class, bind_and_activate)
+        self.executor = ThreadPoolExecutor(max_workers=workers, thread_name_prefix='rest-worker')
+        # connections waiting for a worker, beyond max_pending they are shed as they are accepted
+        self.max_pending = settings.ADMISSION_MAX_PENDING if max_pending is None else max_pending
+        self.pending = 0
+        self.shed = 0
+        self._pending_lock = threading.Lock()
+
+    def process_request(self, request, client_address):
+        with self._pending_lock:
+            shed = self.max_pending and self.pending >= self.max_pending
+            if shed:
+                self.shed += 1
             else:
-                if method == 'HEAD':
-                    self.send_response(200)
-                    if 'media_type' in route:
-                        self.send_header('Content-type', route['media_type'])
-                    self.end_headers()
-                else:
-                    if method in route:
-                        content = route[method](self, **params)
-                        if content is not None:
-                            self.send_response(200)
-                            if 'media_type' in route:
-                                self.send_header('Content-type', route['media_type'])
-                            self.end_headers()
-                            if method != 'DELETE':
-                                self.wfile.write(json.dumps(content, sort_keys=True, default=str).encode())
-                        else:
-                            self.send_response(404)
-                            self.end_headers()
-                            self.wfile.write('Not found'.encode())
-                    else:
-                        self.send_response(405)
-                        self.end_headers()
-                        self.wfile.write('{} is not supported'.format(method).encode())
-        except (exceptions.ValidationError, exceptions.NotFoundError) as e:
-            self.send_response(e.status_code)
-            self.end_headers()
-            self.wfile.write(str(e).encode())
-        except:
-            self.send_response(500)
-            self.end_headers()
-            self.wfile.write('Internal server error'.format(method).encode())
-
-    def get_route(self):
-        for path, route in self.routes.items():
-            match = re.match(path, self.path)
-            if match:
-                params = match.groupdict()
-                return route, params
-        return None, None
-
-
-def rest_server(port: int) -> None:
-    """
-    Starts the REST server
+                self.pending += 1
+        if shed:
+            self.shed_request(request)
+            return
+        self.executor.submit(self.process_request_thread, request, client_address)
+
+    def shed_request(self, request) -> None:
+        """
+        Answers a connection with 503 without reading its request, from the accepting thread
+        :param request: socket
+        :return:
+        """
+        metrics = getattr(self.RequestHandlerClass, 'metrics', None)
+        if metrics is not None:
+            metrics.observe_shed(PENDING)
+        try:
+            request.sendall(SHED_RESPONSE)
+        except OSError:
+            pass
+        self.shutdown_request(request)
+
+    def process_request_thread(self, request, client_address):
+        with self._pending_lock:
+            self.pending -= 1
+        try:
+            self.finish_request(request, client_address)
+        except Exception:
+            self.handle_error(request, client_address)
+        finally:
+            self.shutdown_request(request)
+
+    def server_close(self):
+        # idle kept alive connections let their workers go rather than waiting for their timeout
+        self.draining = True
+        super().server_close()
+        self.executor.shutdown(wait=True)
+
+
+def make_server(port: int, workers: int = 0, handler_class=RESTRequestHandler,
+                reuse_port: bool = False) -> http.server.HTTPServer:
+    """
+    Creates an HTTP server, a concurrent one if workers are requested
+    :param port:
+    :param workers: size of the worker thread pool, 0 handles requests serially
+    :param handler_class:
+    :param reuse_port: bind with SO_REUSEPORT, so that other processes can serve the same port
+    :return: server
+    """
+    if workers > 0:
+        http_server = ThreadPoolHTTPServer(('', port), handler_class, workers, bind_and_activate=False)
+    else:
+        http_server = http.server.HTTPServer(('', port), handler_class, bind_and_activate=False)
+    try:
+        if reuse_port:
+            http_server.socket.setsockopt(socket.SOL_SOCKET, socket.SO_REUSEPORT, 1)
+        http_server.server_bind()
+        http_server.server_activate()
+    except BaseException:
+        http_server.server_close()
+        raise
+    return http_server
+
+
+def enable_cache_coherence() -> None:
+    """
+    Makes the read cache follow the writes of other processes serving the same database
+    :return:
+    """
+    if cache is not None:
+        RESTDispatcher.coherence = DataVersionWatcher(cache)
+
+
+def start_sampler() -> None:
+    """
+    Starts whole-process stack sampling if settings.PROFILE_SAMPLE_SECONDS asks for it
+    :return:
+    """
+    if settings.PROFILE_SAMPLE_SECONDS:
+        StackSampler(
+            settings.PROFILE_SAMPLE_SECONDS, settings.PROFILE_SAMPLE_INTERVAL / 1000, settings.PROFILE_DIR
+        ).start()
+
+
+def rest_server(port: int, workers: int = None, reuse_port: bool = False) -> None:
+    """
+    Starts the REST server. SIGTERM shuts it down once the requests in progress are answered.
     :param port:
+    :param workers: size of the worker thread pool, settings.SERVER_WORKERS by default
+    :param reuse_port: share the port with other processes serving the same database, see supervisor.py
     :return:
     """
-    http_server = http.server.HTTPServer(('', port), RESTRequestHandler)
+    if workers is None:
+        workers = settings.SERVER_WORKERS
+    migrate_database()
+    http_server = make_server(port, workers, reuse_port=reuse_port)
     http_server.service_actions = service_worker
+    if reuse_port:
+        enable_cache_coherence()
+
+    def drain(signum, frame):
+        http_server.draining = True
+        # shutdown() waits for serve_forever, which runs in this thread
+        threading.Thread(target=http_server.shutdown, daemon=True).start()
+
+    signal.signal(signal.SIGTERM, drain)
+    start_sampler()
     try:
-        http_server.serve_forever(poll_interval)
+        http_server.serve_forever(get_poll_interval())
     except KeyboardInterrupt:
         pass
+    # a thread pool server waits for its workers, and so for the connections they serve
     http_server.server_close()
+    if recorder is not None:
+        recorder.close()
+    if writer_thread is not None:
+        writer_thread.close()
@@ -0,0 +1,133 @@
+import os
+import tempfile
+from pathlib import Path, PurePath
+
+
+def env_int(name: str, default: int) -> int:
+    """
+    Reads an integer setting from the environment
+    :param name: environment variable name
+    :param default: value used when the variable is not set
+    :return: setting value
+    """
+    value = os.environ.get(name)
+    return int(value) if value else default
+
+
+def env_float(name: str, default: float) -> float:
+    """
+    Reads a number setting from the environment
+    :param name: environment variable name
+    :param default: value used when the variable is not set
+    :return: setting value
+    """
+    value = os.environ.get(name)
+    return float(value) if value else default
+
+
+DB_PATH = os.environ.get('NEWS_DB_PATH', str(Path(__file__).parent.parent / PurePath('db/news.db')))
+
+# 0 serves requests one by one in the main thread, N > 0 uses a pool of N worker threads
+SERVER_WORKERS = env_int('NEWS_SERVER_WORKERS', 0)
+
+# 'http' runs the http.server based engine, 'asyncio' the event loop based one
+SERVER_ENGINE = os.environ.get('NEWS_SERVER_ENGINE', 'http')
+# processes serving the port, more than 1 runs a supervisor forking them, see supervisor.py
+SERVER_PROCESSES = env_int('NEWS_SERVER_PROCESSES', 1)
+# seconds stopping worker processes get to answer the requests in progress before they are killed
+SERVER_DRAIN_TIMEOUT = env_int('NEWS_SERVER_DRAIN_TIMEOUT', 30)
+
+# seconds an idle keep-alive connection is kept open
+KEEP_ALIVE_TIMEOUT = env_int('NEWS_KEEP_ALIVE_TIMEOUT', 15)
+# requests served on a connection before it is closed
+KEEP_ALIVE_MAX_REQUESTS = env_int('NEWS_KEEP_ALIVE_MAX_REQUESTS', 100)
+
+# connections kept by the repositories' connection pool
+DB_POOL_SIZE = env_int('NEWS_DB_POOL_SIZE', 8)
+# seconds to wait for a free pooled connection
+DB_POOL_TIMEOUT = env_int('NEWS_DB_POOL_TIMEOUT', 10)
+# 1 runs all writes on one writer thread and connection and reads on a pool of DB_POOL_SIZE read-only
+# connections, 0 runs both on the connections of one pool
+DB_WRITER_THREAD = env_int('NEWS_DB_WRITER_THREAD', 1)
+
+# pragmas applied to every new connection
+DB_JOURNAL_MODE = os.environ.get('NEWS_DB_JOURNAL_MODE', 'WAL')
+DB_SYNCHRONOUS = os.environ.get('NEWS_DB_SYNCHRONOUS', 'NORMAL')
+DB_MMAP_SIZE = env_int('NEWS_DB_MMAP_SIZE', 256 * 1024 * 1024)
+# negative values are KiB, positive ones are pages
+DB_CACHE_SIZE = env_int('NEWS_DB_CACHE_SIZE', -16000)
+# milliseconds
+DB_BUSY_TIMEOUT = env_int('NEWS_DB_BUSY_TIMEOUT', 5000)
+
+# default and maximum number of objects on a list page
+PAGE_SIZE = env_int('NEWS_PAGE_SIZE', 25)
+MAX_PAGE_SIZE = env_int('NEWS_MAX_PAGE_SIZE', 1000)
+
+# objects kept by the repositories' read cache, 0 disables it
+CACHE_SIZE = env_int('NEWS_CACHE_SIZE', 0)
+# seconds a cached object is served
+CACHE_TTL = env_int('NEWS_CACHE_TTL', 30)
+
+# responses smaller than this many bytes are sent uncompressed
+COMPRESSION_MIN_SIZE = env_int('NEWS_COMPRESSION_MIN_SIZE', 1024)
+# zlib compression level, 1 (fastest) to 9 (smallest), 0 disables compression
+COMPRESSION_LEVEL = env_int('NEWS_COMPRESSION_LEVEL', 6)
+# compressed bodies of responses with an ETag kept for reuse, 0 disables it
+COMPRESSION_CACHE_SIZE = env_int('NEWS_COMPRESSION_CACHE_SIZE', 256)
+COMPRESSION_CACHE_TTL = env_int('NEWS_COMPRESSION_CACHE_TTL', 300)
+
+# items accepted by one bulk request
+BULK_MAX_ITEMS = env_int('NEWS_BULK_MAX_ITEMS', 1000)
+
+# list pages with more objects than this are streamed with chunked transfer encoding, 0 disables streaming
+STREAM_PAGE_SIZE = env_int('NEWS_STREAM_PAGE_SIZE', 100)
+# bytes of JSON gathered into one chunk of a streamed response
+STREAM_CHUNK_SIZE = env_int('NEWS_STREAM_CHUNK_SIZE', 16384)
+
+# rows committed per transaction by an NDJSON import
+IMPORT_BATCH_SIZE = env_int('NEWS_IMPORT_BATCH_SIZE', 1000)
+
+# tokens around the matches in a search result snippet, at most 64
+SEARCH_SNIPPET_TOKENS = env_int('NEWS_SEARCH_SNIPPET_TOKENS', 16)
+
+# milliseconds a write may wait to be committed together with concurrent ones (group commit), 0 commits
+# every write on its own, or with DB_WRITER_THREAD the writes queued meanwhile
+GROUP_COMMIT_DELAY = env_int('NEWS_GROUP_COMMIT_DELAY', 0)
+# writes committed by one group commit at most
+GROUP_COMMIT_MAX_WRITES = env_int('NEWS_GROUP_COMMIT_MAX_WRITES', 100)
+
+# 1 records request and database timings and serves them on /metrics, 0 disables it
+METRICS = env_int('NEWS_METRICS', 1)
+
+# one request in N is profiled with cProfile, 0 disables it
+PROFILE_EVERY = env_int('NEWS_PROFILE_EVERY', 0)
+# requests with this value in an X-Profile header are profiled and answered with a summary, '' disables it
+PROFILE_SECRET = os.environ.get('NEWS_PROFILE_SECRET', '')
+# directory of saved profiles, '' saves none
+PROFILE_DIR = os.environ.get('NEWS_PROFILE_DIR', str(Path(tempfile.gettempdir()) / 'news-restapi-profiles'))
+# functions listed by a profile summary
+PROFILE_TOP = env_int('NEWS_PROFILE_TOP', 25)
+# seconds the stacks of the whole process are sampled for after the server starts, 0 disables it
+PROFILE_SAMPLE_SECONDS = env_int('NEWS_PROFILE_SAMPLE_SECONDS', 0)
+# milliseconds between stack samples
+PROFILE_SAMPLE_INTERVAL = env_int('NEWS_PROFILE_SAMPLE_INTERVAL', 5)
+
+# file served requests are recorded to as JSON lines, see recording.py, '' disables recording
+RECORD_PATH = os.environ.get('NEWS_RECORD_PATH', '')
+# fraction of requests recorded
+RECORD_SAMPLE_RATE = env_float('NEWS_RECORD_SAMPLE_RATE', 1.0)
+# request bodies larger than this many bytes are recorded without the body
+RECORD_MAX_BODY = env_int('NEWS_RECORD_MAX_BODY', 65536)
+# records waiting to be written, more are dropped
+RECORD_QUEUE_SIZE = env_int('NEWS_RECORD_QUEUE_SIZE', 10000)
+
+# requests handled at once, more are answered with 503 right away, 0 means no limit
+ADMISSION_MAX_IN_FLIGHT = env_int('NEWS_ADMISSION_MAX_IN_FLIGHT', 0)
+# connections waiting for a worker thread of the thread pool server, more are answered with 503, 0 means no limit
+ADMISSION_MAX_PENDING = env_int('NEWS_ADMISSION_MAX_PENDING', 0)
+# requests per second a client address may make on average, more are answered with 429, 0 means no limit
+ADMISSION_RATE = env_float('NEWS_ADMISSION_RATE', 0)
+# requests a client address may make at once above its rate
+ADMISSION_BURST = env_int('NEWS_ADMISSION_BURST', 20)
+# seconds clients are told to wait by the Retry-After header of 503 responses
+ADMISSION_RETRY_AFTER = env_int('NEWS_ADMISSION_RETRY_AFTER', 1)
@@ -0,0 +1,126 @@
+import logging
+import os
+import signal
+import time
+from typing import Callable
+
+logger = logging.getLogger(__name__)
+
+
+class Supervisor:
+    """
+    Pre-fork server: runs processes worker processes, each serving the same port with SO_REUSEPORT
+    so that the kernel spreads connections across them and every core can run Python code.
+    A worker that exits is restarted, one that crashes right after starting is restarted after restart_delay.
+    SIGTERM or SIGINT is passed to the workers as SIGTERM, which answer the requests in progress and exit;
+    workers still running after drain_timeout seconds are killed.
+    """
+    def __init__(self, serve: Callable[[], None], processes: int, drain_timeout: float = 30,
+                 restart_delay: float = 1, poll_interval: float = 0.1):
+        """
+        :param serve: serves requests until SIGTERM, run in every worker process
+        :param processes:
+        :param drain_timeout:
+        :param restart_delay:
+        :param poll_interval: seconds between checks for exited workers
+        """
+        self.serve = serve
+        self.processes = processes
+        self.drain_timeout = drain_timeout
+        self.restart_delay = restart_delay
+        self.poll_interval = poll_interval
+        self.workers = {}  # pid -> slot, start time
+        self.restarts = []  # due time, slot of the workers to restart
+        self.restarted = 0
+        self.stopping_since = None
+
+    def run(self) -> None:
+        """
+        Starts the workers and supervises them until they all exited after a stop
+        :return:
+        """
+        handlers = {signum: signal.signal(signum, self.stop) for signum in (signal.SIGTERM, signal.SIGINT)}
+        try:
+            for slot in range(self.processes):
+                self.spawn(slot)
+            while self.workers or self.restarts:
+                self.reap()
+                if self.stopping_since is None:
+                    self.restart_due()
+                elif time.monotonic() - self.stopping_since > self.drain_timeout:
+                    self.kill(signal.SIGKILL)
+                time.sleep(self.poll_interval)
+        finally:
+            for signum, handler in handlers.items():
+                signal.signal(signum, handler)
+
+    def spawn(self, slot: int) -> int:
+        """
+        Forks a worker
+        :param slot: number of the worker, kept by its replacements
+        :return: pid
+        """
+        pid = os.fork()
+        if pid == 0:
+            # a terminal's Ctrl-C reaches the whole process group, the worker waits for the supervisor's SIGTERM
+            signal.signal(signal.SIGINT, signal.SIG_IGN)
+            signal.signal(signal.SIGTERM, signal.SIG_DFL)
+            status = 0
+            try:
+                self.serve()
+            except BaseException:
+                logger.exception('Worker %d failed', slot)
+                status = 1
+            finally:
+                # never return into the supervisor's code
+                os._exit(status)
+        self.workers[pid] = (slot, time.monotonic())
+        logger.info('Started worker %d, pid %d', slot, pid)
+        return pid
+
+    def reap(self) -> None:
+        """
+        Collects exited workers and schedules their restart
+        :return:
+        """
+        while self.workers:
+            try:
+                pid, status = os.waitpid(-1, os.WNOHANG)
+            except ChildProcessError:
+                self.workers.clear()
+                return
+            if pid == 0:
+                return
+            slot, started = self.workers.pop(pid, (None, None))
+            if slot is None or self.stopping_since is not None:
+                continue
+            logger.warning('Worker %d, pid %d, exited with wait status %d', slot, pid, status)
+            # a worker dying right away likely dies again, do not fork in a tight loop
+            delay = self.restart_delay if time.monotonic() - started < self.restart_delay else 0
+            self.restarts.append((time.monotonic() + delay, slot))
+
+    def restart_due(self) -> None:
+        now = time.monotonic()
+        due = [slot for at, slot in self.restarts if at <= now]
+        self.restarts = [(at, slot) for at, slot in self.restarts if at > now]
+        for slot in due:
+            self.spawn(slot)
+            self.restarted += 1
+
+    def stop(self, signum=None, frame=None) -> None:
+        """
+        Asks the workers to drain and exit
+        :return:
+        """
+        if self.stopping_since is not None:
+            return
+        self.stopping_since = time.monotonic()
+        self.restarts = []
+        self.kill(signal.SIGTERM)
+
+    def kill(self, signum: int) -> None:
+        for pid in list(self.workers):
+            try:
+                os.kill(pid, signum)
+            except ProcessLookupError:
+                pass
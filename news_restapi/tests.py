@@ -1,14 +1,46 @@
+import asyncio
+import http.client
 import sqlite3
+import tempfile
+import threading
 import unittest
 import copy
+import gzip
+import json
+import os
+import re
+import socket
+import time
 
 from pathlib import Path, PurePath
 from datetime import datetime
 from dataclasses import asdict
+from unittest import mock
+from news_restapi import settings
 from news_restapi.utils import timestamp_to_datetime, datetime_to_timestamp
 from news_restapi.models import News, Comment
-from news_restapi.repositories import NewsRepository, CommentRepository
-from news_restapi.controllers import NewsController, CommentController
+from news_restapi.repositories import (
+    NewsRepository, CommentRepository, ConnectionPool, RepositoryException, ConstraintViolation, WriteQueue,
+    DataVersionWatcher, WriterThread, get_connection, get_read_connection
+)
+from news_restapi.controllers import NewsController, CommentController, TransferController, MetricsController
+from news_restapi.exceptions import ValidationError
+from news_restapi import server
+from news_restapi.cache import LRUCache
+from news_restapi.metrics import Metrics
+from news_restapi.profiling import RequestProfiler, StackSampler
+from news_restapi.recording import TrafficRecorder
+from news_restapi.admission import AdmissionControl
+from news_restapi.supervisor import Supervisor
+from news_restapi.compression import negotiate_encoding, encoded_etag, decoded_etag
+from news_restapi.migrations import (
+    MIGRATIONS, migrate, get_version, explain_queries, is_full_scan, repair_comment_counts
+)
+from news_restapi.routing import Router
+from news_restapi.serializers import dumps, iter_dumps
+from news_restapi.server import make_server, build_routes, RESTRequestHandler, ThreadPoolHTTPServer
+from news_restapi.async_server import AsyncRESTServer, AsyncRESTRequest
+from news_restapi.transfer import export_ndjson, import_ndjson
 
 
 class TestCaseUtils(unittest.TestCase):
@@ -23,9 +55,119 @@ class TestCaseUtils(unittest.TestCase):
         self.assertEqual(datetime_to_timestamp(self.datetime), self.ts)
 
 
+class TestCaseCompression(unittest.TestCase):
+    def test_negotiate_encoding(self):
+        self.assertIsNone(negotiate_encoding(None))
+        self.assertIsNone(negotiate_encoding('br'))
+        self.assertEqual(negotiate_encoding('gzip, deflate'), 'gzip')
+        self.assertEqual(negotiate_encoding('gzip;q=0.5, deflate'), 'deflate')
+        self.assertEqual(negotiate_encoding('*'), 'gzip')
+        self.assertIsNone(negotiate_encoding('gzip;q=0, deflate;q=0'))
+
+    def test_etag(self):
+        self.assertEqual(encoded_etag('"abc"', 'gzip'), '"abc-gzip"')
+        self.assertEqual(decoded_etag('"abc-gzip"'), '"abc"')
+        self.assertEqual(decoded_etag('"abc"'), '"abc"')
+
+
+class TestCaseMetrics(unittest.TestCase):
+    def test_render(self):
+        metrics = Metrics()
+        metrics.observe_request(r'^/news/(?P<pk>\d+)/$', 'GET', 200, 0.003, 100)
+        metrics.observe_request(r'^/news/(?P<pk>\d+)/$', 'GET', 404, 0.2, 9)
+        metrics.observe_request(None, 'GET', 404, 10, 15)
+        metrics.observe_query('news', 'get', 0.0002)
+        lines = metrics.render().splitlines()
+        labels = 'route="^/news/(?P<pk>\\\\d+)/$",method="GET"'
+        self.assertIn('news_http_requests_total{{{},status="200"}} 1'.format(labels), lines)
+        self.assertIn('news_http_requests_total{{{},status="404"}} 1'.format(labels), lines)
+        self.assertIn('news_http_request_duration_seconds_bucket{{{},le="0.0025"}} 0'.format(labels), lines)
+        self.assertIn('news_http_request_duration_seconds_bucket{{{},le="0.005"}} 1'.format(labels), lines)
+        self.assertIn('news_http_request_duration_seconds_bucket{{{},le="+Inf"}} 2'.format(labels), lines)
+        self.assertIn('news_http_request_duration_seconds_count{{{}}} 2'.format(labels), lines)
+        self.assertIn('news_http_response_bytes_total{{{}}} 109'.format(labels), lines)
+        self.assertIn('news_http_request_duration_seconds_bucket{route="unmatched",method="GET",le="5.0"} 0', lines)
+        self.assertIn('news_db_query_duration_seconds_bucket{table="news",query="get",le="0.00025"} 1', lines)
+        self.assertIn('news_db_query_duration_seconds_sum{table="news",query="get"} 0.0002', lines)
+
+    def test_cache_stats(self):
+        metrics = Metrics()
+        cache = LRUCache(1, 10)
+        metrics.add_cache('read', cache)
+        cache.set('a', 1)
+        cache.get('a')
+        cache.get('b')
+        cache.set('b', 2)
+        lines = metrics.render().splitlines()
+        self.assertIn('# TYPE news_cache_hits_total counter', lines)
+        self.assertIn('news_cache_hits_total{cache="read"} 1', lines)
+        self.assertIn('news_cache_misses_total{cache="read"} 1', lines)
+        self.assertIn('news_cache_evictions_total{cache="read"} 1', lines)
+        self.assertIn('news_cache_entries{cache="read"} 1', lines)
+
+
+class TestCaseRouter(unittest.TestCase):
+    def setUp(self):
+        self.router = Router({
+            r'^/news/$': {'GET': 'list', 'POST': 'add'},
+            r'^/news/(?P<pk>\d+)/$': {'GET': 'get', 'media_type': 'application/json'},
+            r'^/news/(?P<news_pk>\d+)/comments/(?P<pk>\d+)/$': {'DELETE': 'delete'},
+            r'^/tags/(?P<slug>[a-z]+)/$': {'GET': 'tag'},
+        })
+
+    def test_resolve(self):
+        self.assertEqual(
+            self.router.resolve('GET', '/news/'),
+            ({'GET': 'list', 'POST': 'add'}, 'list', {}, 'GET, POST, HEAD')
+        )
+        route, controller, params, allow = self.router.resolve('DELETE', '/news/1/comments/22/')
+        self.assertEqual((controller, params), ('delete', {'news_pk': 1, 'pk': 22}))
+        self.assertEqual(self.router.resolve('GET', '/tags/python/')[1:3], ('tag', {'slug': 'python'}))
+
+    def test_not_allowed(self):
+        route, controller, params, allow = self.router.resolve('PUT', '/news/1/')
+        self.assertIsNotNone(route)
+        self.assertIsNone(controller)
+        self.assertEqual(allow, 'GET, HEAD')
+
+    def test_not_found(self):
+        self.assertIsNone(self.router.resolve('GET', '/news/x/')[0])
+        self.assertIsNone(self.router.resolve('GET', '/news/1/comments/')[0])
+        self.assertIsNone(self.router.resolve('GET', '/news/{}/'.format(2 ** 63))[0])
+        self.assertEqual(self.router.resolve('GET', '/news/{}/'.format(2 ** 63 - 1))[2], {'pk': 2 ** 63 - 1})
+
+
+class TestCaseSerializers(unittest.TestCase):
+    def setUp(self):
+        dt = datetime(2019, 11, 17, 15, 27, 43, 804000)
+        self.news = News(id=1, created_date=dt, modified_date=dt.replace(microsecond=0), title='Заголовок "1"',
+                         content='Line\nline')
+        self.comment = Comment(id=2, created_date=dt, modified_date=dt, news_id=1, content=None)
+
+    def test_same_as_json_dumps(self):
+        for content in (self.news, self.comment, [self.news, self.comment], {'news': self.news, 'count': 1}):
+            self.assertEqual(
+                dumps(content),
+                json.dumps(
+                    [asdict(obj) for obj in content] if isinstance(content, list) else
+                    {key: asdict(value) if key == 'news' else value for key, value in content.items()}
+                    if isinstance(content, dict) else asdict(content),
+                    sort_keys=True, default=str
+                )
+            )
+
+    def test_iter_dumps(self):
+        self.assertEqual(''.join(iter_dumps(iter([self.news, self.comment]))), dumps([self.news, self.comment]))
+        self.assertEqual(''.join(iter_dumps(iter([]))), '[]')
+
+    def test_slots(self):
+        self.assertFalse(hasattr(self.news, '__dict__'))
+        self.assertEqual(copy.copy(self.news), self.news)
+
+
 class TestCaseBaseRepository(unittest.TestCase):
     def setUp(self):
-        self.conn = sqlite3.connect(":memory:", isolation_level=None)
+        self.conn = sqlite3.connect(":memory:", isolation_level=None, check_same_thread=False)
         cur = self.conn.cursor()
 
         with open(Path(__file__).parent.parent / PurePath('db/schema.sql'), 'r') as content_file:
@@ -33,6 +175,50 @@ class TestCaseBaseRepository(unittest.TestCase):
 
         cur.executescript(schema_sql)
         self.conn.commit()
+        migrate(self.conn)
+
+
+class TestCaseMigrations(TestCaseBaseRepository):
+    def test_migrate(self):
+        self.assertEqual(get_version(self.conn), MIGRATIONS[-1][0])
+        self.assertEqual(migrate(self.conn), [])
+        indexes = {row[0] for row in self.conn.execute("SELECT name FROM sqlite_master WHERE type = 'index'")}
+        self.assertIn('comment_news_id_id_idx', indexes)
+        self.assertIn('news_modified_date_idx', indexes)
+
+    def test_search_index_rebuilt(self):
+        conn = sqlite3.connect(':memory:', isolation_level=None)
+        with open(Path(__file__).parent.parent / PurePath('db/schema.sql'), 'r') as content_file:
+            conn.executescript(content_file.read())
+        conn.execute("INSERT INTO news (created_date, modified_date, title, content) VALUES (1, 1, 'Old', 'Story')")
+        migrate(conn)
+        self.assertEqual(len(NewsRepository(connection=conn).search_news('story', 10)), 1)
+
+    def test_comment_counts(self):
+        self.conn.execute('PRAGMA foreign_keys = ON')
+        news_repository = NewsRepository(connection=self.conn)
+        comment_repository = CommentRepository(connection=self.conn)
+        dt = datetime.now()
+        news = news_repository.add_news(News(id=None, created_date=dt, modified_date=dt, title='T', content='C'))
+        comments = comment_repository.add_comment_many([
+            Comment(id=None, created_date=dt, modified_date=dt, news_id=news.id, content='C') for _ in range(3)
+        ])
+        comment_repository.delete_comment(comments[0])
+        self.assertEqual(news_repository.get_news(news.id).comment_count, 2)
+        self.assertEqual(news_repository.list_news(1)[0].comment_count, 2)
+
+        self.conn.execute('UPDATE news SET comment_count = 10')
+        self.assertEqual(repair_comment_counts(self.conn), 1)
+        self.assertEqual(repair_comment_counts(self.conn), 0)
+        self.assertEqual(news_repository.get_news(news.id).comment_count, 2)
+
+    def test_explain_queries(self):
+        plans = dict(explain_queries(self.conn))
+        self.assertFalse(self.conn.execute('SELECT COUNT(*) FROM news').fetchone()[0])
+        comment_plans = [plan for statement, plan in plans.items() if 'WHERE news_id' in statement]
+        self.assertTrue(comment_plans)
+        for plan in comment_plans:
+            self.assertFalse([line for line in plan if is_full_scan(line)], plan)
 
 
 class TestCaseNewsRepository(TestCaseBaseRepository):
@@ -51,9 +237,24 @@ class TestCaseNewsRepository(TestCaseBaseRepository):
         self.news_repository = NewsRepository(connection=self.conn)
 
     def test_list_news(self):
-        news_list = self.news_repository.list_news(1, 0)
+        news_list = self.news_repository.list_news(1)
         self.assertListEqual(news_list, [self.news])
 
+    def test_list_news_before_id(self):
+        older = self.news_repository.add_news(copy.copy(self.news))
+        self.assertListEqual(self.news_repository.list_news(10, older.id), [self.news])
+        self.assertListEqual(self.news_repository.list_news(10, self.news.id), [])
+
+    def test_iter_news(self):
+        newer = [self.news_repository.add_news(copy.copy(self.news)) for _ in range(2)]
+        last_id = self.news_repository.get_news_page_end(2)
+        self.assertEqual(last_id, newer[0].id)
+        self.assertListEqual(list(self.news_repository.iter_news(None, last_id)), newer[::-1])
+        self.assertIsNone(self.news_repository.get_news_page_end(2, last_id))
+        self.assertListEqual(list(self.news_repository.iter_news(last_id)), [self.news])
+        # the last page has no end id, news added after get_news_page_end stay off it
+        self.assertListEqual(list(self.news_repository.iter_news(None, None, 2)), newer[::-1])
+
     def test_get_news(self):
         news = self.news_repository.get_news(self.news.id)
         self.assertEqual(news, self.news)
@@ -74,11 +275,85 @@ class TestCaseNewsRepository(TestCaseBaseRepository):
         data = cur.fetchone()
         self.assertIsNone(data)
 
+    def test_get_news_with_comments(self):
+        self.assertEqual(self.news_repository.get_news_with_comments(self.news.id, 2).comments, [])
+        comment_repository = CommentRepository(connection=self.conn)
+        comments = comment_repository.add_comment_many([
+            Comment(id=None, created_date=self.news.created_date, modified_date=self.news.modified_date,
+                    news_id=self.news.id, content=str(index))
+            for index in range(3)
+        ])
+        news = self.news_repository.get_news_with_comments(self.news.id, 2)
+        self.assertEqual((news.id, news.title, news.comment_count), (self.news.id, self.news.title, 3))
+        self.assertEqual(news.comments, comments[:0:-1])
+        self.assertIsNone(self.news_repository.get_news_with_comments(self.news.id + 1, 2))
+
+    def test_search_news(self):
+        dt = datetime.now()
+        other = self.news_repository.add_news(
+            News(id=None, created_date=dt, modified_date=dt, title='Title', content='Weather weather report')
+        )
+        hits = self.news_repository.search_news('weather', 10)
+        self.assertEqual([hit.id for hit, score in hits], [other.id])
+        self.assertEqual(hits[0][0].snippet, '<mark>Weather</mark> <mark>weather</mark> report')
+        self.assertEqual([hit.id for hit, score in self.news_repository.search_news('news "title', 10)], [self.news.id])
+
+        other.content = 'Sports'
+        self.news_repository.update_news(other)
+        self.assertEqual(self.news_repository.search_news('weather', 10), [])
+        self.news_repository.delete_news(self.news)
+        self.assertEqual(self.news_repository.search_news('content', 10), [])
+
     def test_add_news(self):
         created_news = self.news_repository.add_news(self.news)
         self.assertIsNotNone(created_news.id)
 
 
+class TestCaseBulkRepository(TestCaseBaseRepository):
+    def setUp(self):
+        super().setUp()
+        self.news_repository = NewsRepository(connection=self.conn)
+        dt = datetime.now()
+        self.news_list = [
+            News(id=None, created_date=dt, modified_date=dt, title='Title {}'.format(i), content='Content')
+            for i in range(5)
+        ]
+
+    def test_add_many(self):
+        self.news_repository.add_news(copy.copy(self.news_list[0]))
+        news_list = self.news_repository.add_news_many(self.news_list)
+        self.assertEqual([news.id for news in news_list], [2, 3, 4, 5, 6])
+        stored = self.news_repository.get_news_many(news.id for news in news_list)
+        self.assertEqual([stored[news.id] for news in news_list], news_list)
+
+    def test_update_many(self):
+        news_list = self.news_repository.add_news_many(self.news_list)
+        for news in news_list:
+            news.title = 'Updated'
+        self.news_repository.update_news_many(news_list[:2])
+        titles = [row[0] for row in self.conn.execute('SELECT title FROM news ORDER BY id')]
+        self.assertEqual(titles, ['Updated', 'Updated', 'Title 2', 'Title 3', 'Title 4'])
+
+    def test_delete_many(self):
+        news_list = self.news_repository.add_news_many(self.news_list)
+        self.news_repository.delete_news_many(news_list[1:])
+        self.assertEqual(list(self.news_repository.get_news_many(news.id for news in news_list)), [news_list[0].id])
+
+    def test_add_many_rolls_back(self):
+        comment_repository = CommentRepository(connection=self.conn)
+        self.conn.execute('PRAGMA foreign_keys = ON')
+        news = self.news_repository.add_news(self.news_list[0])
+        dt = datetime.now()
+        comments = [
+            Comment(id=None, created_date=dt, modified_date=dt, news_id=news_id, content='Comment')
+            for news_id in (news.id, news.id + 1)
+        ]
+        with self.assertRaises(ConstraintViolation):
+            comment_repository.add_comment_many(comments)
+        self.assertEqual(self.conn.execute('SELECT COUNT(*) FROM comment').fetchone()[0], 0)
+        self.assertFalse(self.conn.in_transaction)
+
+
 class TestCaseCommentRepository(TestCaseBaseRepository):
     def setUp(self):
         super().setUp()
@@ -102,7 +377,12 @@ class TestCaseCommentRepository(TestCaseBaseRepository):
         self.comment_repository = CommentRepository(connection=self.conn)
 
     def test_list_comment(self):
-        comment_list = self.comment_repository.get_comments_for_news(self.news.id, 1, 0)
+        comment_list = self.comment_repository.get_comments_for_news(self.news.id, 1)
+        self.assertListEqual(comment_list, [self.comment])
+
+    def test_list_comment_before_id(self):
+        newer = self.comment_repository.add_comment(copy.copy(self.comment))
+        comment_list = self.comment_repository.get_comments_for_news(self.news.id, 10, newer.id)
         self.assertListEqual(comment_list, [self.comment])
 
     def test_get_comment(self):
@@ -130,8 +410,173 @@ class TestCaseCommentRepository(TestCaseBaseRepository):
         self.assertIsNotNone(created_comment.id)
 
 
+class TestCaseTransfer(TestCaseBaseRepository):
+    def setUp(self):
+        super().setUp()
+        self.conn.execute('PRAGMA foreign_keys = ON')
+        dt = datetime.now()
+        self.news = NewsRepository(connection=self.conn).add_news_many([
+            News(id=None, created_date=dt, modified_date=dt, title='News {}'.format(index), content='Content')
+            for index in range(3)
+        ])
+        self.comments = CommentRepository(connection=self.conn).add_comment_many([
+            Comment(id=None, created_date=dt, modified_date=dt, news_id=news.id, content='Comment')
+            for news in self.news[::-1] for _ in range(2)
+        ])
+
+    def import_conn(self):
+        conn = sqlite3.connect(':memory:', isolation_level=None)
+        with open(Path(__file__).parent.parent / PurePath('db/schema.sql'), 'r') as content_file:
+            conn.executescript(content_file.read())
+        conn.execute('PRAGMA foreign_keys = ON')
+        migrate(conn)
+        return conn
+
+    def test_export(self):
+        lines = [json.loads(line) for line in export_ndjson(self.conn)]
+        self.assertEqual(len(lines), 9)
+        news = NewsRepository(connection=self.conn).get(self.news[0].id)
+        self.assertEqual(lines[0], {'news': json.loads(dumps(news))})
+        self.assertEqual(lines[0]['news']['comment_count'], 2)
+        self.assertEqual([line['comment']['news_id'] for line in lines[1:3]], [self.news[0].id] * 2)
+        self.assertFalse(self.conn.in_transaction)
+
+    def test_round_trip(self):
+        lines = list(export_ndjson(self.conn))
+        conn = self.import_conn()
+        stats = import_ndjson([line.encode() for line in lines], NewsRepository(connection=conn).write, 4)
+        self.assertEqual((stats.news, stats.comments), (3, 6))
+        self.assertEqual(list(export_ndjson(conn)), lines)
+
+    def test_import_without_ids(self):
+        conn = self.import_conn()
+        lines = [b'{"news": {"title": "Title", "content": "Content"}}\n', b'\n', b'{"comment": {"content": "A"}}']
+        import_ndjson(lines, NewsRepository(connection=conn).write, 1)
+        news_id, = conn.execute('SELECT id FROM news').fetchone()
+        self.assertEqual(conn.execute('SELECT news_id, content FROM comment').fetchall(), [(news_id, 'A')])
+
+    def test_import_error(self):
+        conn = self.import_conn()
+        lines = [b'{"news": {"id": 5, "title": "Title"}}', b'{"comment": {"content": "A"}}', b'{"news": {"id": "x"}}']
+        with self.assertRaises(ValidationError) as context:
+            import_ndjson(lines, NewsRepository(connection=conn).write, 1)
+        error = json.loads(str(context.exception))
+        self.assertEqual(error['line'], 3)
+        self.assertEqual(error['errors'], {'id': 'Invalid value'})
+        self.assertEqual(error['imported']['comments'], 1)
+        with self.assertRaises(ValidationError):
+            import_ndjson([b'{"comment": {"news_id": 99, "content": "A"}}'], NewsRepository(connection=conn).write, 1)
+        self.assertEqual(conn.execute('SELECT COUNT(*) FROM comment').fetchone()[0], 1)
+
+
+class TestCaseLRUCache(unittest.TestCase):
+    def setUp(self):
+        self.now = 0
+        self.cache = LRUCache(2, 10, clock=lambda: self.now)
+
+    def test_lru_eviction(self):
+        self.cache.set('a', 1)
+        self.cache.set('b', 2)
+        self.assertEqual(self.cache.get('a'), 1)
+        self.cache.set('c', 3)
+        self.assertIsNone(self.cache.get('b'))
+        self.assertEqual(self.cache.get('a'), 1)
+        self.assertEqual(self.cache.stats(), {'size': 2, 'hits': 2, 'misses': 1, 'evictions': 1})
+
+    def test_ttl(self):
+        self.cache.set('a', 1)
+        self.now = 11
+        self.assertIsNone(self.cache.get('a'))
+        self.assertEqual(len(self.cache), 0)
+
+    def test_invalidate_tags(self):
+        self.cache.set('a', 1, tags=('x', 'y'))
+        self.cache.set('b', 2, tags=('y',))
+        self.cache.invalidate_tags('x')
+        self.assertIsNone(self.cache.get('a'))
+        self.assertEqual(self.cache.get('b'), 2)
+
+    def test_stale_load_not_stored(self):
+        def load():
+            self.cache.invalidate_tags('x')
+            return 1
+        self.assertEqual(self.cache.get_or_load('a', load, ('x',)), 1)
+        self.assertIsNone(self.cache.get('a'))
+
+
+class TestCaseCachedRepository(TestCaseBaseRepository):
+    def setUp(self):
+        super().setUp()
+        self.conn.execute('PRAGMA foreign_keys = ON')
+        self.cache = LRUCache(100, 60)
+        self.news_repository = NewsRepository(connection=self.conn, cache=self.cache)
+        self.comment_repository = CommentRepository(connection=self.conn, cache=self.cache)
+        dt = datetime.now()
+        self.news = self.news_repository.add_news(
+            News(id=None, created_date=dt, modified_date=dt, title='News title', content='News content')
+        )
+        self.comment = self.comment_repository.add_comment(
+            Comment(id=None, created_date=dt, modified_date=dt, news_id=self.news.id, content='Comment content')
+        )
+        self.news.comment_count = 1
+        self.queries = []
+        self.conn.set_trace_callback(self.queries.append)
+
+    def test_hot_reads_skip_database(self):
+        for _ in range(3):
+            self.assertEqual(self.news_repository.get_news(self.news.id), self.news)
+            self.assertEqual(self.news_repository.list_news(10), [self.news])
+            self.assertEqual(self.comment_repository.get_comment(self.comment.id), self.comment)
+            self.assertEqual(self.comment_repository.get_comments_for_news(self.news.id, 10), [self.comment])
+        self.assertEqual(len(self.queries), 4)
+        self.assertEqual(self.cache.hits, 8)
+
+    def test_cached_objects_are_copies(self):
+        news = self.news_repository.get_news(self.news.id)
+        news.title = 'Changed'
+        self.assertEqual(self.news_repository.get_news(self.news.id).title, 'News title')
+
+    def test_update_invalidates(self):
+        self.news_repository.list_news(10)
+        news = self.news_repository.get_news(self.news.id)
+        news.title = 'Updated title'
+        self.news_repository.update_news(news)
+        self.assertEqual(self.news_repository.get_news(self.news.id).title, 'Updated title')
+        self.assertEqual(self.news_repository.list_news(10)[0].title, 'Updated title')
+
+    def test_add_comment_invalidates_list(self):
+        self.comment_repository.get_comments_for_news(self.news.id, 10)
+        comment = self.comment_repository.add_comment(copy.copy(self.comment))
+        self.assertEqual(len(self.comment_repository.get_comments_for_news(self.news.id, 10)), 2)
+        self.comment_repository.delete_comment(comment)
+        self.assertEqual(self.comment_repository.get_comments_for_news(self.news.id, 10), [self.comment])
+
+    def test_delete_news_invalidates_comments(self):
+        self.comment_repository.get_comment(self.comment.id)
+        self.comment_repository.get_comments_for_news(self.news.id, 10)
+        self.news_repository.delete_news(self.news)
+        self.assertIsNone(self.news_repository.get_news(self.news.id))
+        self.assertIsNone(self.comment_repository.get_comment(self.comment.id))
+        self.assertEqual(self.comment_repository.get_comments_for_news(self.news.id, 10), [])
+
+    def test_news_with_comments(self):
+        news = self.news_repository.get_news_with_comments(self.news.id, 10)
+        self.assertEqual(news.comments, [self.comment])
+        news.comments[0].content = 'Changed'
+        self.assertEqual(self.news_repository.get_news_with_comments(self.news.id, 10).comments, [self.comment])
+        self.assertEqual(len(self.queries), 1)
+
+        self.comment.content = 'Updated'
+        self.comment_repository.update_comment(self.comment)
+        self.assertEqual(self.news_repository.get_news_with_comments(self.news.id, 10).comments[0].content, 'Updated')
+
+
 class MockHandler:
-    pass
+    def __init__(self, query: dict = None):
+        self.query = query or {}
+
+    def get_query(self):
+        return self.query
 
 
 class TestCaseNewsController(TestCaseBaseRepository):
@@ -142,7 +587,7 @@ class TestCaseNewsController(TestCaseBaseRepository):
         news = News(id=None, created_date=dt, modified_date=dt, title='News title', content='News content')
         news = self.news_repository.add_news(news)
         self.news_id = news.id
-        self.news_dict = asdict(news)
+        self.news = news
         self.news_updated = asdict(News(
             id=self.news_id, created_date=dt, modified_date=dt,
             title='News updated title', content='News updated content')
@@ -160,14 +605,34 @@ class TestCaseNewsController(TestCaseBaseRepository):
         )
 
     def test_list_news(self):
-        self.assertEqual(self.news_controller.list_news(self.palyoad_create), [self.news_dict])
+        self.assertEqual(self.news_controller.list_news(self.palyoad_create), [self.news])
+
+    def test_list_news_pages(self):
+        second = self.news_controller.add_news(self.palyoad_create)
+        page = self.news_controller.list_news(MockHandler({'limit': '1'}))
+        self.assertEqual([news.id for news in page], [second.id])
+        self.assertIsNotNone(page.next_cursor)
+        page = self.news_controller.list_news(MockHandler({'limit': '1', 'cursor': page.next_cursor}))
+        self.assertEqual(page, [self.news])
+        self.assertIsNone(page.next_cursor)
+
+    def test_list_news_invalid_params(self):
+        with self.assertRaises(ValidationError):
+            self.news_controller.list_news(MockHandler({'limit': '0'}))
+        with self.assertRaises(ValidationError):
+            self.news_controller.list_news(MockHandler({'cursor': 'garbage'}))
+
+    def test_list_news_max_limit(self):
+        with mock.patch.object(settings, 'MAX_PAGE_SIZE', 1):
+            self.news_controller.add_news(self.palyoad_create)
+            self.assertEqual(len(self.news_controller.list_news(MockHandler({'limit': '100'}))), 1)
 
     def test_get_news(self):
-        self.assertEqual(self.news_controller.get_news(self.palyoad_create, **{'pk': self.news_id}), self.news_dict)
+        self.assertEqual(self.news_controller.get_news(self.palyoad_create, **{'pk': self.news_id}), self.news)
 
     def test_update_news(self):
         result = self.news_controller.update_news(self.palyoad_update, **{'pk': self.news_id})
-        result_check = {'title': result['title'], 'content': result['content']}
+        result_check = {'title': result.title, 'content': result.content}
         self.assertEqual(result_check, self.palyoad_update.get_payload())
 
     def test_delete_news(self):
@@ -176,7 +641,7 @@ class TestCaseNewsController(TestCaseBaseRepository):
 
     def test_add_news(self):
         result = self.news_controller.add_news(self.palyoad_create)
-        result_check = {'title': result['title'], 'content': result['content']}
+        result_check = {'title': result.title, 'content': result.content}
         self.assertEqual(result_check, self.palyoad_create.get_payload())
 
 
@@ -195,7 +660,7 @@ class TestCaseCommentController(TestCaseBaseRepository):
         comment = self.comment_repository.add_comment(comment)
         self.comment_id = comment.id
 
-        self.comment_dict = asdict(comment)
+        self.comment = comment
         self.comment_updated = asdict(Comment(
             id=self.comment_id, created_date=dt, modified_date=dt, news_id=self.news_id, content='Comment updated content')
         )
@@ -210,7 +675,7 @@ class TestCaseCommentController(TestCaseBaseRepository):
     def test_list_comment(self):
         self.assertEqual(
             self.comment_controller.list_comments(self.palyoad_create, **{'news_pk': self.news_id}),
-            [self.comment_dict]
+            [self.comment]
         )
 
     def test_get_comment(self):
@@ -218,14 +683,14 @@ class TestCaseCommentController(TestCaseBaseRepository):
             self.comment_controller.get_comment(
                 self.palyoad_create, **{'news_pk': self.news_id, 'pk': self.comment_id}
             ),
-            self.comment_dict
+            self.comment
         )
 
     def test_update_comment(self):
         result = self.comment_controller.update_comment(
             self.palyoad_update, **{'news_pk': self.news_id, 'pk': self.comment_id}
         )
-        result_check = {'content': result['content']}
+        result_check = {'content': result.content}
         self.assertEqual(result_check, self.palyoad_update.get_payload())
 
     def test_delete_comment(self):
@@ -234,5 +699,902 @@ class TestCaseCommentController(TestCaseBaseRepository):
 
     def test_add_comment(self):
         result = self.comment_controller.add_comment(self.palyoad_create, **{'news_pk': self.news_id})
-        result_check = {'content': result['content']}
+        result_check = {'content': result.content}
         self.assertEqual(result_check, self.palyoad_create.get_payload())
+
+
+class TestCaseConnectionPool(unittest.TestCase):
+    def setUp(self):
+        self.db_dir = tempfile.TemporaryDirectory()
+        self.db_path = str(Path(self.db_dir.name) / 'news.db')
+        patcher = mock.patch.object(settings, 'DB_PATH', self.db_path)
+        patcher.start()
+        self.addCleanup(patcher.stop)
+        self.addCleanup(self.db_dir.cleanup)
+        self.pool = ConnectionPool(2, timeout=0.01)
+        self.addCleanup(self.pool.close)
+        with self.pool.connection() as conn:
+            with open(Path(__file__).parent.parent / PurePath('db/schema.sql'), 'r') as content_file:
+                conn.executescript(content_file.read())
+            migrate(conn)
+
+    def test_connection_reuse(self):
+        first = self.pool.acquire()
+        second = self.pool.acquire()
+        self.assertIsNot(first, second)
+        with self.assertRaises(RepositoryException):
+            self.pool.acquire()
+        self.pool.release(first)
+        self.assertIs(self.pool.acquire(), first)
+
+    def test_pragmas(self):
+        with self.pool.connection() as conn:
+            self.assertEqual(conn.execute('PRAGMA journal_mode').fetchone()[0], 'wal')
+            self.assertEqual(conn.execute('PRAGMA foreign_keys').fetchone()[0], 1)
+            self.assertEqual(conn.execute('PRAGMA busy_timeout').fetchone()[0], settings.DB_BUSY_TIMEOUT)
+
+    def test_pooled_repository(self):
+        dt = datetime.now()
+        news_repository = NewsRepository(pool=self.pool)
+        comment_repository = CommentRepository(pool=self.pool)
+        news = news_repository.add_news(
+            News(id=None, created_date=dt, modified_date=dt, title='News title', content='News content')
+        )
+        self.assertEqual(news_repository.get_news(news.id), news)
+        with self.assertRaises(ConstraintViolation):
+            comment_repository.add_comment(
+                Comment(id=None, created_date=dt, modified_date=dt, news_id=news.id + 1, content='Comment')
+            )
+
+
+class TestCaseWriteQueue(unittest.TestCase):
+    def setUp(self):
+        self.db_dir = tempfile.TemporaryDirectory()
+        self.addCleanup(self.db_dir.cleanup)
+        self.pool = ConnectionPool(
+            4, factory=lambda: sqlite3.connect(str(Path(self.db_dir.name) / 'news.db'), isolation_level=None,
+                                               check_same_thread=False)
+        )
+        self.addCleanup(self.pool.close)
+        with self.pool.connection() as conn:
+            with open(Path(__file__).parent.parent / PurePath('db/schema.sql'), 'r') as content_file:
+                conn.executescript(content_file.read())
+            migrate(conn)
+            conn.execute('PRAGMA foreign_keys = ON')
+        self.dt = datetime.now()
+
+    def make_news(self, title):
+        return News(id=None, created_date=self.dt, modified_date=self.dt, title=title, content='News content')
+
+    def run_writers(self, *writes):
+        results = [None] * len(writes)
+
+        def run(index):
+            try:
+                results[index] = writes[index]()
+            except Exception as e:
+                results[index] = e
+
+        threads = [threading.Thread(target=run, args=(index,)) for index in range(len(writes))]
+        for thread in threads:
+            thread.start()
+        for thread in threads:
+            thread.join()
+        return results
+
+    def test_group_commit(self):
+        write_queue = WriteQueue(10, 4, pool=self.pool)
+        repository = NewsRepository(pool=self.pool, write_queue=write_queue)
+        results = self.run_writers(*[
+            lambda index=index: repository.add_news(self.make_news(str(index))) for index in range(4)
+        ])
+        self.assertEqual((write_queue.commits, write_queue.writes), (1, 4))
+        self.assertEqual(sorted(news.id for news in results), [1, 2, 3, 4])
+        self.assertEqual(repository.get_news_many([1, 2, 3, 4]), {news.id: news for news in results})
+
+    def test_failed_write(self):
+        write_queue = WriteQueue(10, 2, pool=self.pool)
+        news_repository = NewsRepository(pool=self.pool, write_queue=write_queue)
+        comment_repository = CommentRepository(pool=self.pool, write_queue=write_queue)
+        comment = Comment(id=None, created_date=self.dt, modified_date=self.dt, news_id=100, content='Comment')
+        news, error = self.run_writers(
+            lambda: news_repository.add_news(self.make_news('News title')),
+            lambda: comment_repository.add_comment(comment)
+        )
+        self.assertIsInstance(error, ConstraintViolation)
+        self.assertEqual(news_repository.get_news(news.id), news)
+        self.assertEqual(write_queue.commits, 1)
+
+    def test_max_delay(self):
+        write_queue = WriteQueue(0.01, 100, pool=self.pool)
+        repository = NewsRepository(pool=self.pool, write_queue=write_queue)
+        news = repository.add_news(self.make_news('News title'))
+        self.assertEqual(repository.get_news(news.id), news)
+        self.assertEqual(write_queue.commits, 1)
+        write_queue.flush_due()
+        self.assertEqual(write_queue.commits, 1)
+
+
+class TestCaseWriterThread(unittest.TestCase):
+    def setUp(self):
+        db_dir = tempfile.TemporaryDirectory()
+        self.addCleanup(db_dir.cleanup)
+        patcher = mock.patch.object(settings, 'DB_PATH', str(Path(db_dir.name) / 'news.db'))
+        patcher.start()
+        self.addCleanup(patcher.stop)
+        conn = get_connection()
+        with open(Path(__file__).parent.parent / PurePath('db/schema.sql'), 'r') as content_file:
+            conn.executescript(content_file.read())
+        migrate(conn)
+        conn.close()
+        self.writer = WriterThread(max_writes=2)
+        self.addCleanup(self.writer.close)
+        self.read_pool = ConnectionPool(2, factory=get_read_connection)
+        self.addCleanup(self.read_pool.close)
+        self.news_repository = NewsRepository(write_queue=self.writer, read_pool=self.read_pool)
+        self.dt = datetime.now()
+
+    def make_news(self, title):
+        return News(id=None, created_date=self.dt, modified_date=self.dt, title=title, content='News content')
+
+    def test_writes_and_reads(self):
+        news = self.news_repository.add_news(self.make_news('News title'))
+        news.title = 'Changed'
+        self.news_repository.update_news(news)
+        self.assertEqual(self.news_repository.get_news(news.id), news)
+        self.assertEqual(self.writer.commits, 2)
+        with self.read_pool.connection() as conn:
+            with self.assertRaises(sqlite3.OperationalError):
+                conn.execute('DELETE FROM news')
+
+    def test_failed_write(self):
+        comment_repository = CommentRepository(write_queue=self.writer, read_pool=self.read_pool)
+        comment = Comment(id=None, created_date=self.dt, modified_date=self.dt, news_id=100, content='Comment')
+        with self.assertRaises(ConstraintViolation):
+            comment_repository.add_comment(comment)
+        news = self.news_repository.add_news(self.make_news('News title'))
+        self.assertEqual(self.news_repository.get_news(news.id), news)
+
+    def test_failed_commit(self):
+        def orphan_comment(conn):
+            # a deferred foreign key violation fails the COMMIT rather than the INSERT
+            conn.execute('PRAGMA defer_foreign_keys = ON')
+            conn.execute(
+                "INSERT INTO comment (created_date,modified_date,news_id,content) VALUES(0, 0, 100, 'Comment')"
+            )
+
+        with self.assertRaises(sqlite3.IntegrityError):
+            self.writer.submit(orphan_comment)
+        news = self.news_repository.add_news(self.make_news('News title'))
+        self.assertEqual(self.news_repository.get_news(news.id), news)
+        with self.news_repository.read_connection() as conn:
+            self.assertEqual(conn.execute('SELECT COUNT(*) FROM comment').fetchone(), (0,))
+
+    def test_import(self):
+        lines = [b'{"news": {"title": "Title", "content": "Content"}}', b'{"comment": {"content": "A"}}']
+        stats = import_ndjson(lines, self.news_repository.write, 1)
+        self.assertEqual((stats.news, stats.comments), (1, 1))
+        self.assertEqual(self.writer.commits, 2)
+        comment_repository = CommentRepository(write_queue=self.writer, read_pool=self.read_pool)
+        news = self.news_repository.list_news(1)[0]
+        self.assertEqual([comment.content for comment in comment_repository.get_comments_for_news(news.id, 1)], ['A'])
+
+    def test_reads_during_write(self):
+        news = self.news_repository.add_news(self.make_news('News title'))
+        writing, release = threading.Event(), threading.Event()
+
+        def slow_write(conn):
+            conn.execute("UPDATE news SET title = 'Changed' WHERE id = ?", (news.id,))
+            writing.set()
+            release.wait(5)
+
+        thread = threading.Thread(target=self.writer.submit, args=(slow_write,))
+        thread.start()
+        self.addCleanup(thread.join)
+        self.addCleanup(release.set)
+        writing.wait(5)
+        # the writer holds the write lock, reads go on with the last committed snapshot
+        started = time.monotonic()
+        self.assertEqual(self.news_repository.get_news(news.id).title, 'News title')
+        self.assertLess(time.monotonic() - started, 1)
+        with self.news_repository.read_connection() as conn:
+            self.assertEqual(conn.execute('SELECT title FROM news').fetchone(), ('News title',))
+            release.set()
+            thread.join()
+            # the read transaction keeps the snapshot of its first query until the connection is returned
+            self.assertEqual(conn.execute('SELECT title FROM news').fetchone(), ('News title',))
+        self.assertEqual(self.news_repository.get_news(news.id).title, 'Changed')
+
+
+class TestCaseThreadPoolServer(unittest.TestCase):
+    def setUp(self):
+        self.server = make_server(0, workers=4)
+        self.thread = threading.Thread(target=self.server.serve_forever, args=(0.01,))
+        self.thread.start()
+
+    def tearDown(self):
+        self.server.shutdown()
+        self.thread.join()
+        self.server.server_close()
+
+    def test_concurrent_requests(self):
+        self.assertIsInstance(self.server, ThreadPoolHTTPServer)
+        statuses = []
+
+        def request():
+            conn = http.client.HTTPConnection('127.0.0.1', self.server.server_port)
+            conn.request('GET', '/unknown/')
+            statuses.append(conn.getresponse().status)
+            conn.close()
+
+        threads = [threading.Thread(target=request) for _ in range(8)]
+        for thread in threads:
+            thread.start()
+        for thread in threads:
+            thread.join()
+        self.assertEqual(statuses, [404] * 8)
+
+
+class TestCaseAsyncServer(unittest.TestCase):
+    def setUp(self):
+        self.loop = asyncio.new_event_loop()
+        self.server = AsyncRESTServer(0, workers=2)
+        self.loop.run_until_complete(self.server.start('127.0.0.1'))
+        self.thread = threading.Thread(target=self.loop.run_forever)
+        self.thread.start()
+
+    def tearDown(self):
+        self.loop.call_soon_threadsafe(self.loop.stop)
+        self.thread.join()
+        self.server.close()
+        self.loop.run_until_complete(self.server.server.wait_closed())
+        # let the connection handlers see the clients close
+        self.loop.run_until_complete(asyncio.sleep(0.01))
+        self.loop.close()
+
+    def test_keep_alive_requests(self):
+        conn = http.client.HTTPConnection('127.0.0.1', self.server.port)
+        for _ in range(3):
+            conn.request('GET', '/unknown/')
+            response = conn.getresponse()
+            self.assertEqual(response.status, 404)
+            self.assertEqual(response.read(), b'Route not found')
+        sock = conn.sock
+        conn.request('HEAD', '/unknown/')
+        conn.getresponse().read()
+        self.assertIs(conn.sock, sock)
+        conn.close()
+
+
+class TestCaseBaseServer(TestCaseBaseRepository):
+    workers = 0
+
+    def setUp(self):
+        super().setUp()
+        self.conn.execute('PRAGMA foreign_keys = ON')
+        self.metrics = Metrics()
+        self.news_repository = NewsRepository(connection=self.conn, metrics=self.metrics)
+        self.comment_repository = CommentRepository(connection=self.conn, metrics=self.metrics)
+        routes = build_routes(
+            NewsController(self.news_repository), CommentController(self.comment_repository),
+            TransferController(self.news_repository, self.comment_repository), MetricsController(self.metrics)
+        )
+        handler_class = type(
+            'TestRESTRequestHandler', (RESTRequestHandler,), {'router': Router(routes), 'metrics': self.metrics}
+        )
+        self.server = make_server(0, self.workers, handler_class=handler_class)
+        self.thread = threading.Thread(target=self.server.serve_forever, args=(0.01,))
+        self.thread.start()
+
+    def tearDown(self):
+        self.server.shutdown()
+        self.thread.join()
+        self.server.server_close()
+
+    def connect(self) -> http.client.HTTPConnection:
+        return http.client.HTTPConnection('127.0.0.1', self.server.server_port)
+
+    def request(self, method: str, path: str, body: bytes = None, headers: dict = None):
+        conn = self.connect()
+        conn.request(method, path, body, headers or {})
+        response = conn.getresponse()
+        content = response.read()
+        conn.close()
+        return response, content
+
+    def add_news(self, title='News title', content='News content') -> News:
+        dt = datetime.now()
+        return self.news_repository.add_news(
+            News(id=None, created_date=dt, modified_date=dt, title=title, content=content)
+        )
+
+    def add_comment(self, news: News, content='Comment content') -> Comment:
+        dt = datetime.now()
+        return self.comment_repository.add_comment(
+            Comment(id=None, created_date=dt, modified_date=dt, news_id=news.id, content=content)
+        )
+
+
+class TestCaseConditionalGet(TestCaseBaseServer):
+    def setUp(self):
+        super().setUp()
+        self.news = self.add_news()
+
+    def test_etag(self):
+        response, content = self.request('GET', '/news/{}/'.format(self.news.id))
+        self.assertEqual(response.status, 200)
+        etag = response.getheader('ETag')
+        self.assertTrue(etag.startswith('"'))
+        self.assertIsNotNone(response.getheader('Last-Modified'))
+
+        response, content = self.request('GET', '/news/{}/'.format(self.news.id), headers={'If-None-Match': etag})
+        self.assertEqual(response.status, 304)
+        self.assertEqual(content, b'')
+
+        self.news_repository.update_news(self.news)
+        response, content = self.request('GET', '/news/{}/'.format(self.news.id), headers={'If-None-Match': etag})
+        self.assertEqual(response.status, 200)
+        self.assertNotEqual(response.getheader('ETag'), etag)
+
+    def test_list_etag(self):
+        response, content = self.request('GET', '/news/')
+        etag = response.getheader('ETag')
+        response, content = self.request('GET', '/news/', headers={'If-None-Match': 'W/"x", {}'.format(etag)})
+        self.assertEqual(response.status, 304)
+        self.news_repository.delete_news(self.news)
+        response, content = self.request('GET', '/news/', headers={'If-None-Match': etag})
+        self.assertEqual(response.status, 200)
+        self.assertEqual(content, b'[]')
+
+    def test_if_modified_since(self):
+        # news carry a comment count that changes without their modified_date, comments are date validated
+        comment = self.add_comment(self.news)
+        path = '/news/{}/comments/{}/'.format(self.news.id, comment.id)
+        response, content = self.request('GET', path)
+        last_modified = response.getheader('Last-Modified')
+        response, content = self.request('GET', path, headers={'If-Modified-Since': last_modified})
+        self.assertEqual(response.status, 304)
+        response, content = self.request('GET', path, headers={'If-Modified-Since': 'Thu, 01 Jan 2015 00:00:00 GMT'})
+        self.assertEqual(response.status, 200)
+
+    def test_comment_count(self):
+        path = '/news/{}/'.format(self.news.id)
+        response, content = self.request('GET', path)
+        etag, last_modified = response.getheader('ETag'), response.getheader('Last-Modified')
+        self.assertEqual(json.loads(content.decode())['comment_count'], 0)
+        self.add_comment(self.news)
+        response, content = self.request('GET', path, headers={'If-Modified-Since': last_modified})
+        self.assertEqual(response.status, 200)
+        self.assertEqual(json.loads(content.decode())['comment_count'], 1)
+        response, content = self.request('GET', path, headers={'If-None-Match': etag})
+        self.assertEqual(response.status, 200)
+
+
+class TestCaseCompressedResponse(TestCaseBaseServer):
+    def setUp(self):
+        super().setUp()
+        patcher = mock.patch.object(server, 'compressed_cache', LRUCache(10, 60))
+        self.compressed_cache = patcher.start()
+        self.addCleanup(patcher.stop)
+        self.news = self.add_news(content='News content ' * 200)
+
+    def test_gzip(self):
+        path = '/news/{}/'.format(self.news.id)
+        plain_response, plain = self.request('GET', path)
+        self.assertIsNone(plain_response.getheader('Content-Encoding'))
+        response, content = self.request('GET', path, headers={'Accept-Encoding': 'gzip'})
+        self.assertEqual(response.getheader('Content-Encoding'), 'gzip')
+        self.assertEqual(response.getheader('Vary'), 'Accept-Encoding')
+        self.assertEqual(gzip.decompress(content), plain)
+        self.assertLess(len(content), len(plain))
+        self.assertEqual(response.getheader('ETag'), encoded_etag(plain_response.getheader('ETag'), 'gzip'))
+
+        response, cached = self.request('GET', path, headers={'Accept-Encoding': 'gzip'})
+        self.assertEqual(cached, content)
+        self.assertEqual(self.compressed_cache.hits, 1)
+
+        response, content = self.request(
+            'GET', path, headers={'Accept-Encoding': 'gzip', 'If-None-Match': response.getheader('ETag')}
+        )
+        self.assertEqual(response.status, 304)
+
+    def test_small_body_not_compressed(self):
+        with mock.patch.object(settings, 'COMPRESSION_MIN_SIZE', 1000000):
+            response, content = self.request('GET', '/news/', headers={'Accept-Encoding': 'gzip'})
+        self.assertIsNone(response.getheader('Content-Encoding'))
+        self.assertEqual(json.loads(content.decode())[0]['id'], self.news.id)
+
+
+class TestCaseStreamedList(TestCaseBaseServer):
+    workers = 2
+
+    def setUp(self):
+        super().setUp()
+        for name, value in (('STREAM_PAGE_SIZE', 2), ('STREAM_CHUNK_SIZE', 64)):
+            patcher = mock.patch.object(settings, name, value)
+            patcher.start()
+            self.addCleanup(patcher.stop)
+        self.news = [self.add_news(title='News {}'.format(index)) for index in range(5)]
+
+    def test_chunked(self):
+        conn = self.connect()
+        conn.request('GET', '/news/?limit=3')
+        response = conn.getresponse()
+        content = response.read()
+        self.assertEqual(response.getheader('Transfer-Encoding'), 'chunked')
+        self.assertIsNone(response.getheader('ETag'))
+        self.assertEqual(content.decode(), dumps(self.news[:1:-1]))
+        sock = conn.sock
+        conn.request('GET', re.match('<(.*)>', response.getheader('Link')).group(1))
+        response = conn.getresponse()
+        self.assertEqual(response.read().decode(), dumps(self.news[1::-1]))
+        self.assertIsNone(response.getheader('Link'))
+        self.assertIs(conn.sock, sock)
+        conn.close()
+
+    def test_small_page_not_streamed(self):
+        response, content = self.request('GET', '/news/?limit=2')
+        self.assertIsNone(response.getheader('Transfer-Encoding'))
+        self.assertIsNotNone(response.getheader('ETag'))
+
+    def test_gzip(self):
+        response, content = self.request('GET', '/news/?limit=5', headers={'Accept-Encoding': 'gzip'})
+        self.assertEqual(response.getheader('Content-Encoding'), 'gzip')
+        self.assertEqual(gzip.decompress(content).decode(), dumps(self.news[::-1]))
+
+    def test_comments(self):
+        dt = datetime.now()
+        comments = self.comment_repository.add_comment_many([
+            Comment(id=None, created_date=dt, modified_date=dt, news_id=self.news[0].id, content=str(index))
+            for index in range(3)
+        ])
+        response, content = self.request('GET', '/news/{}/comments/?limit=3'.format(self.news[0].id))
+        self.assertEqual(response.getheader('Transfer-Encoding'), 'chunked')
+        self.assertEqual(content.decode(), dumps(comments[::-1]))
+
+    def test_async_engine(self):
+        loop = asyncio.new_event_loop()
+        async_server = AsyncRESTServer(0, workers=2)
+        loop.run_until_complete(async_server.start('127.0.0.1'))
+        thread = threading.Thread(target=loop.run_forever)
+        thread.start()
+        try:
+            with mock.patch.object(AsyncRESTRequest, 'router', self.server.RequestHandlerClass.router):
+                conn = http.client.HTTPConnection('127.0.0.1', async_server.port)
+                for _ in range(2):
+                    conn.request('GET', '/news/?limit=5')
+                    response = conn.getresponse()
+                    self.assertEqual(response.getheader('Transfer-Encoding'), 'chunked')
+                    self.assertEqual(response.read().decode(), dumps(self.news[::-1]))
+                conn.close()
+        finally:
+            loop.call_soon_threadsafe(loop.stop)
+            thread.join()
+            async_server.close()
+            loop.run_until_complete(async_server.server.wait_closed())
+            # let the connection handler see the client close
+            loop.run_until_complete(asyncio.sleep(0.01))
+            loop.close()
+
+
+class TestCasePersistentConnection(TestCaseBaseServer):
+    workers = 2
+
+    def test_keep_alive(self):
+        news = self.add_news()
+        conn = self.connect()
+        requests = [
+            ('GET', '/news/{}/'.format(news.id), None, 200),
+            ('PUT', '/news/{}/'.format(news.id + 1), b'{"title": "a", "content": "b"}', 404),
+            ('GET', '/news/99999999999999999999999/', None, 404),
+            ('POST', '/unknown/', b'{"content": "b"}', 404),
+            ('PUT', '/news/', b'{}', 405),
+            ('DELETE', '/news/', None, 405),
+            ('HEAD', '/news/', None, 200),
+            ('DELETE', '/news/{}/'.format(news.id), None, 200),
+            ('GET', '/news/', None, 200),
+        ]
+        conn.request('GET', '/news/')
+        conn.getresponse().read()
+        sock = conn.sock
+        for method, path, body, status in requests:
+            conn.request(method, path, body)
+            response = conn.getresponse()
+            response.read()
+            self.assertEqual(response.status, status, (method, path))
+            self.assertIs(conn.sock, sock)
+        conn.close()
+
+    def test_max_requests(self):
+        conn = self.connect()
+        with mock.patch.object(settings, 'KEEP_ALIVE_MAX_REQUESTS', 2):
+            conn.request('GET', '/news/')
+            response = conn.getresponse()
+            response.read()
+            self.assertIsNone(response.getheader('Connection'))
+            conn.request('GET', '/news/')
+            response = conn.getresponse()
+            response.read()
+            self.assertEqual(response.getheader('Connection'), 'close')
+        conn.close()
+
+    def test_idle_connections_do_not_hold_workers(self):
+        idle = []
+        for _ in range(self.workers):
+            conn = self.connect()
+            conn.request('GET', '/news/')
+            conn.getresponse().read()
+            idle.append(conn)
+        started = time.monotonic()
+        response, content = self.request('GET', '/news/')
+        self.assertEqual(response.status, 200)
+        self.assertLess(time.monotonic() - started, 2)
+        for conn in idle:
+            conn.close()
+
+    def test_pipelined_requests(self):
+        sock = socket.create_connection(('127.0.0.1', self.server.server_port))
+        self.addCleanup(sock.close)
+        sock.sendall(b'GET /news/ HTTP/1.1\r\nHost: a\r\n\r\n' * 2)
+        sock.settimeout(5)
+        received = b''
+        while received.count(b'HTTP/1.1 200 OK') < 2:
+            data = sock.recv(65536)
+            self.assertTrue(data)
+            received += data
+
+
+class TestCaseSerialServerConnection(TestCaseBaseServer):
+    def test_connection_close(self):
+        response, content = self.request('GET', '/news/')
+        self.assertEqual(response.getheader('Connection'), 'close')
+        self.assertEqual(int(response.getheader('Content-Length')), len(content))
+
+    def test_method_not_allowed(self):
+        response, content = self.request('DELETE', '/news/')
+        self.assertEqual(response.status, 405)
+        self.assertEqual(response.getheader('Allow'), 'GET, POST, HEAD')
+
+
+class TestCaseBulkEndpoints(TestCaseBaseServer):
+    def request_json(self, method: str, path: str, payload):
+        response, content = self.request(method, path, json.dumps(payload).encode())
+        return response.status, json.loads(content.decode()) if content else None
+
+    def test_bulk_news(self):
+        status, results = self.request_json('POST', '/news/_bulk/', [
+            {'title': 'First', 'content': 'Content'},
+            {'title': 'Second'},
+            'garbage',
+            {'title': 'Third', 'content': 'Content'},
+        ])
+        self.assertEqual(status, 200)
+        self.assertEqual(results, [
+            {'id': 1},
+            {'errors': {'content': 'This field is required'}},
+            {'errors': {'non_field_errors': 'Expected an object'}},
+            {'id': 2},
+        ])
+
+        status, results = self.request_json('PUT', '/news/_bulk/', [
+            {'id': 1, 'title': 'Updated', 'content': 'Updated'},
+            {'id': 7, 'title': 'Updated', 'content': 'Updated'},
+            {'title': 'Updated', 'content': 'Updated'},
+        ])
+        self.assertEqual(results, [
+            {'id': 1},
+            {'id': 7, 'errors': {'id': 'Not found'}},
+            {'errors': {'id': 'This field is required'}},
+        ])
+        self.assertEqual(self.news_repository.get_news(1).title, 'Updated')
+
+        status, results = self.request_json('DELETE', '/news/_bulk/', [2, 7])
+        self.assertEqual(results, [{'id': 2}, {'id': 7, 'errors': {'id': 'Not found'}}])
+        self.assertEqual(list(self.news_repository.get_news_many([1, 2])), [1])
+
+    def test_bulk_comments(self):
+        news = self.add_news()
+        other_news = self.add_news()
+        path = '/news/{}/comments/_bulk/'.format(news.id)
+        status, results = self.request_json('POST', path, [{'content': 'First'}, {'content': ''}])
+        self.assertEqual(results, [{'id': 1}, {'errors': {'content': 'This field is required'}}])
+        status, results = self.request_json(
+            'POST', '/news/{}/comments/_bulk/'.format(other_news.id), [{'content': 'Other'}]
+        )
+        status, results = self.request_json('PUT', path, [{'id': 1, 'content': 'Updated'}, {'id': 2, 'content': 'x'}])
+        self.assertEqual(results, [{'id': 1}, {'id': 2, 'errors': {'id': 'Not found'}}])
+        self.assertEqual(self.comment_repository.get_comment(1).content, 'Updated')
+
+        response, content = self.request('POST', '/news/99/comments/_bulk/', b'[{"content": "First"}]')
+        self.assertEqual(response.status, 404)
+
+    def test_bulk_limit(self):
+        with mock.patch.object(settings, 'BULK_MAX_ITEMS', 1):
+            response, content = self.request('POST', '/news/_bulk/', b'[{}, {}]')
+        self.assertEqual(response.status, 400)
+
+    def test_bulk_invalid_payload(self):
+        for method in ('POST', 'PUT', 'DELETE'):
+            for payload, error in ((b'{"id": 1}', 'Expected a list'), (b'[{"id": 1}', 'Invalid JSON')):
+                response, content = self.request(method, '/news/_bulk/', payload)
+                self.assertEqual(response.status, 400, (method, payload))
+                self.assertEqual(json.loads(content.decode()), {'non_field_errors': error})
+
+
+class TestCaseTransferEndpoints(TestCaseBaseServer):
+    def test_export_empty_database(self):
+        response, content = self.request('GET', '/export')
+        self.assertEqual(response.status, 200)
+        self.assertEqual(content, b'')
+
+    def test_export_import(self):
+        news = self.add_news()
+        response, content = self.request('GET', '/export')
+        self.assertEqual(response.getheader('Content-type'), 'application/x-ndjson')
+        self.assertEqual(response.getheader('Transfer-Encoding'), 'chunked')
+        self.assertEqual(content.decode(), '{{"news": {}}}\n'.format(dumps(news)))
+
+        payload = b'{"news": {"title": "Imported", "content": "Content"}}\n{"comment": {"content": "Comment"}}\n'
+        response, content = self.request('POST', '/import?batch_size=1', payload)
+        self.assertEqual(response.status, 200)
+        result = json.loads(content.decode())
+        self.assertEqual((result['news'], result['comments']), (1, 1))
+        self.assertIn('rows_per_second', result)
+        self.assertEqual(self.news_repository.list_news(1)[0].title, 'Imported')
+
+        response, content = self.request('POST', '/import', b'garbage\n')
+        self.assertEqual(response.status, 400)
+        self.assertEqual(json.loads(content.decode())['line'], 1)
+
+
+class TestCaseSearchEndpoint(TestCaseBaseServer):
+    def test_search(self):
+        for content in ('Rain', 'Rain and rain', 'Rain rain rain', 'Sun'):
+            self.add_news(content=content)
+        response, content = self.request('GET', '/news/search?q=rain&limit=2')
+        hits = json.loads(content.decode())
+        self.assertEqual([hit['content'] for hit in hits], ['Rain rain rain', 'Rain and rain'])
+        self.assertEqual(hits[0]['snippet'], '<mark>Rain</mark> <mark>rain</mark> <mark>rain</mark>')
+        link = re.match('<(.*)>', response.getheader('Link')).group(1)
+        self.assertIn('q=rain', link)
+        response, content = self.request('GET', link)
+        self.assertEqual([hit['content'] for hit in json.loads(content.decode())], ['Rain'])
+        self.assertIsNone(response.getheader('Link'))
+
+        response, content = self.request('GET', '/news/search/?q=%20')
+        self.assertEqual(response.status, 400)
+
+
+class TestCaseCompoundDocument(TestCaseBaseServer):
+    def test_include_comments(self):
+        news = self.add_news()
+        comments = [self.add_comment(news, content=str(index)) for index in range(3)]
+        response, content = self.request('GET', '/news/{}/?include=comments&comments_limit=2'.format(news.id))
+        document = json.loads(content.decode())
+        self.assertEqual(document['title'], news.title)
+        self.assertEqual(document['comment_count'], 3)
+        self.assertEqual(document['comments'], json.loads(dumps(comments[:0:-1])))
+
+        etag = response.getheader('ETag')
+        self.comment_repository.update_comment(comments[2])
+        response, content = self.request(
+            'GET', '/news/{}/?include=comments&comments_limit=2'.format(news.id), headers={'If-None-Match': etag}
+        )
+        self.assertEqual(response.status, 200)
+
+        response, content = self.request('GET', '/news/{}/?include=author'.format(news.id))
+        self.assertEqual(response.status, 400)
+
+
+class TestCaseMetricsEndpoint(TestCaseBaseServer):
+    def test_metrics(self):
+        news = self.add_news()
+        self.request('GET', '/news/')
+        self.request('GET', '/news/{}/'.format(news.id))
+        with mock.patch.object(self.news_repository, 'get_news', side_effect=RuntimeError), \
+                self.assertLogs('news_restapi.server', 'ERROR'):
+            response, content = self.request('GET', '/news/{}/'.format(news.id))
+        self.assertEqual(response.status, 500)
+
+        response, content = self.request('GET', '/metrics')
+        self.assertEqual(response.status, 200)
+        self.assertTrue(response.getheader('Content-type').startswith('text/plain'))
+        lines = content.decode().splitlines()
+        self.assertIn('news_http_requests_total{route="^/news/$",method="GET",status="200"} 1', lines)
+        labels = 'route="^/news/(?P<pk>\\\\d+)/$",method="GET"'
+        self.assertIn('news_http_requests_total{{{},status="200"}} 1'.format(labels), lines)
+        self.assertIn('news_http_requests_total{{{},status="500"}} 1'.format(labels), lines)
+        self.assertIn('news_http_request_duration_seconds_count{{{}}} 2'.format(labels), lines)
+        self.assertIn('news_db_query_duration_seconds_count{table="news",query="add"} 1', lines)
+        self.assertIn('news_db_query_duration_seconds_count{table="news",query="list"} 1', lines)
+
+
+class TestCaseProfiling(TestCaseBaseServer):
+    def setUp(self):
+        super().setUp()
+        self.profile_dir = tempfile.TemporaryDirectory()
+        self.addCleanup(self.profile_dir.cleanup)
+        self.profiler = RequestProfiler(every=2, secret='secret', directory=self.profile_dir.name, top=10)
+        self.server.RequestHandlerClass.profiler = self.profiler
+
+    def test_sampled_requests(self):
+        self.add_news()
+        for _ in range(3):
+            response, content = self.request('GET', '/news/')
+            self.assertEqual(len(json.loads(content.decode())), 1)
+        self.assertEqual(self.profiler.profiled, 1)
+        profiles = list(Path(self.profile_dir.name).glob('request-*-GET-news.pstats'))
+        self.assertEqual(len(profiles), 1)
+
+    def test_requested_profile(self):
+        response, content = self.request('GET', '/news/', headers={'X-Profile': 'wrong'})
+        self.assertEqual(json.loads(content.decode()), [])
+        response, content = self.request('GET', '/news/', headers={'X-Profile': 'secret'})
+        self.assertEqual(response.status, 200)
+        self.assertEqual(response.getheader('X-Profile-Status'), '200')
+        self.assertIn('list_news', content.decode())
+        self.assertTrue(Path(response.getheader('X-Profile-File')).exists())
+
+    def test_stack_sampler(self):
+        event = threading.Event()
+        thread = threading.Thread(target=event.wait)
+        thread.start()
+        sampler = StackSampler(0.02, 0.005, self.profile_dir.name)
+        path = sampler.run()
+        event.set()
+        thread.join()
+        with open(path) as folded_file:
+            lines = folded_file.read().splitlines()
+        self.assertTrue(any(line.split(' ')[0].endswith('threading.py:wait') for line in lines))
+
+
+class TestCaseTrafficRecording(TestCaseBaseServer):
+    def setUp(self):
+        super().setUp()
+        self.record_dir = tempfile.TemporaryDirectory()
+        self.addCleanup(self.record_dir.cleanup)
+        self.record_path = str(Path(self.record_dir.name) / 'requests.jsonl')
+
+    def read_records(self) -> list:
+        with open(self.record_path) as record_file:
+            return [json.loads(line) for line in record_file]
+
+    def test_record_requests(self):
+        recorder = TrafficRecorder(self.record_path)
+        self.server.RequestHandlerClass.recorder = recorder
+        body = json.dumps({'title': 'News title', 'content': 'News content'}).encode()
+        self.request('POST', '/news/', body)
+        response, content = self.request('GET', '/news/?limit=1')
+        # requests are recorded once their response is written, let the server finish the last one
+        self.server.shutdown()
+        recorder.close()
+        post, get = self.read_records()
+        self.assertEqual(
+            (post['method'], post['path'], post['body'], post['status']), ('POST', '/news/', body.decode(), 200)
+        )
+        self.assertEqual((get['method'], get['path'], get['body'], get['status']), ('GET', '/news/?limit=1', None, 200))
+        self.assertEqual(get['size'], len(content))
+        self.assertGreater(get['latency_ms'], 0)
+
+    def test_sampling(self):
+        recorder = TrafficRecorder(self.record_path, sample_rate=0.5, rng=mock.Mock(random=mock.Mock(
+            side_effect=[0.1, 0.7, 0.3, 0.9]
+        )))
+        for index in range(4):
+            recorder.record('GET', '/news/{}/'.format(index), None, 200, 10, 0.001)
+        recorder.close()
+        self.assertEqual([record['path'] for record in self.read_records()], ['/news/0/', '/news/2/'])
+
+
+class TestCaseAdmissionControl(unittest.TestCase):
+    def setUp(self):
+        self.now = 0.0
+
+    def test_rate_limit(self):
+        admission = AdmissionControl(rate=2, burst=2, clock=lambda: self.now)
+        self.assertIsNone(admission.admit('a'))
+        self.assertIsNone(admission.admit('a'))
+        self.assertEqual(admission.admit('a'), (429, 1, 'rate_limited'))
+        self.assertIsNone(admission.admit('b'))
+        self.now += 0.5
+        self.assertIsNone(admission.admit('a'))
+        self.assertEqual(admission.shed['rate_limited'], 1)
+
+    def test_in_flight_limit(self):
+        admission = AdmissionControl(max_in_flight=1, retry_after=3)
+        self.assertIsNone(admission.admit('a'))
+        self.assertEqual(admission.admit('b'), (503, 3, 'overload'))
+        admission.release()
+        self.assertIsNone(admission.admit('b'))
+        self.assertEqual(admission.shed['overload'], 1)
+
+
+class TestCaseAdmissionEndpoint(TestCaseBaseServer):
+    def test_shed_requests(self):
+        self.server.RequestHandlerClass.admission = AdmissionControl(rate=0.1, burst=1)
+        response, content = self.request('GET', '/news/')
+        self.assertEqual(response.status, 200)
+        response, content = self.request('POST', '/news/', b'{"title": "News title", "content": "News content"}')
+        self.assertEqual(response.status, 429)
+        self.assertEqual(response.getheader('Retry-After'), '10')
+        self.assertEqual(response.getheader('Connection'), 'close')
+        self.assertEqual(self.news_repository.list_news(10), [])
+        self.assertIn('news_http_shed_total{reason="rate_limited"} 1', self.metrics.render().splitlines())
+
+    def test_shed_pending_connections(self):
+        server = ThreadPoolHTTPServer(('127.0.0.1', 0), self.server.RequestHandlerClass, 1, max_pending=1)
+        self.addCleanup(server.server_close)
+        server.pending = 1
+        client, accepted = socket.socketpair()
+        server.process_request(accepted, ('127.0.0.1', 0))
+        self.assertTrue(client.recv(1024).startswith(b'HTTP/1.1 503 Service Unavailable\r\nRetry-After: '))
+        client.close()
+        self.assertEqual(server.shed, 1)
+        self.assertIn('news_http_shed_total{reason="pending"} 1', self.metrics.render().splitlines())
+
+
+class TestCaseMultiProcess(unittest.TestCase):
+    def setUp(self):
+        self.db_dir = tempfile.TemporaryDirectory()
+        self.addCleanup(self.db_dir.cleanup)
+        self.conn = self.connect()
+        with open(Path(__file__).parent.parent / PurePath('db/schema.sql'), 'r') as content_file:
+            self.conn.executescript(content_file.read())
+        migrate(self.conn)
+        self.dt = datetime.now()
+
+    def connect(self):
+        conn = sqlite3.connect(str(Path(self.db_dir.name) / 'news.db'), isolation_level=None, check_same_thread=False)
+        self.addCleanup(conn.close)
+        return conn
+
+    def test_data_version_watcher(self):
+        cache = LRUCache(100, 60)
+        repository = NewsRepository(connection=self.conn, cache=cache)
+        # another process writes through a connection of its own
+        other = NewsRepository(connection=self.connect())
+        news = other.add_news(News(id=None, created_date=self.dt, modified_date=self.dt, title='Old', content='C'))
+        watcher = DataVersionWatcher(cache, factory=self.connect)
+        self.assertFalse(watcher.check())
+        self.assertEqual(repository.get_news(news.id).title, 'Old')
+        news.title = 'New'
+        other.update_news(news)
+        self.assertEqual(repository.get_news(news.id).title, 'Old')
+        self.assertTrue(watcher.check())
+        self.assertEqual(repository.get_news(news.id).title, 'New')
+        self.assertFalse(watcher.check())
+        self.assertEqual(watcher.clears, 1)
+
+    def test_reuse_port(self):
+        first = make_server(0, reuse_port=True)
+        self.addCleanup(first.server_close)
+        second = make_server(first.server_port, reuse_port=True)
+        self.addCleanup(second.server_close)
+        self.assertEqual(second.server_port, first.server_port)
+
+    def test_supervisor_restarts_workers(self):
+        starts = Path(self.db_dir.name) / 'starts'
+        crashed = Path(self.db_dir.name) / 'crashed'
+
+        def serve():
+            with open(str(starts), 'a') as starts_file:
+                starts_file.write('{}\n'.format(os.getpid()))
+            try:
+                # the first worker to start crashes
+                os.close(os.open(str(crashed), os.O_CREAT | os.O_EXCL))
+            except FileExistsError:
+                time.sleep(60)
+            else:
+                os._exit(3)
+
+        supervisor = Supervisor(serve, 2, drain_timeout=5, restart_delay=0.05, poll_interval=0.01)
+        timer = threading.Timer(1, supervisor.stop)
+        timer.start()
+        started = time.monotonic()
+        supervisor.run()
+        timer.join()
+        # the stopped workers died of SIGTERM rather than waiting for drain_timeout
+        self.assertLess(time.monotonic() - started, 5)
+        self.assertEqual(supervisor.restarted, 1)
+        self.assertEqual(len(starts.read_text().splitlines()), 3)
+        self.assertEqual(supervisor.workers, {})
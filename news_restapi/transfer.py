@@ -0,0 +1,206 @@
+import json
+import time
+from dataclasses import fields
+from datetime import datetime
+from typing import Any, Callable, Iterable, Iterator, Optional, Tuple
+
+from news_restapi import exceptions
+from news_restapi.models import News, Comment
+from news_restapi.repositories import NewsRepository, CommentRepository, ConstraintViolation, transaction
+from news_restapi.serializers import dumps
+
+# NDJSON records are {"news": {...}} or {"comment": {...}}, a news is followed by its comments
+RECORD_TYPES = {
+    'news': News,
+    'comment': Comment,
+}
+
+
+class TransferStats:
+    """
+    Rows exported or imported so far, and the throughput
+    """
+    def __init__(self, clock=time.monotonic):
+        self.clock = clock
+        self.started = clock()
+        self.news = 0
+        self.comments = 0
+
+    @property
+    def rows(self) -> int:
+        return self.news + self.comments
+
+    @property
+    def seconds(self) -> float:
+        return self.clock() - self.started
+
+    @property
+    def rows_per_second(self) -> float:
+        seconds = self.seconds
+        return self.rows / seconds if seconds > 0 else 0.0
+
+    def as_dict(self) -> dict:
+        return {
+            'news': self.news,
+            'comments': self.comments,
+            'seconds': round(self.seconds, 3),
+            'rows_per_second': round(self.rows_per_second),
+        }
+
+    def __str__(self):
+        return '{} news and {} comments in {:.1f}s, {:.0f} rows/s'.format(
+            self.news, self.comments, self.seconds, self.rows_per_second
+        )
+
+
+class NDJSONStream:
+    """
+    Response content written line by line, iterating it consumes the underlying generator
+    """
+    def __init__(self, lines: Iterator[str]):
+        self.lines = lines
+
+    def __iter__(self) -> Iterator[str]:
+        return self.lines
+
+    def close(self) -> None:
+        close = getattr(self.lines, 'close', None)
+        if close is not None:
+            close()
+
+
+def export_ndjson(conn, stats: TransferStats = None) -> Iterator[str]:
+    """
+    Yields every news followed by its comments as NDJSON lines. News and comments are read by
+    two cursors in id order and merged, in one read transaction so both see the same snapshot.
+    :param conn: connection in autocommit mode, kept busy until the generator is exhausted or closed
+    :param stats: counts the exported rows
+    :return: generator of lines
+    """
+    stats = stats or TransferStats()
+    news_repository = NewsRepository(connection=conn)
+    comment_repository = CommentRepository(connection=conn)
+    own_transaction = not conn.in_transaction
+    if own_transaction:
+        conn.execute('BEGIN')
+    comments = comment_repository.iter_all_comments()
+    try:
+        comment = next(comments, None)
+        for news in news_repository.iter_all_news():
+            yield '{"news": ' + dumps(news) + '}\n'
+            stats.news += 1
+            # foreign keys keep comments from pointing at missing news, smaller news ids are skipped anyway
+            while comment is not None and comment.news_id <= news.id:
+                if comment.news_id == news.id:
+                    yield '{"comment": ' + dumps(comment) + '}\n'
+                    stats.comments += 1
+                comment = next(comments, None)
+    finally:
+        comments.close()
+        if own_transaction:
+            conn.execute('COMMIT')
+
+
+def parse_record(line: bytes) -> Tuple[Optional[Any], dict]:
+    """
+    Reads a model object from an NDJSON line. Fields missing from a record are left None,
+    the importer fills them in.
+    :param line:
+    :return: News or Comment (None for a blank line) and errors by field
+    """
+    if not line.strip():
+        return None, {}
+    try:
+        record = json.loads(line.decode())
+    except ValueError:
+        record = None
+    if not isinstance(record, dict) or len(record) != 1 or next(iter(record)) not in RECORD_TYPES \
+            or not isinstance(next(iter(record.values())), dict):
+        return None, {'non_field_errors': 'Expected {"news": {...}} or {"comment": {...}}'}
+    (record_type, data), = record.items()
+    model = RECORD_TYPES[record_type]
+    values, errors = {}, {}
+    for field in fields(model):
+        value = data.get(field.name)
+        if value is None:
+            values[field.name] = None
+        elif field.type is datetime and isinstance(value, str):
+            try:
+                values[field.name] = datetime.fromisoformat(value)
+            except ValueError:
+                errors[field.name] = 'Invalid date'
+        elif isinstance(value, field.type) and not isinstance(value, bool):
+            values[field.name] = value
+        else:
+            errors[field.name] = 'Invalid value'
+    return (None if errors else model(**values)), errors
+
+
+def import_error(line_number: int, errors: dict, stats: TransferStats) -> exceptions.ValidationError:
+    """
+    An import error tells where the import stopped and what was committed before
+    :param line_number:
+    :param errors: errors by field
+    :param stats:
+    :return: error to raise
+    """
+    return exceptions.ValidationError(json.dumps({'line': line_number, 'errors': errors, 'imported': stats.as_dict()}))
+
+
+def import_ndjson(lines: Iterable[bytes], write: Callable[[Callable[[Any], Any]], Any], batch_size: int,
+                  stats: TransferStats = None) -> TransferStats:
+    """
+    Inserts news and comments from NDJSON lines as export_ndjson writes them, committing every
+    batch_size rows. Records keep their ids, a record without one gets a new id. A comment without
+    a news_id belongs to the news before it. On an error the batches committed before it are kept.
+    :param lines: iterable of lines, e.g. a file opened in binary mode
+    :param write: runs a write on a connection in autocommit mode, e.g. Repository.write
+    :param batch_size: rows per transaction
+    :param stats: counts the committed rows
+    :return: stats
+    """
+    stats = stats or TransferStats()
+    news_batch, comment_batch, first_line = [], [], 1
+    # comments without a news_id, with the news they follow
+    parents = []
+    news = None
+
+    def import_batch(conn):
+        with transaction(conn):
+            NewsRepository(connection=conn).import_many(news_batch)
+            for comment, parent in parents:
+                comment.news_id = parent.id
+            CommentRepository(connection=conn).import_many(comment_batch)
+
+    def flush():
+        try:
+            write(import_batch)
+        except ConstraintViolation as e:
+            raise import_error(first_line, {'non_field_errors': 'Batch rejected: {}'.format(e)}, stats)
+        stats.news += len(news_batch)
+        stats.comments += len(comment_batch)
+
+    for line_number, line in enumerate(lines, start=1):
+        obj, errors = parse_record(line)
+        if errors:
+            raise import_error(line_number, errors, stats)
+        if obj is None:
+            continue
+        now = datetime.now()
+        obj.created_date = obj.created_date or now
+        obj.modified_date = obj.modified_date or obj.created_date
+        if isinstance(obj, News):
+            news = obj
+            news_batch.append(obj)
+        else:
+            if obj.news_id is None:
+                if news is None:
+                    raise import_error(line_number, {'news_id': 'This field is required'}, stats)
+                parents.append((obj, news))
+            comment_batch.append(obj)
+        if len(news_batch) + len(comment_batch) >= batch_size:
+            flush()
+            news_batch, comment_batch, parents, first_line = [], [], [], line_number + 1
+    if news_batch or comment_batch:
+        flush()
+    return stats
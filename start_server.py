@@ -1,8 +1,32 @@
+import argparse
+import functools
+
+from news_restapi import settings
+from news_restapi.async_server import async_rest_server
+from news_restapi.migrations import migrate_database
 from news_restapi.server import rest_server
+from news_restapi.supervisor import Supervisor
+
+engines = {
+    'http': rest_server,
+    'asyncio': async_rest_server,
+}
 
 
 def start_server():
-    rest_server(8080)
+    parser = argparse.ArgumentParser(description='News REST API server')
+    parser.add_argument('--port', type=int, default=8080)
+    parser.add_argument('--engine', choices=sorted(engines), default=settings.SERVER_ENGINE)
+    parser.add_argument('--workers', type=int, default=settings.SERVER_WORKERS)
+    parser.add_argument('--processes', type=int, default=settings.SERVER_PROCESSES)
+    args = parser.parse_args()
+    if args.processes > 1:
+        # migrated before forking, so that the workers find nothing left to apply
+        migrate_database()
+        serve = functools.partial(engines[args.engine], args.port, args.workers, reuse_port=True)
+        Supervisor(serve, args.processes, settings.SERVER_DRAIN_TIMEOUT).run()
+    else:
+        engines[args.engine](args.port, args.workers)
 
 
 if __name__ == '__main__':